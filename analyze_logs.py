@@ -0,0 +1,180 @@
+import argparse, json, os, sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from logsink import parse_record, read_binary_log, EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+
+EVENT_NAMES = {EVENT_RECEIVED: "received", EVENT_SENT: "sent", EVENT_INTERNAL: "internal"}
+DAY = 24 * 3600
+
+
+# Streaming statistics for one machine's log. Memory is bounded by the number of distinct
+# clock jumps, queue sizes and wall-clock seconds, not by the number of lines
+class LogStats():
+    def __init__(self, path):
+        self.path = path
+        self.run, self.machine = run_and_machine(path)
+        self.events = Counter()
+        self.jumps = Counter() # logical clock increase between consecutive cycles -> count
+        self.queue_sizes = Counter() # queue size after a received message -> count
+        self.clock_at = {} # wall-clock second -> logical clock at the end of that second
+        self.first = self.last = None # first and last wall-clock second
+        self.clock = 0
+        self.day = 0 # days added to times of day that wrapped around midnight
+
+    # Adds one record, given its time as seconds since midnight
+    def add(self, event, second, clock, queue_depth):
+        second += self.day
+        if self.last is not None and second < self.last - DAY // 2: # the log crossed midnight
+            self.day += DAY
+            second += DAY
+        if self.first is None:
+            self.first = second
+        self.last = second
+        self.events[event] += 1
+        if event == EVENT_RECEIVED:
+            self.queue_sizes[queue_depth] += 1
+        if clock != self.clock: # the extra lines of a broadcast repeat the same clock
+            self.jumps[clock - self.clock] += 1
+            self.clock = clock
+        self.clock_at[second] = clock
+
+    # Wall-clock seconds covered by the log, counting partial first and last seconds as whole
+    def duration(self):
+        return 0 if self.first is None else self.last - self.first + 1
+
+    def summary(self):
+        duration = self.duration() or 1
+        return {
+            "machine": self.machine,
+            "events": {EVENT_NAMES[e]: self.events[e] for e in EVENT_NAMES},
+            "rates_per_second": {EVENT_NAMES[e]: round(self.events[e] / duration, 3) for e in EVENT_NAMES},
+            "final_clock": self.clock,
+            "jumps": distribution(self.jumps),
+            "queue_size": distribution(self.queue_sizes),
+        }
+
+
+# Splits a log path into the run it belongs to and the machine's port, e.g.
+# base_logs/base1_log11113.txt -> ("base_logs/base1", "11113") and runs/log11113.txt -> ("runs", "11113")
+def run_and_machine(path):
+    directory, name = os.path.split(path)
+    prefix, _, machine = os.path.splitext(name)[0].rpartition("log")
+    prefix = prefix.rstrip("_")
+    return (os.path.join(directory, prefix) if prefix else directory or "."), machine
+
+
+# Streams one log file (text, or binary as written by LogSink), or one machine's columnar table
+# (see columnar.py), into a LogStats
+def analyze_file(path):
+    stats = LogStats(path)
+    if path.endswith(".cols"):
+        from columnar import load # columnar.py builds on this module
+        table = load(path)
+        for event, time_ns, clock, queue_depth in zip(table["event"], table["time_ns"], table["clock"], table["queue"]):
+            stats.add(int(event), int(time_ns) // 10**9 % DAY, int(clock), int(queue_depth))
+    elif path.endswith(".bin"):
+        for event, wall_ns, clock, queue_depth in read_binary_log(path):
+            stats.add(event, wall_ns // 10**9 % DAY, clock, queue_depth) # UTC seconds; only differences matter
+    else:
+        with open(path, errors="replace") as f:
+            for line in f:
+                record = parse_record(line)
+                if record is not None:
+                    stats.add(*record)
+    return stats
+
+
+# Returns count, mean, max and percentiles of a histogram given as value -> count
+def distribution(histogram, percentiles=(50, 90, 99)):
+    total = sum(histogram.values())
+    if not total:
+        return {"count": 0}
+    result = {"count": total, "mean": round(sum(v * c for v, c in histogram.items()) / total, 3), "max": max(histogram)}
+    values = sorted(histogram)
+    for p in percentiles:
+        target, seen = p / 100 * total, 0
+        for value in values:
+            seen += histogram[value]
+            if seen >= target:
+                result[f"p{p}"] = value
+                break
+    return result
+
+
+# Computes, for every wall-clock second during which all machines of a run were logging, the
+# spread (max - min) of their logical clocks at the end of that second. Each machine's clock is
+# carried forward through seconds in which it logged nothing
+def drift(machines):
+    machines = [m for m in machines if m.first is not None]
+    if len(machines) < 2:
+        return Counter()
+    start, end = max(m.first for m in machines), min(m.last for m in machines)
+    current = {m.machine: 0 for m in machines}
+    for m in machines: # clocks at the start of the aligned window
+        current[m.machine] = max((clock for second, clock in m.clock_at.items() if second <= start), default=0)
+    spreads = Counter()
+    for second in range(start, end + 1):
+        for m in machines:
+            clock = m.clock_at.get(second)
+            if clock is not None:
+                current[m.machine] = clock
+        values = current.values()
+        spreads[max(values) - min(values)] += 1
+    return spreads
+
+
+# Expands directories into the log files they contain
+def find_logs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith((".txt", ".bin", ".cols")) and "log" in name:
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+# Analyzes all logs, one file per worker process, and groups the results by run
+def analyze(paths, workers=None):
+    files = list(find_logs(paths))
+    if workers == 1 or len(files) == 1:
+        stats = list(map(analyze_file, files))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            stats = list(pool.map(analyze_file, files))
+    runs = defaultdict(list)
+    for s in stats:
+        runs[s.run].append(s)
+    return {run: {"machines": [m.summary() for m in machines], "drift": distribution(drift(machines))} for run, machines in sorted(runs.items())}
+
+
+def _format(name, dist):
+    if not dist["count"]:
+        return f"{name}: none"
+    return f"{name}: " + ", ".join(f"{key} {value}" for key, value in dist.items())
+
+
+def print_report(report, out=sys.stdout):
+    for run, result in report.items():
+        print(f"== {run}", file=out)
+        for m in result["machines"]:
+            rates = ", ".join(f"{name} {rate}/s" for name, rate in m["rates_per_second"].items())
+            print(f"  machine {m['machine']}: final clock {m['final_clock']}, {rates}", file=out)
+            print("    " + _format("clock jumps", m["jumps"]), file=out)
+            print("    " + _format("queue size", m["queue_size"]), file=out)
+        print("  " + _format("clock drift between machines", result["drift"]), file=out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Analyze machine logs: clock jumps, drift, queue sizes and event rates")
+    parser.add_argument("paths", nargs="+", help="log files or directories of log files")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = analyze(args.paths, args.workers)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report)
@@ -0,0 +1,78 @@
+import unittest
+import io
+import os
+import tempfile
+from collections import Counter
+from datetime import datetime
+import analyze_logs
+import logsink
+
+class TestAnalyzeLogs(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, name, lines):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+        return path
+
+    def test_run_and_machine(self):
+        self.assertEqual((os.path.join("base_logs", "base1"), "11113"), analyze_logs.run_and_machine(os.path.join("base_logs", "base1_log11113.txt")))
+        self.assertEqual(("runs", "11113"), analyze_logs.run_and_machine(os.path.join("runs", "log11113.txt")))
+        self.assertEqual((".", "11113"), analyze_logs.run_and_machine("log11113.bin"))
+
+    def test_distribution(self):
+        self.assertEqual({"count": 0}, analyze_logs.distribution(Counter()))
+        self.assertEqual({"count": 10, "mean": 1.9, "max": 10, "p50": 1, "p90": 1, "p99": 10}, analyze_logs.distribution(Counter({1: 9, 10: 1})))
+
+    def test_analyze_file(self):
+        path = self.write("x_log1.txt", [
+            "Internal event: system time 23:59:59, logical clock time 1",
+            "Sent a message: system time 23:59:59, logical clock time 2",
+            "Sent a message: system time 23:59:59, logical clock time 2",
+            "Received a message: system time 00:00:00, logical clock time 9, remaining message queue size 3",
+            "Received a message: system time 00:00:01, logical clock time 10, remaining message queue size 2",
+        ])
+        stats = analyze_logs.analyze_file(path)
+        self.assertEqual(Counter({1: 3, 7: 1}), stats.jumps)
+        self.assertEqual(Counter({3: 1, 2: 1}), stats.queue_sizes)
+        self.assertEqual(3, stats.duration())
+        summary = stats.summary()
+        self.assertEqual({"received": 2, "sent": 2, "internal": 1}, summary["events"])
+        self.assertEqual(10, summary["final_clock"])
+
+    def test_binary_log_matches_text(self):
+        wall_ns = int(datetime(2023, 3, 1, 10, 0, 0).timestamp()) * 10**9
+        with logsink.LogSink(os.path.join(self.dir.name, "log7.bin"), binary=True) as sink:
+            for clock in range(1, 6):
+                sink.record(logsink.EVENT_INTERNAL, clock, wall_ns=wall_ns + clock * 10**9)
+        stats = analyze_logs.analyze_file(os.path.join(self.dir.name, "log7.bin"))
+        self.assertEqual(Counter({1: 5}), stats.jumps)
+        self.assertEqual(5, stats.duration())
+
+    def test_drift_over_aligned_seconds(self):
+        self.write("r_log1.txt", ["Internal event: system time 10:00:00, logical clock time 1",
+                                  "Internal event: system time 10:00:01, logical clock time 2",
+                                  "Internal event: system time 10:00:02, logical clock time 3"])
+        self.write("r_log2.txt", ["Internal event: system time 10:00:01, logical clock time 5",
+                                  "Received a message: system time 10:00:03, logical clock time 9, remaining message queue size 0"])
+        report = analyze_logs.analyze([self.dir.name], workers=2)
+        run = report[os.path.join(self.dir.name, "r")]
+        self.assertEqual(["1", "2"], [m["machine"] for m in run["machines"]])
+        # seconds 10:00:01 and 10:00:02, where both machines were logging: spreads 3 and 2
+        self.assertEqual({"count": 2, "mean": 2.5, "max": 3, "p50": 2, "p90": 3, "p99": 3}, run["drift"])
+
+    def test_repository_logs(self):
+        report = analyze_logs.analyze([os.path.join(os.path.dirname(os.path.abspath(__file__)), "base_logs")], workers=1)
+        self.assertEqual(5, len(report))
+        self.assertTrue(all(len(run["machines"]) == 3 for run in report.values()))
+        out = io.StringIO()
+        analyze_logs.print_report(report, out)
+        self.assertIn("clock drift between machines", out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import asyncio
+from machine import Client, peer_address, tune
+from logsink import LogSink
+from message_queue import MessageQueue, OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST
+from framing import FRAMED_MAGIC
+from clocks import CLOCK_LAMPORT, needs_frames, new_decoder
+from scheduler import TickScheduler
+from metrics import MachineMetrics, MetricsServer
+
+
+# Gives Client the same sendall interface as a blocking socket on top of an asyncio stream
+class StreamLink():
+    def __init__(self, writer):
+        self.writer = writer
+
+    def sendall(self, data):
+        self.writer.write(bytes(data)) # the transport may keep what it cannot send yet, and senders reuse their buffers
+
+
+# asyncio implementation of Machine: the "server" and "client" components run as tasks on one
+# event loop instead of two threads, so a single process can host many machines. It runs the
+# same Client logic and writes the same log files as the threaded Machine
+class AsyncMachine():
+    def __init__(self, config, log_options=None, queue_size=None, overflow=OVERFLOW_BLOCK, client_options=None, connect_timeout=30, metrics_port=None):
+        self.messages = MessageQueue(queue_size, overflow) # message queue containing other machines' timestamps
+        self.config = config # network config of the form [host, listening port, port to connect to, ...]
+        self.log_options = log_options or {}
+        self.client_options = client_options or {}
+        self.connect_timeout = connect_timeout
+        self.metrics_port = metrics_port
+        self.metrics = MachineMetrics(config[1], self.messages) if metrics_port is not None else None
+        self.metrics_server = None
+        self.server = None
+        self.client = None
+        self.writers = []
+
+    # Starts listening so that other machines can connect
+    async def listen(self):
+        self.server = await asyncio.start_server(self._service_connection, self.config[0], self.config[1])
+        if self.metrics is not None:
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_port).start()
+
+    # Receives timestamps from one connected machine until it disconnects. A full queue cannot
+    # block the event loop, so instead we stop reading from the machine until the client catches up
+    async def _service_connection(self, reader, writer):
+        decoder = new_decoder()
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                while self.messages.full() and self.messages.overflow != OVERFLOW_DROP_OLDEST:
+                    await asyncio.sleep(1 / self.client.tick if self.client else 0.01)
+                data = await reader.read(65536)
+                if not data:
+                    break
+                times = decoder.feed(data)
+                if self.metrics is not None:
+                    self.metrics.add_received(peer, len(times))
+                if self.messages.overflow == OVERFLOW_DROP_OLDEST:
+                    self.messages.put_many(times)
+                else:
+                    self.messages.extend(times)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Connects to every other machine, retrying until each one is listening instead of sleeping blindly
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.connect_timeout
+        framed = self.client_options.get("framed", False) or needs_frames(self.client_options.get("clock_mode", CLOCK_LAMPORT), self.client_options.get("message_ids", False))
+
+        async def connect_to(peer):
+            host, port = peer_address(self.config, peer)
+            host = host or "127.0.0.1" # like socket.connect, treat an empty host as this machine
+            delay = 0.001
+            while True:
+                try:
+                    reader, writer = await asyncio.open_connection(host, port)
+                    break
+                except OSError: # not listening yet, or its host cannot be reached yet
+                    if loop.time() + delay > deadline:
+                        raise
+                    await asyncio.sleep(delay)
+                    delay = min(2 * delay, 0.1)
+            tune(writer.get_extra_info("socket"))
+            if framed:
+                writer.write(FRAMED_MAGIC)
+            return peer, writer
+
+        links = await asyncio.gather(*(connect_to(peer) for peer in self.config[2:]))
+        self.writers = [writer for _, writer in links]
+        connections = {port: StreamLink(writer) for port, writer in links}
+        log = LogSink.for_machine(self.config[1], **self.log_options)
+        self.client = Client(self.config, self.messages, log, connections=connections, metrics=self.metrics, **self.client_options)
+
+    # Runs clock cycles at the machine's tick rate, against absolute deadlines on the loop clock
+    async def run_clock(self, duration=None):
+        loop = asyncio.get_running_loop()
+        scheduler = self.client.scheduler = TickScheduler(self.client.tick, self.client.schedule_policy, clock=loop.time)
+        scheduler.begin()
+        try:
+            while duration is None or scheduler.cycles < duration * self.client.tick:
+                start = loop.time()
+                self.client.step()
+                for writer in self.writers:
+                    await writer.drain() # returns immediately unless a peer has stopped reading
+                delay = scheduler.next_delay()
+                if self.metrics is not None:
+                    self.metrics.cycle_duration.observe(loop.time() - start)
+                    self.metrics.sleep_slack.observe(delay)
+                await asyncio.sleep(delay)
+        finally: # as Client.run: flush the log, wait for the last snapshot and report both
+            self.client.log.close()
+            self.client.report_schedule()
+            if self.client.checkpointer is not None:
+                self.client.checkpointer.close()
+                self.client.report_checkpoints()
+
+    # Closes the listening socket and all connections to other machines
+    async def close(self):
+        for writer in self.writers:
+            writer.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def run(self, duration=None):
+        await self.listen()
+        await self.connect()
+        try:
+            await self.run_clock(duration)
+        finally:
+            await self.close()
+
+
+# Runs several machines on the current event loop. All machines start listening before any of
+# them connects, so startup only takes as long as the connections themselves
+async def run_machines(machines, duration=None):
+    await asyncio.gather(*(m.listen() for m in machines))
+    await asyncio.gather(*(m.connect() for m in machines))
+    try:
+        await asyncio.gather(*(m.run_clock(duration) for m in machines))
+    finally:
+        await asyncio.gather(*(m.close() for m in machines))
+
+
+if __name__ == '__main__':
+    port1, port2, port3 = 11113, 22224, 33335 # listening ports for each of the 3 machines
+
+    # Same 3-machine setup as machine.py, but hosted as tasks of a single process
+    configs = [["", port1, port2, port3], ["", port2, port1, port3], ["", port3, port1, port2]]
+    asyncio.run(run_machines([AsyncMachine(config) for config in configs]))
@@ -0,0 +1,84 @@
+import unittest
+import asyncio
+import io
+import os
+import re
+import socket
+import tempfile
+import time
+import async_machine
+from contextlib import redirect_stdout
+from checkpoint import checkpoint_path
+
+LINE = re.compile(r"(Received a message|Sent a message|Internal event): system time \d\d:\d\d:\d\d, logical clock time (\d+)(, remaining message queue size \d+)?\n")
+
+# Returns n currently unused TCP ports on localhost
+def free_ports(n):
+    socks = [socket.socket() for _ in range(n)]
+    for sock in socks:
+        sock.bind(("127.0.0.1", 0))
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+class TestAsyncMachine(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_three_machines_exchange_messages(self):
+        p1, p2, p3 = free_ports(3)
+        configs = [["127.0.0.1", p1, p2, p3], ["127.0.0.1", p2, p1, p3], ["127.0.0.1", p3, p1, p2]]
+        machines = [async_machine.AsyncMachine(config, log_options={"directory": self.dir.name}) for config in configs]
+        start = time.monotonic()
+        asyncio.run(async_machine.run_machines(machines, duration=1.5))
+        self.assertLess(time.monotonic() - start, 4)
+
+        received = 0
+        for port in (p1, p2, p3):
+            with open(os.path.join(self.dir.name, f"log{port}.txt")) as f:
+                lines = f.readlines()
+            clocks = []
+            for line in lines:
+                match = LINE.fullmatch(line)
+                self.assertIsNotNone(match, line)
+                clocks.append(int(match.group(2)))
+                received += match.group(1) == "Received a message"
+            self.assertEqual(sorted(clocks), clocks)
+        sent = sum(1 for port in (p1, p2, p3) for line in open(os.path.join(self.dir.name, f"log{port}.txt")) if line.startswith("Sent"))
+        self.assertLessEqual(received, sent)
+
+    def test_checkpointer_closed_on_shutdown(self):
+        p1, p2 = free_ports(2)
+        options = {"checkpoint_dir": self.dir.name, "checkpoint_every": 1, "tick_range": (20, 20)}
+        machines = [async_machine.AsyncMachine(config, log_options={"directory": self.dir.name}, client_options=options) for config in (["127.0.0.1", p1, p2], ["127.0.0.1", p2, p1])]
+        with redirect_stdout(io.StringIO()) as out:
+            asyncio.run(async_machine.run_machines(machines, duration=0.5))
+        for machine in machines:
+            self.assertFalse(machine.client.checkpointer.writer.is_alive())
+            self.assertIsNone(machine.client.checkpointer.pending) # the last snapshot was written
+            self.assertIn(f"Machine {machine.config[1]} took ", out.getvalue())
+            self.assertTrue(os.path.exists(checkpoint_path(machine.config[1], self.dir.name)))
+
+    def test_connect_waits_for_late_peer(self):
+        p1, p2 = free_ports(2)
+        early = async_machine.AsyncMachine(["127.0.0.1", p1, p2], log_options={"directory": self.dir.name})
+        late = async_machine.AsyncMachine(["127.0.0.1", p2, p1], log_options={"directory": self.dir.name})
+
+        async def scenario():
+            await early.listen()
+            connecting = asyncio.create_task(early.connect())
+            await asyncio.sleep(0.2)
+            self.assertFalse(connecting.done())
+            await late.listen()
+            await asyncio.wait_for(connecting, 2)
+            await late.connect()
+            await early.close()
+            await late.close()
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import argparse, io, json, os, socket, tempfile, threading, time
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from bench_transport import LatencyRecorder
+from logsink import LogSink
+from machine import Client, Server
+from message_queue import MessageQueue
+from metrics import MachineMetrics
+
+PERCENTILES = (50, 90, 99)
+BARRIER_TIMEOUT = 60 # seconds machines wait for each other, so that one that fails to start does not hang the others
+
+
+# Returns the p-th percentile of the sorted values
+def percentile(values, p):
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+# Sender process of a link benchmark: a real Client connected to port sends n messages through
+# Client.write_message, one every interval seconds (as fast as it can if interval is 0). Each
+# message's Lamport stamp is set to the send time, time.perf_counter_ns() in microseconds, so the
+# receiver can tell how long it took; that clock is shared by every process on Linux
+def _send(peer, n, interval, directory, results):
+    with redirect_stdout(io.StringIO()):
+        client = Client(["127.0.0.1", 0, peer], MessageQueue(), LogSink.for_machine(0, directory, binary=True))
+    cpu, due = 0.0, time.perf_counter()
+    for _ in range(n):
+        if interval:
+            due += interval
+            while time.perf_counter() < due:
+                pass
+        start = time.process_time() # only the sends count, not the pacing
+        client.logical_clock = (time.perf_counter_ns() // 1000 - 1) & 0xFFFFFFFF # write_message increments it once
+        client.write_message(client.peers)
+        cpu += time.process_time() - start
+    results.put(cpu)
+    client.log.close()
+    time.sleep(0.1)
+
+
+# Sends n messages over one localhost link from a Client in another process into a Server in this
+# one, listening on host, and returns the link's throughput (messages enqueued per second), one-way
+# latency from write_message to enqueue in microseconds, and CPU time per message on both ends
+def link(n=20000, interval=0.0, host="127.0.0.1"):
+    recorder = LatencyRecorder()
+    recorder.expected = n
+    server = Server([host, 0], recorder)
+    port = server.lsock.getsockname()[1]
+    threading.Thread(target=server.run, daemon=True).start()
+    context = get_context("spawn")
+    results = context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        sender = context.Process(target=_send, args=(f"{host}:{port}", n, interval, directory, results))
+        sender.start()
+        start = time.process_time()
+        recorder.done.wait(60 + n * interval)
+        receiver_cpu = time.process_time() - start
+        sender_cpu = results.get(timeout=60)
+        sender.join()
+    latencies = sorted(recorder.latencies)
+    result = {"host": host, "interval_s": interval, "messages": len(latencies),
+              "messages_per_second": round(len(latencies) / (recorder.last - recorder.first)) if len(latencies) > 1 else 0}
+    result.update({f"p{p}_us": percentile(latencies, p) for p in PERCENTILES})
+    result.update({"max_us": latencies[-1], "sender_cpu_us_per_message": round(sender_cpu / n * 1e6, 2),
+                   "receiver_cpu_us_per_message": round(receiver_cpu / n * 1e6, 2)})
+    return result
+
+
+# One machine of a cluster benchmark, in its own process: it times listening, connecting to every
+# peer and accepting every peer's connection, then runs clock cycles at tick rate tick for duration
+# seconds and reports its event count and the CPU time both of its threads used meanwhile
+def _run_machine(config, tick, duration, directory, barrier, results):
+    messages = MessageQueue()
+    metrics = MachineMetrics(config[1], messages)
+    start = time.perf_counter()
+    server = Server(config, messages, metrics)
+    listen = time.perf_counter() - start
+    threading.Thread(target=server.run, daemon=True).start()
+    barrier.wait(BARRIER_TIMEOUT) # every machine is listening
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        client = Client(config, messages, LogSink.for_machine(config[1], directory, binary=True), tick_range=(tick, tick), metrics=metrics)
+    connect = time.perf_counter() - start
+    while len(server.sel.get_map()) <= len(client.peers): # the listening socket plus one connection per peer
+        time.sleep(0.0005)
+    accept = time.perf_counter() - start
+    barrier.wait(BARRIER_TIMEOUT) # every link is up
+    cpu = time.process_time()
+    client._scheduler().begin()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        client._perform_clock_cycle()
+    cpu = time.process_time() - cpu
+    client.log.close()
+    results.put({"listen_s": listen, "connect_s": connect, "accept_s": accept, "cpu_s": cpu,
+                 "cycles": client.cycles, "events": sum(metrics.events), "received": sum(metrics.received.values())})
+    barrier.wait(BARRIER_TIMEOUT) # keep every server up until all machines stop sending
+
+
+# Returns n ports that are free right now, so that benchmarks do not clash with whatever else
+# (e.g. another benchmark) listens on this host
+def free_ports(n):
+    socks = [socket.socket() for _ in range(n)]
+    for sock in socks:
+        sock.bind(("127.0.0.1", 0))
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+
+# Returns full mesh configs for machines listening on ports, all on 127.0.0.1, or spread
+# round-robin over the addresses in hosts and connecting to each other as "host:port"
+def mesh(ports, hosts=None):
+    if not hosts:
+        return [["127.0.0.1", port] + [peer for peer in ports if peer != port] for port in ports]
+    host = {port: hosts[i % len(hosts)] for i, port in enumerate(ports)}
+    return [[host[port], port] + [f"{host[peer]}:{peer}" for peer in ports if peer != port] for port in ports]
+
+
+# Runs a full mesh of real machines on free localhost ports, each ticking at tick, and returns the
+# slowest machine's startup times, the cluster's achieved tick rate and its CPU time per logged
+# event (clock cycles plus the extra sends of broadcasts)
+def cluster(machines=3, tick=10, duration=5.0, hosts=None):
+    configs = mesh(free_ports(machines), hosts)
+    context = get_context("spawn")
+    barrier, results = context.Barrier(machines), context.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        processes = [context.Process(target=_run_machine, args=(config, tick, duration, directory, barrier, results), daemon=True) for config in configs]
+        for p in processes:
+            p.start()
+        stats = [results.get(timeout=120 + duration) for _ in processes]
+        for p in processes:
+            p.join()
+    events = sum(s["events"] for s in stats)
+    return {"machines": machines, "hosts": len(hosts or [None]), "tick": tick, "duration_s": duration,
+            "listen_ms": round(max(s["listen_s"] for s in stats) * 1e3, 2),
+            "connect_ms": round(max(s["connect_s"] for s in stats) * 1e3, 2),
+            "accept_ms": round(max(s["accept_s"] for s in stats) * 1e3, 2),
+            "achieved_tick": round(sum(s["cycles"] for s in stats) / machines / duration, 2),
+            "events": events, "received": sum(s["received"] for s in stats),
+            "cpu_us_per_event": round(sum(s["cpu_s"] for s in stats) / events * 1e6, 2) if events else 0}
+
+
+# One machine of a startup benchmark: it starts listening and connects to its peers, which start
+# at about the same time, retrying until they listen, and reports how long it took until it had
+# connected to and been connected by every peer
+def _start_machine(config, barrier, results):
+    start = time.perf_counter()
+    messages = MessageQueue()
+    server = Server(config, messages)
+    threading.Thread(target=server.run, daemon=True).start()
+    with redirect_stdout(io.StringIO()):
+        client = Client(config, messages, log=LogSink(os.devnull))
+    while len(server.sel.get_map()) <= len(client.peers):
+        time.sleep(0.0005)
+    results.put(time.perf_counter() - start)
+    barrier.wait(BARRIER_TIMEOUT) # keep every server up until all links are up
+
+
+# Starts a full mesh of machines without waiting for each other first, as Machine.run does, and
+# returns the slowest and mean time from a machine starting until all its links were up
+def startup(machines=3, hosts=None):
+    configs = mesh(free_ports(machines), hosts)
+    context = get_context("spawn")
+    barrier, results = context.Barrier(machines), context.Queue()
+    processes = [context.Process(target=_start_machine, args=(config, barrier, results), daemon=True) for config in configs]
+    for p in processes:
+        p.start()
+    times = [results.get(timeout=120) for _ in processes]
+    for p in processes:
+        p.join()
+    return {"machines": machines, "hosts": len(hosts or [None]), "max_ms": round(max(times) * 1e3, 2), "mean_ms": round(sum(times) / machines * 1e3, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark real machines on localhost: link throughput and latency, startup time, and CPU per event by tick rate and machine count")
+    parser.add_argument("-n", "--messages", type=int, default=20000, help="messages per link benchmark")
+    parser.add_argument("--intervals", type=float, nargs="+", default=[0.0, 0.0002], help="seconds between messages of each link benchmark, 0 for as fast as possible")
+    parser.add_argument("--machines", type=int, nargs="+", default=[3, 8])
+    parser.add_argument("--ticks", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds each cluster runs for")
+    parser.add_argument("--hosts", nargs="+", default=None, help="also run every benchmark with machines spread over these local addresses, e.g. 127.0.0.2 127.0.0.3")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("-o", "--output", default=None, help="also write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    layouts = [None] + ([args.hosts] if args.hosts else [])
+    results = {"cpus": os.cpu_count(),
+               "links": [link(args.messages, interval, hosts[-1] if hosts else "127.0.0.1") for hosts in layouts for interval in args.intervals],
+               "startups": [startup(machines, hosts) for hosts in layouts for machines in args.machines],
+               "clusters": [cluster(machines, tick, args.duration, hosts) for hosts in layouts for machines in args.machines for tick in args.ticks]}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print(f"{'host':>10} {'interval s':>10} {'msgs/s':>8} {'p50 us':>7} {'p90 us':>7} {'p99 us':>7} {'max us':>7} {'send cpu us':>11} {'recv cpu us':>11}")
+    for r in results["links"]:
+        print(f"{r['host']:>10} {r['interval_s']:10} {r['messages_per_second']:8} {r['p50_us']:7} {r['p90_us']:7} {r['p99_us']:7} {r['max_us']:7} "
+              f"{r['sender_cpu_us_per_message']:11} {r['receiver_cpu_us_per_message']:11}")
+    print()
+    print(f"{'machines':>8} {'hosts':>5} {'max startup ms':>14} {'mean startup ms':>15}")
+    for r in results["startups"]:
+        print(f"{r['machines']:8} {r['hosts']:5} {r['max_ms']:14} {r['mean_ms']:15}")
+    print()
+    print(f"{'machines':>8} {'hosts':>5} {'tick':>5} {'listen ms':>9} {'connect ms':>10} {'accept ms':>9} {'ticks/s':>8} {'events':>7} {'cpu us/event':>12}")
+    for r in results["clusters"]:
+        print(f"{r['machines']:8} {r['hosts']:5} {r['tick']:5} {r['listen_ms']:9} {r['connect_ms']:10} {r['accept_ms']:9} {r['achieved_tick']:8} {r['events']:7} {r['cpu_us_per_event']:12}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
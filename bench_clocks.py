@@ -0,0 +1,100 @@
+import argparse, io, json, tempfile, time
+from contextlib import redirect_stdout
+from clocks import CLOCK_MODES, make_clock, new_decoder
+from cluster import make_configs, TOPOLOGIES
+from framing import FRAMED_MAGIC
+from simulation import Simulation
+
+
+# Measures the cost of the clock itself: CPU time per send event (local tick, stamp, encode) and
+# per receive event (decode, merge) for one machine exchanging messages with machines - 1 peers
+# whose clocks keep advancing, so that vector stamps carry realistic numbers of changed entries
+def clock_cost(mode, machines, events=20000):
+    now = [time.time_ns()]
+    wall_clock = lambda: now[0]
+    peers = [make_clock(mode, 1 + i, wall_clock) for i in range(machines)]
+    clock = peers[0]
+    encoder, decoder = clock.encoder(True), new_decoder()
+    decoder.feed(FRAMED_MAGIC)
+    incoming = []
+    for i in range(events): # stamps from a random-ish peer that has merged with others along the way
+        peer = peers[1 + i % (machines - 1)]
+        peer.local()
+        peers[1 + (i * 7) % (machines - 1)].merge(peer.stamp())
+        incoming.append(peer.stamp())
+        now[0] += 100_000
+    encoded_in = [peers[0].encoder(True).encode([stamp]) for stamp in incoming]
+
+    start = time.process_time()
+    sent_bytes = 0
+    for _ in range(events):
+        clock.local()
+        sent_bytes += len(encoder.encode([clock.stamp()]))
+        clock.scalar()
+    send_cost = (time.process_time() - start) / events
+
+    start = time.process_time()
+    for data in encoded_in:
+        for stamp in decoder.feed(data):
+            clock.merge(stamp)
+        clock.scalar()
+    receive_cost = (time.process_time() - start) / events
+    return send_cost, receive_cost
+
+
+# Counts the stamps passed to an encoder, so that wire bytes can be reported per message
+class _CountingEncoder():
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.messages = 0
+
+    def encode(self, stamps):
+        self.messages += len(stamps)
+        return self.encoder.encode(stamps)
+
+
+# Runs a simulated cluster and returns the mean CPU time per machine cycle and the mean bytes
+# on the wire per message, including frame headers
+def cluster_cost(mode, machines, topology, duration, seed=0):
+    with tempfile.TemporaryDirectory() as directory, redirect_stdout(io.StringIO()):
+        sim = Simulation(make_configs(machines, topology, seed=seed), seed, latency=0.01,
+                         log_options={"directory": directory, "binary": True}, client_options={"clock_mode": mode})
+        encoders = []
+        for client in sim.clients:
+            client.encoders = {port: _CountingEncoder(encoder) for port, encoder in client.encoders.items()}
+            encoders.extend(client.encoders.values())
+        start = time.process_time()
+        sim.run(duration)
+        elapsed = time.process_time() - start
+    cycles = sum(client.cycles for client in sim.clients)
+    wire = sum(link.bytes_sent for client in sim.clients for link in client.connections.values())
+    messages = sum(encoder.messages for encoder in encoders)
+    return elapsed / cycles, wire / messages if messages else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare CPU cost and wire size of the logical clock modes")
+    parser.add_argument("--machines", type=int, nargs="+", default=[3, 16, 64])
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="mesh")
+    parser.add_argument("--duration", type=float, default=60, help="virtual seconds to simulate per cluster")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for machines in args.machines:
+        for mode in CLOCK_MODES:
+            send_cost, receive_cost = clock_cost(mode, machines)
+            cycle_cost, message_bytes = cluster_cost(mode, machines, args.topology, args.duration)
+            results.append({"mode": mode, "machines": machines, "send_us": round(send_cost * 1e6, 2), "receive_us": round(receive_cost * 1e6, 2),
+                            "cycle_us": round(cycle_cost * 1e6, 2), "bytes_per_message": round(message_bytes, 2)})
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print(f"{'mode':8} {'machines':>8} {'send us':>8} {'recv us':>8} {'cycle us':>9} {'bytes/msg':>9}")
+    for r in results:
+        print(f"{r['mode']:8} {r['machines']:8} {r['send_us']:8} {r['receive_us']:8} {r['cycle_us']:9} {r['bytes_per_message']:9}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
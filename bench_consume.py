@@ -0,0 +1,56 @@
+import argparse, io, json, os, tempfile, time
+from contextlib import redirect_stdout
+from cluster import make_configs
+from machine import CONSUME_ONE, CONSUME_BATCH, CONSUME_DRAIN, LOG_EACH, LOG_SUMMARY
+from simulation import Simulation
+from sweep import summarize_log
+
+
+# Simulates a full mesh whose machines tick at the given rates for duration virtual seconds with
+# one consumption policy, and returns per machine its largest and final queue size and the mean
+# and largest logical clock jump between cycles, plus the CPU time per clock cycle of the whole run
+def run(consume, ticks=(1, 3, 6), duration=600.0, batch=4, log_received=LOG_SUMMARY, seed=0):
+    configs = make_configs(len(ticks), "mesh", host="127.0.0.1")
+    options = {"consume": consume, "consume_batch": batch, "log_received": log_received}
+    with tempfile.TemporaryDirectory() as directory, redirect_stdout(io.StringIO()):
+        sim = Simulation(configs, seed, log_options={"directory": directory}, client_options=options)
+        for client, tick in zip(sim.clients, ticks):
+            client.tick = tick
+        start = time.process_time()
+        sim.run(duration)
+        cpu = time.process_time() - start
+        rows = []
+        for client in sim.clients:
+            summary = summarize_log(os.path.join(directory, f"log{client.config[1]}.txt"), duration)
+            rows.append({"consume": consume if consume != CONSUME_BATCH else f"batch{batch}", "machine": client.config[1], "tick": client.tick,
+                         "max_queue": summary["max_queue"], "final_queue": len(client.messages),
+                         "mean_jump": summary["mean_jump"], "max_jump": summary["max_jump"]})
+    cycle_us = round(cpu / sum(client.cycles for client in sim.clients) * 1e6, 2)
+    for row in rows:
+        row["cycle_us"] = cycle_us
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare queue growth, clock jumps and cycle cost of the message consumption policies")
+    parser.add_argument("--ticks", type=int, nargs="+", default=[1, 3, 6], help="tick rate of each machine")
+    parser.add_argument("--duration", type=float, default=600, help="virtual seconds to simulate")
+    parser.add_argument("--batch", type=int, default=4, help="messages per cycle of the batch policy")
+    parser.add_argument("--log-received", choices=(LOG_EACH, LOG_SUMMARY), default=LOG_SUMMARY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [row for consume in (CONSUME_ONE, CONSUME_BATCH, CONSUME_DRAIN)
+               for row in run(consume, args.ticks, args.duration, args.batch, args.log_received, args.seed)]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print(f"{'consume':8} {'machine':>7} {'tick':>4} {'max queue':>9} {'final queue':>11} {'mean jump':>9} {'max jump':>8} {'cycle us':>8}")
+    for r in results:
+        print(f"{r['consume']:8} {r['machine']:7} {r['tick']:4} {r['max_queue']:9} {r['final_queue']:11} {r['mean_jump']:9} {r['max_jump']:8} {r['cycle_us']:8}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
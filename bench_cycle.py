@@ -0,0 +1,57 @@
+import argparse, io, json, os, random, tempfile, time
+from contextlib import redirect_stdout
+from logsink import LogSink
+from machine import Client
+from message_queue import MessageQueue
+
+
+# Connection that discards what is sent, so that only the client's own work is measured
+class NullLink():
+    def sendall(self, data):
+        pass
+
+
+# Runs cycles clock cycles of one client with peers peers, its log in directory, and returns
+# cycles per second of CPU time. Every incoming_every-th cycle finds a message in the queue
+def run_cycles(cycles, peers=2, binary=False, incoming_every=3, directory=".", seed=0):
+    config = ["127.0.0.1", 10000] + [10001 + i for i in range(peers)]
+    messages = MessageQueue()
+    with redirect_stdout(io.StringIO()):
+        client = Client(config, messages, LogSink.for_machine(10000, directory, binary=binary),
+                        connections={port: NullLink() for port in config[2:]}, rng=random.Random(seed))
+    start = time.process_time()
+    for i in range(cycles):
+        if i % incoming_every == 0:
+            messages.put(i)
+        client.step()
+    elapsed = time.process_time() - start
+    client.log.close()
+    return cycles / elapsed, (cycles + incoming_every - 1) // incoming_every
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure clock cycles per second of CPU time of a single client")
+    parser.add_argument("-n", "--cycles", type=int, default=200000)
+    parser.add_argument("--peers", type=int, nargs="+", default=[2])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per log format; the best is reported")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for peers in args.peers:
+            for binary in (False, True):
+                rate = max(run_cycles(args.cycles, peers, binary, directory=directory)[0] for _ in range(args.repeat))
+                results.append({"log": "binary" if binary else "text", "peers": peers, "cycles_per_second": round(rate)})
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    for r in results:
+        print(f"{r['log']:6} log, {r['peers']} peers: {r['cycles_per_second']} cycles/s")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse, io, json, tempfile, threading, time, tracemalloc
+from contextlib import redirect_stdout
+from bench import free_ports, percentile
+from flow import FLOW_POLICIES, DEFAULT_WINDOW
+from logsink import LogSink
+from machine import Client, Server
+from message_queue import MessageQueue
+
+
+# Runs one sender that sends send_rate messages per second to a receiver whose client consumes
+# consume_rate per second, for duration seconds, with flow control policy (None for none). Each
+# stamp is the send time in ms, so the receiver can tell how stale every message it consumes is.
+# Returns peak and final queue lengths on both sides, peak traced memory and staleness percentiles
+def run(policy, duration=30.0, send_rate=200, consume_rate=20, window=DEFAULT_WINDOW):
+    with tempfile.TemporaryDirectory() as directory:
+        return _run(policy, duration, send_rate, consume_rate, window, directory)
+
+
+def _run(policy, duration, send_rate, consume_rate, window, directory):
+    port, = free_ports(1)
+    messages = MessageQueue()
+    server = Server(["127.0.0.1", port], messages)
+    threading.Thread(target=server.run, daemon=True).start()
+    with redirect_stdout(io.StringIO()):
+        client = Client(["127.0.0.1", 0, port], MessageQueue(), LogSink.for_machine(port, directory, binary=True), flow=policy, flow_window=window)
+    staleness, peaks, stop = [], {"queue": 0, "pending": 0}, threading.Event()
+
+    def consume():
+        while not stop.wait(1 / consume_rate):
+            peaks["queue"] = max(peaks["queue"], len(messages))
+            if messages:
+                staleness.append(int(time.monotonic() * 1000) - messages.pop())
+
+    tracemalloc.start()
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = due = time.monotonic()
+    while due < start + duration:
+        due += 1 / send_rate
+        time.sleep(max(0.0, due - time.monotonic()))
+        client.logical_clock = int(time.monotonic() * 1000) - 1 # write_message increments it once
+        if client.flow is not None:
+            client.release_flow()
+        client.write_message(client.peers)
+        if client.flow is not None:
+            peaks["pending"] = max(peaks["pending"], len(client.flow[port].pending))
+    stop.set()
+    consumer.join()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    control = client.flow[port] if client.flow is not None else None
+    client.connections[port].close()
+    client.log.close()
+    staleness.sort()
+    return {"policy": policy or "none", "sent": round(duration * send_rate), "consumed": len(staleness),
+            "dropped": control.dropped if control else 0, "coalesced": control.coalesced if control else 0,
+            "peak_queue": peaks["queue"], "final_queue": len(messages), "peak_pending": peaks["pending"],
+            "final_pending": len(control.pending) if control else 0, "peak_memory_kib": round(peak_memory / 1024),
+            "p50_staleness_ms": percentile(staleness, 50), "p99_staleness_ms": percentile(staleness, 99)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare queue growth, memory and message staleness of a fast sender and a slow receiver with and without flow control")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per policy")
+    parser.add_argument("--send-rate", type=int, default=200, help="messages per second the sender sends")
+    parser.add_argument("--consume-rate", type=int, default=20, help="messages per second the receiver consumes")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [run(policy, args.duration, args.send_rate, args.consume_rate, args.window) for policy in (None,) + FLOW_POLICIES]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print(f"{'policy':8} {'sent':>6} {'consumed':>8} {'dropped':>7} {'coalesced':>9} {'peak queue':>10} {'peak pending':>12} {'peak KiB':>8} {'p50 ms':>7} {'p99 ms':>7}")
+    for r in results:
+        print(f"{r['policy']:8} {r['sent']:6} {r['consumed']:8} {r['dropped']:7} {r['coalesced']:9} {r['peak_queue']:10} {r['peak_pending']:12} "
+              f"{r['peak_memory_kib']:8} {r['p50_staleness_ms']:7} {r['p99_staleness_ms']:7}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
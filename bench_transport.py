@@ -0,0 +1,92 @@
+import argparse, json, socket, threading, time
+from multiprocessing import get_context
+from framing import FRAMED_MAGIC, encode_timestamps
+from machine import Server
+from shm_transport import ShmLink
+
+TRANSPORTS = ("tcp", "shm")
+
+
+# Stands in for a machine's message queue, recording how long each message took from its
+# sender to being enqueued. Messages are the sender's time.perf_counter_ns() in microseconds,
+# which is the same clock in every process on Linux
+class LatencyRecorder():
+    overflow = "block"
+
+    def __init__(self):
+        self.latencies = []
+        self.done = threading.Event()
+        self.expected = None
+        self.first = self.last = None # perf_counter() when the first and the latest messages were enqueued
+
+    def put_many(self, stamps):
+        now = time.perf_counter_ns()
+        self.last = now / 1e9
+        if self.first is None:
+            self.first = self.last
+        now = now // 1000 & 0xFFFFFFFF
+        self.latencies.extend((now - stamp) & 0xFFFFFFFF for stamp in stamps)
+        if self.expected is not None and len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def full(self):
+        return False
+
+    def __len__(self):
+        return 0
+
+
+# Sends n single-message writes to port over the given transport, one every interval seconds,
+# like a machine sending one message per clock cycle
+def _send(port, transport, n, interval):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(FRAMED_MAGIC)
+    link = ShmLink(sock) if transport == "shm" else sock
+    due = time.perf_counter()
+    for _ in range(n):
+        due += interval
+        while time.perf_counter() < due:
+            pass
+        link.sendall(encode_timestamps([time.perf_counter_ns() // 1000 & 0xFFFFFFFF], framed=True))
+    time.sleep(0.1)
+    link.close()
+
+
+# Returns latency percentiles in microseconds for n messages over transport into a Server
+def measure(transport, n=5000, interval=0.0005, ring_spin=None):
+    recorder = LatencyRecorder()
+    recorder.expected = n
+    server = Server(["127.0.0.1", 0], recorder, **({} if ring_spin is None else {"ring_spin": ring_spin}))
+    port = server.lsock.getsockname()[1]
+    threading.Thread(target=server.run, daemon=True).start()
+    start = time.process_time()
+    sender = get_context("spawn").Process(target=_send, args=(port, transport, n, interval))
+    sender.start()
+    recorder.done.wait(60 + n * interval)
+    sender.join()
+    cpu = time.process_time() - start
+    latencies = sorted(recorder.latencies)
+    return {"transport": transport, "messages": len(latencies), "p50_us": latencies[len(latencies) // 2],
+            "p99_us": latencies[len(latencies) * 99 // 100], "max_us": latencies[-1], "receiver_cpu_us_per_message": round(cpu / n * 1e6, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-message latency of TCP and shared memory links between two processes")
+    parser.add_argument("-n", "--messages", type=int, default=5000)
+    parser.add_argument("--interval", type=float, default=0.0005, help="seconds between messages")
+    parser.add_argument("--spin", type=float, default=None, help="seconds the server polls shared memory before sleeping (default: machine.DEFAULT_RING_SPIN)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [measure(transport, args.messages, args.interval, args.spin) for transport in TRANSPORTS]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print(f"{'transport':9} {'messages':>8} {'p50 us':>7} {'p99 us':>7} {'max us':>7} {'recv cpu us/msg':>15}")
+    for r in results:
+        print(f"{r['transport']:9} {r['messages']:8} {r['p50_us']:7} {r['p99_us']:7} {r['max_us']:7} {r['receiver_cpu_us_per_message']:15}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
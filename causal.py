@@ -0,0 +1,179 @@
+import argparse, heapq, pickle
+from array import array
+from bisect import bisect_right
+from analyze_logs import find_logs, run_and_machine
+from logsink import parse_record, parse_message_id, read_binary_log, EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+
+EVENT_NAMES = {EVENT_RECEIVED: "received", EVENT_SENT: "sent", EVENT_INTERNAL: "internal"}
+
+
+# Streams the records of one machine's log (text, or binary as written by LogSink) as
+# (event, logical clock, message ID) tuples, with message ID None for records without one
+def read_events(path):
+    if path.endswith(".bin"):
+        for event, _, clock, _, sender, seq in read_binary_log(path, message_ids=True):
+            yield event, clock, (sender, seq) if sender else None
+    else:
+        with open(path, errors="replace") as f:
+            for line in f:
+                record = parse_record(line)
+                if record is not None:
+                    yield record[0], record[2], parse_message_id(line) if record[0] != EVENT_INTERNAL else None
+
+
+# Happens-before index over the events of one run. Event k (0-based, in log order) of machine
+# i has a vector clock V whose entry for machine m counts the events of m that happened before
+# or at it. Along machine i's log, V[m] for m != i only changes at receives, so the index keeps
+# just those changes, as sorted arrays per (i, m). Every query is then a binary search, and the
+# events that happened before an event are, on each machine, a prefix of its log
+class CausalIndex():
+    def __init__(self, machines):
+        self.machines = list(machines) # ports, in the order used by vectors
+        self.position = {machine: i for i, machine in enumerate(self.machines)}
+        self.counts = [0] * len(self.machines) # events per machine
+        n = len(self.machines)
+        self.change_at = [[array("q") for _ in range(n)] for _ in range(n)] # [i][m] -> event indices where V[m] changed
+        self.change_to = [[array("q") for _ in range(n)] for _ in range(n)] # [i][m] -> the new values of V[m]
+
+    # Number of events of machine m that happened before or at event (machine, index)
+    def component(self, event, m):
+        machine, index = event
+        i = self.position[machine]
+        j = self.position[m]
+        if i == j:
+            return index + 1
+        k = bisect_right(self.change_at[i][j], index)
+        return self.change_to[i][j][k - 1] if k else 0
+
+    # The vector clock of an event as {machine: events of that machine that happened before or at it}
+    def vector(self, event):
+        return {m: self.component(event, m) for m in self.machines}
+
+    def happened_before(self, a, b):
+        return a != b and self.component(b, a[0]) > a[1]
+
+    def concurrent(self, a, b):
+        return a != b and not self.happened_before(a, b) and not self.happened_before(b, a)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump((self.machines, self.counts, self.change_at, self.change_to), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            machines, counts, change_at, change_to = pickle.load(f)
+        index = cls(machines)
+        index.counts, index.change_at, index.change_to = counts, change_at, change_to
+        return index
+
+
+# Merges the logs of one run into a single causally consistent timeline, yielding
+# (machine, index, event, logical clock, message ID) in an order where every send comes before
+# its receive and each machine's events keep their log order. Only the head of each log and the
+# vector clocks of messages sent but not yet received are held in memory. Among the events that
+# may go next, the one with the smallest logical clock goes first. A receive whose send is in
+# no log (e.g. a truncated log) is released once nothing else can proceed.
+# If index is a CausalIndex for the same machines, it is filled in along the way
+def merge_logs(paths, index=None):
+    logs = sorted((int(run_and_machine(path)[1]), path) for path in paths)
+    machines = [machine for machine, _ in logs]
+    streams = [read_events(path) for _, path in logs]
+    counts = [0] * len(machines)
+    vectors = [[0] * len(machines) for _ in machines]
+    sent = {} # message ID -> vector clock of its send, until received
+    waiting = {} # message ID -> machine whose next event receives it
+    blocked = [] # heap of (clock, machine, message ID) receives waiting for their send
+    ready = [] # heap of (clock, machine) whose next event can go next
+    heads = [None] * len(machines)
+
+    def advance(i):
+        head = next(streams[i], None)
+        heads[i] = head
+        if head is None:
+            return
+        event, clock, message_id = head
+        if event == EVENT_RECEIVED and message_id is not None and message_id not in sent:
+            waiting[message_id] = i
+            heapq.heappush(blocked, (clock, i, message_id))
+        else:
+            heapq.heappush(ready, (clock, i))
+
+    for i in range(len(machines)):
+        advance(i)
+    while ready or waiting:
+        if ready:
+            _, i = heapq.heappop(ready)
+        else: # only receives of unlogged sends are left, release the earliest one
+            _, i, message_id = heapq.heappop(blocked)
+            if waiting.get(message_id) != i:
+                continue
+            del waiting[message_id]
+        event, clock, message_id = heads[i]
+        index_in_log = counts[i]
+        counts[i] += 1
+        vector = vectors[i]
+        vector[i] += 1
+        if event == EVENT_SENT and message_id is not None:
+            sent[message_id] = tuple(vector)
+            j = waiting.pop(message_id, None)
+            if j is not None:
+                heapq.heappush(ready, (heads[j][1], j))
+        elif event == EVENT_RECEIVED and message_id is not None:
+            send_vector = sent.pop(message_id, None)
+            if send_vector is not None:
+                for m, value in enumerate(send_vector):
+                    if value > vector[m]:
+                        vector[m] = value
+                        if index is not None:
+                            index.change_at[i][m].append(index_in_log)
+                            index.change_to[i][m].append(value)
+        yield machines[i], index_in_log, event, clock, message_id
+        advance(i)
+    if index is not None:
+        index.counts = counts
+
+
+# Builds the happens-before index of one run, writing the merged timeline to timeline if given
+def build_index(paths, timeline=None):
+    paths = list(paths)
+    index = CausalIndex(sorted(int(run_and_machine(path)[1]) for path in paths))
+    for machine, i, event, clock, message_id in merge_logs(paths, index):
+        if timeline is not None:
+            timeline.write(f"{machine} {i} {EVENT_NAMES[event]} {clock}{f' {message_id[0]}:{message_id[1]}' if message_id else ''}\n")
+    return index
+
+
+# Parses an event given as machine:index, e.g. 11113:42
+def _event(text):
+    machine, _, index = text.partition(":")
+    return int(machine), int(index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge the logs of one run into a causal timeline and answer happens-before queries")
+    parser.add_argument("paths", nargs="*", help="log files or directories of a single run (machines run with message_ids)")
+    parser.add_argument("--timeline", help="write the merged timeline to this file")
+    parser.add_argument("--save", help="write the happens-before index to this file")
+    parser.add_argument("--load", help="read a previously saved index instead of the logs")
+    parser.add_argument("--before", type=_event, nargs="+", default=[], help="print which events happened before machine:index")
+    args = parser.parse_args()
+
+    if args.load:
+        index = CausalIndex.load(args.load)
+    else:
+        files = list(find_logs(args.paths))
+        runs = {run_and_machine(path)[0] for path in files}
+        if len(runs) != 1:
+            parser.error(f"expected the logs of exactly one run, got {sorted(runs) or 'none'}")
+        if args.timeline:
+            with open(args.timeline, "w") as out:
+                index = build_index(files, out)
+        else:
+            index = build_index(files)
+        if args.save:
+            index.save(args.save)
+    print(f"{sum(index.counts)} events on {len(index.machines)} machines")
+    for event in args.before:
+        prefixes = ", ".join(f"{machine}[0:{count}]" for machine, count in index.vector(event).items())
+        print(f"{event[0]}:{event[1]} happened after (or is) {prefixes}")
@@ -0,0 +1,104 @@
+import unittest
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+import causal
+import cluster
+import simulation
+from logsink import EVENT_RECEIVED, EVENT_SENT
+
+class TestCausal(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def simulate(self, configs, duration=60, latency=0.3, **log_options):
+        with redirect_stdout(io.StringIO()):
+            sim = simulation.Simulation(configs, 1, latency=latency, log_options=dict(directory=self.dir.name, **log_options), client_options={"message_ids": True})
+            sim.run(duration)
+        return list(causal.find_logs([self.dir.name]))
+
+    # Vector clocks of every event, computed directly from the per-machine logs
+    def brute_force_vectors(self, paths):
+        logs = {int(causal.run_and_machine(path)[1]): list(causal.read_events(path)) for path in paths}
+        machines = sorted(logs)
+        sends = {message_id: (machine, k) for machine, events in logs.items() for k, (event, _, message_id) in enumerate(events) if event == EVENT_SENT}
+        vectors = {}
+
+        def vector(machine, k):
+            if (machine, k) not in vectors:
+                v = dict(vector(machine, k - 1)) if k else {m: 0 for m in machines}
+                v[machine] = k + 1
+                event, _, message_id = logs[machine][k]
+                if event == EVENT_RECEIVED and message_id in sends:
+                    for m, value in vector(*sends[message_id]).items():
+                        v[m] = max(v[m], value)
+                vectors[(machine, k)] = v
+            return vectors[(machine, k)]
+
+        for machine, events in logs.items():
+            for k in range(len(events)): # in order, so the recursion only follows messages
+                vector(machine, k)
+        return vectors
+
+    def test_logs_carry_message_ids_on_both_ends(self):
+        paths = self.simulate(cluster.make_configs(3))
+        sent, received = set(), set()
+        for path in paths:
+            for event, _, message_id in causal.read_events(path):
+                if event == EVENT_SENT:
+                    sent.add(message_id)
+                elif event == EVENT_RECEIVED:
+                    received.add(message_id)
+        self.assertNotIn(None, sent | received)
+        self.assertTrue(received)
+        self.assertTrue(received <= sent)
+
+    def test_timeline_is_causally_consistent(self):
+        paths = self.simulate(cluster.make_configs(4, "ring"))
+        seen, next_index = set(), {}
+        for machine, k, event, _, message_id in causal.merge_logs(paths):
+            self.assertEqual(next_index.get(machine, 0), k)
+            next_index[machine] = k + 1
+            if event == EVENT_SENT:
+                seen.add(message_id)
+            elif event == EVENT_RECEIVED:
+                self.assertIn(message_id, seen)
+        self.assertEqual(sum(1 for path in paths for _ in causal.read_events(path)), sum(next_index.values()))
+
+    def test_index_matches_brute_force(self):
+        paths = self.simulate(cluster.make_configs(3), duration=30, binary=True)
+        index = causal.build_index(paths)
+        expected = self.brute_force_vectors(paths)
+        self.assertEqual(len(expected), sum(index.counts))
+        for event, vector in expected.items():
+            self.assertEqual(vector, index.vector(event))
+        events = sorted(expected)[::7]
+        for a in events:
+            for b in events:
+                self.assertEqual(a != b and expected[b][a[0]] > a[1], index.happened_before(a, b))
+
+    def test_save_and_load(self):
+        paths = self.simulate(cluster.make_configs(3), duration=10)
+        index = causal.build_index(paths, io.StringIO())
+        path = os.path.join(self.dir.name, "run.idx")
+        index.save(path)
+        loaded = causal.CausalIndex.load(path)
+        self.assertEqual(index.counts, loaded.counts)
+        self.assertEqual(index.vector((11114, index.counts[1] - 1)), loaded.vector((11114, index.counts[1] - 1)))
+
+    def test_receive_of_unlogged_send_is_released(self):
+        paths = self.simulate(cluster.make_configs(2), duration=10)
+        sender = [path for path in paths if path.endswith("log11113.txt")][0]
+        with open(sender) as f:
+            lines = f.readlines()
+        with open(sender, "w") as f: # lose the sender's log after its first message
+            f.writelines(lines[:1])
+        events = list(causal.merge_logs(paths))
+        self.assertEqual(1 + sum(1 for _ in causal.read_events(paths[1])), len(events))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import argparse, os, struct, sys, threading, time, zlib
+from collections import namedtuple
+from clocks import CLOCK_LAMPORT, CLOCK_VECTOR, CLOCK_MODES, CLOCKS, Message
+from framing import encode_uvarint, decode_uvarint
+from workload import INTERNAL
+
+
+# A checkpoint holds everything a Client keeps only in memory: its clock, the messages still in
+# its queue, its random generator (including the choices it has drawn but not used yet, and how
+# far it has replayed a recorded trace), its message sequence number, its tick rate and cycle
+# count, and how long its log file was when the snapshot was taken. Files are a fixed header, varints, packed integers and a CRC-32 of
+# everything before it, written to a temporary file and renamed over the previous checkpoint, so
+# a machine that dies mid-write leaves the previous checkpoint intact
+CHECKPOINT_MAGIC = b"LCCP"
+CHECKPOINT_VERSION = 2
+# magic, version, clock mode, tick rate, cycles, sequence number, log position, replayed trace events and targets
+HEADER = struct.Struct("<4sBBIQQQII")
+TRAILER = struct.Struct("<I")
+GAUSS = struct.Struct("<d")
+DEFAULT_EVERY = 1000 # clock cycles between snapshots
+
+Snapshot = namedtuple("Snapshot", "clock_mode tick cycles sequence log_position trace_position target_position clock messages rng_state event_draws peer_draws")
+
+
+# Returns the conventional checkpoint file of the machine listening on port
+def checkpoint_path(port, directory="."):
+    return os.path.join(directory, f"checkpoint{port}.bin")
+
+
+def _clock_mode(clock):
+    return next(mode for mode, cls in CLOCKS.items() if isinstance(clock, cls))
+
+
+def _encode_stamp(mode, stamp, out):
+    if mode == CLOCK_LAMPORT:
+        encode_uvarint(stamp, out)
+    elif mode == CLOCK_VECTOR:
+        encode_uvarint(len(stamp), out)
+        for machine, counter in stamp.items():
+            encode_uvarint(machine, out)
+            encode_uvarint(counter, out)
+    else:
+        encode_uvarint(stamp[0], out)
+        encode_uvarint(stamp[1], out)
+
+
+def _decode_stamp(mode, data, pos):
+    if mode == CLOCK_LAMPORT:
+        return decode_uvarint(data, pos)
+    if mode == CLOCK_VECTOR:
+        n, pos = decode_uvarint(data, pos)
+        vector = {}
+        for _ in range(n):
+            machine, pos = decode_uvarint(data, pos)
+            vector[machine], pos = decode_uvarint(data, pos)
+        return vector, pos
+    l, pos = decode_uvarint(data, pos)
+    c, pos = decode_uvarint(data, pos)
+    return (l, c), pos
+
+
+# Lists of integers are packed whole, in the narrowest of 1, 2 or 4 bytes that fits largest (a
+# bound on the values), which is far cheaper than encoding thousands of varints one by one
+def _encode_ints(values, largest, out):
+    width = "B" if largest < 1 << 8 else "H" if largest < 1 << 16 else "I"
+    out += struct.pack(f"<cH{len(values)}{width}", width.encode(), len(values), *values)
+
+
+def _decode_ints(data, pos):
+    width, n = struct.unpack_from("<cH", data, pos)
+    format = f"<{n}{width.decode()}"
+    return list(struct.unpack_from(format, data, pos + 3)), pos + 3 + struct.calcsize(format)
+
+
+# Serializes the state of client as a checkpoint. Queued messages carrying an ID are stored with
+# their sender and sequence number; sender 0 marks a bare stamp. Drawn machines are stored as
+# their index among the client's peers, which may be "host:port" strings
+def dump(client):
+    mode = _clock_mode(client.clock)
+    out = bytearray(HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, CLOCK_MODES.index(mode), client.tick, client.cycles,
+                                client.sequence, client.log.position(), client.trace_position, client.target_position))
+    _encode_stamp(mode, client.clock.stamp(), out)
+    messages = list(client.messages)
+    encode_uvarint(len(messages), out)
+    for message in messages:
+        if isinstance(message, Message):
+            encode_uvarint(message.sender, out)
+            encode_uvarint(message.seq, out)
+            message = message.stamp
+        else:
+            encode_uvarint(0, out)
+        _encode_stamp(mode, message, out)
+    version, internal, gauss = client.rng.getstate()
+    encode_uvarint(version, out)
+    _encode_ints(internal, 0xFFFFFFFF, out)
+    out.append(gauss is not None)
+    if gauss is not None:
+        out += GAUSS.pack(gauss)
+    _encode_ints(client.event_draws[client.event_index:], INTERNAL, out)
+    index = {peer: i for i, peer in enumerate(client.peers)}
+    _encode_ints([index[peer] for peer in client.peer_draws[client.peer_index:]], len(client.peers), out)
+    out += TRAILER.pack(zlib.crc32(out))
+    return bytes(out)
+
+
+# Parses a checkpoint made by dump, raising ValueError if it is not one or is corrupt
+def load(data):
+    if len(data) < HEADER.size + TRAILER.size or TRAILER.unpack_from(data, len(data) - TRAILER.size)[0] != zlib.crc32(data[:-TRAILER.size]):
+        raise ValueError("not a checkpoint, or a corrupt one")
+    magic, version, mode, tick, cycles, sequence, log_position, trace_position, target_position = HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+        raise ValueError(f"not a version {CHECKPOINT_VERSION} checkpoint")
+    mode = CLOCK_MODES[mode]
+    clock, pos = _decode_stamp(mode, data, HEADER.size)
+    n, pos = decode_uvarint(data, pos)
+    messages = []
+    for _ in range(n):
+        sender, pos = decode_uvarint(data, pos)
+        seq = 0
+        if sender:
+            seq, pos = decode_uvarint(data, pos)
+        stamp, pos = _decode_stamp(mode, data, pos)
+        messages.append(Message(stamp, sender, seq) if sender else stamp)
+    rng_version, pos = decode_uvarint(data, pos)
+    internal, pos = _decode_ints(data, pos)
+    gauss = None
+    if data[pos]:
+        gauss, = GAUSS.unpack_from(data, pos + 1)
+        pos += GAUSS.size
+    event_draws, pos = _decode_ints(data, pos + 1)
+    peer_draws, pos = _decode_ints(data, pos)
+    return Snapshot(mode, tick, cycles, sequence, log_position, trace_position, target_position, clock, messages,
+                    (rng_version, tuple(internal), gauss), event_draws, peer_draws)
+
+
+# Reads the checkpoint at path, or returns None if there is none
+def read(path):
+    try:
+        with open(path, "rb") as f:
+            return load(f.read())
+    except FileNotFoundError:
+        return None
+
+
+# Puts client back in the state of snapshot: messages queued since it started go after the
+# restored ones, the workload is back in the phase of the snapshot's clock cycle, and the log
+# loses the records written after the snapshot, which this run replays
+def restore(client, snapshot):
+    mode = _clock_mode(client.clock)
+    if snapshot.clock_mode != mode:
+        raise ValueError(f"checkpoint has a {snapshot.clock_mode} clock, the machine a {mode} clock")
+    client.tick = snapshot.tick
+    client.cycles = snapshot.cycles
+    client._enter_phase()
+    client.sequence = snapshot.sequence
+    client.clock.load(snapshot.clock)
+    client.messages.put_front(snapshot.messages)
+    client.rng.setstate(snapshot.rng_state)
+    client.event_draws, client.event_index = snapshot.event_draws, 0
+    client.peer_draws, client.peer_index = [client.peers[i] for i in snapshot.peer_draws], 0
+    client.trace_position, client.target_position = snapshot.trace_position, snapshot.target_position
+    client.log.truncate(snapshot.log_position)
+
+
+# Takes a client's snapshots every `every` clock cycles. The client thread only serializes its
+# state between two cycles; writing, syncing and renaming the file happens on a
+# writer thread, so disk latency stays out of the tick schedule. If the writer falls behind,
+# only the newest snapshot is kept. Serialization times are kept to report their cost
+class Checkpointer():
+    def __init__(self, path, every=DEFAULT_EVERY):
+        self.path = path
+        self.every = every
+        self.snapshots = 0
+        self.total_time = 0.0 # seconds spent serializing, in the clock cycles that took snapshots
+        self.max_time = 0.0
+        self.written = 0
+        self.pending = None
+        self.closed = False
+        self.ready = threading.Condition()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def snapshot(self, client):
+        start = time.perf_counter()
+        data = dump(client)
+        elapsed = time.perf_counter() - start
+        self.snapshots += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        with self.ready:
+            self.pending = data
+            self.ready.notify()
+
+    # Waits for the latest snapshot to be written and stops the writer thread
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        self.writer.join()
+
+    def stats(self):
+        return {"snapshots": self.snapshots, "written": self.written, "mean_us": round(self.total_time / self.snapshots * 1e6, 1) if self.snapshots else 0.0,
+                "max_us": round(self.max_time * 1e6, 1)}
+
+    def _write_loop(self):
+        while True:
+            with self.ready:
+                self.ready.wait_for(lambda: self.pending is not None or self.closed)
+                data, self.pending = self.pending, None
+            if data is None:
+                return
+            self._write(data)
+            self.written += 1
+
+    def _write(self, data):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Inspect a machine checkpoint, or restart a machine from its latest checkpoint")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print what a checkpoint holds")
+    show.add_argument("path")
+    resume = commands.add_parser("resume", help="restart a machine from its checkpoint and rejoin its peers")
+    resume.add_argument("port", type=int, help="the machine's listening port")
+    resume.add_argument("peers", type=int, nargs="+", help="listening ports of the machines it connects to")
+    resume.add_argument("--host", default="")
+    resume.add_argument("--dir", default=".", help="directory of the checkpoint and log")
+    resume.add_argument("--every", type=int, default=DEFAULT_EVERY, help="clock cycles between snapshots")
+    resume.add_argument("--clock", choices=CLOCK_MODES, default=CLOCK_LAMPORT)
+    resume.add_argument("--workload", default=None, help="the machine's JSON workload spec, which must be the one it ran with")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        snapshot = read(args.path)
+        if snapshot is None:
+            sys.exit(f"{args.path} does not exist")
+        print(f"{snapshot.clock_mode} clock {snapshot.clock} after {snapshot.cycles} cycles at tick rate {snapshot.tick}, "
+              f"{len(snapshot.messages)} queued messages, sequence number {snapshot.sequence}, log position {snapshot.log_position}")
+    else:
+        from machine import Machine
+        from workload import load as load_workload
+        Machine([args.host, args.port] + args.peers, {"directory": args.dir},
+                client_options={"clock_mode": args.clock, "checkpoint_dir": args.dir, "checkpoint_every": args.every, "resume": True,
+                                "workload": load_workload(args.workload) if args.workload else None}).run()
@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+import io
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+import checkpoint
+from clocks import CLOCK_LAMPORT, CLOCK_VECTOR, CLOCK_HYBRID, Message
+from logsink import LogSink, EVENT_SENT, EVENT_INTERNAL
+from machine import Client
+from message_queue import MessageQueue
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def client(self, messages=None, **options):
+        log = LogSink.for_machine(1, self.dir.name, clock=lambda: 0)
+        with redirect_stdout(io.StringIO()):
+            return Client(["", 1, 2, 3], messages if messages is not None else MessageQueue(), log, connections={2: mock.Mock(), 3: mock.Mock()},
+                          rng=random.Random(7), checkpoint_dir=self.dir.name, **options)
+
+    def test_round_trip(self):
+        for mode, queued in ((CLOCK_LAMPORT, [4, 9]), (CLOCK_VECTOR, [{2: 3}]), (CLOCK_HYBRID, [(5, 1)])):
+            with self.subTest(mode=mode):
+                messages = MessageQueue()
+                client = self.client(messages, clock_mode=mode, wall_clock=lambda: 7_000_000)
+                for _ in range(20):
+                    client.step()
+                messages.put_many(queued + [Message(queued[0], 2, 11)])
+                snapshot = checkpoint.load(checkpoint.dump(client))
+                client.checkpointer.close()
+                self.assertEqual((mode, client.tick, 20, client.clock.stamp()), (snapshot.clock_mode, snapshot.tick, snapshot.cycles, snapshot.clock))
+                self.assertEqual(queued + [Message(queued[0], 2, 11)], snapshot.messages)
+                self.assertEqual(client.rng.getstate(), snapshot.rng_state)
+                self.assertEqual(client.event_draws[client.event_index:], snapshot.event_draws)
+                self.assertEqual(client.log.position(), snapshot.log_position)
+
+    def test_corrupt_checkpoint(self):
+        client = self.client()
+        data = bytearray(checkpoint.dump(client))
+        client.checkpointer.close()
+        data[10] ^= 1
+        with self.assertRaises(ValueError):
+            checkpoint.load(bytes(data))
+
+    def test_written_atomically_every_n_cycles(self):
+        client = self.client(checkpoint_every=10)
+        for _ in range(25):
+            client.step()
+        client.checkpointer.close()
+        self.assertEqual(["checkpoint1.bin", "log1.txt"], sorted(os.listdir(self.dir.name))) # no temporary file is left
+        self.assertEqual(20, checkpoint.read(checkpoint.checkpoint_path(1, self.dir.name)).cycles)
+        self.assertEqual(2, client.checkpointer.stats()["snapshots"])
+
+    def test_resumed_machine_continues_like_the_original(self):
+        client = self.client(checkpoint_every=50)
+        for _ in range(49):
+            client.step()
+        client.messages.put_many([3, 70])
+        for _ in range(31): # the snapshot is taken after cycle 50, with 70 still queued
+            client.step()
+        client.checkpointer.close()
+        client.log.close()
+        with open(client.log.path) as f:
+            original = f.read()
+
+        resumed = self.client(checkpoint_every=50, resume=True)
+        self.assertEqual([70], list(resumed.messages))
+        self.assertEqual(50, resumed.cycles)
+        for _ in range(30):
+            resumed.step()
+        resumed.checkpointer.close()
+        resumed.log.close()
+        with open(resumed.log.path) as f:
+            self.assertEqual(original, f.read())
+
+    def test_resumed_mid_replay_continues_like_the_original(self):
+        trace = os.path.join(self.dir.name, "trace.txt")
+        with LogSink(trace) as sink:
+            for clock in range(1, 31):
+                sink.record(EVENT_SENT if clock % 3 else EVENT_INTERNAL, clock)
+        spec = {"targets": {"3": 1}, "replay": trace, "phases": [{"cycle": 35, "weights": [1, 1, 0]}]}
+        client = self.client(checkpoint_every=25, workload=spec)
+        for _ in range(45): # the snapshot is taken after cycle 25, 5 events before the end of the trace
+            client.step()
+        client.checkpointer.close()
+        client.log.close()
+        with open(client.log.path) as f:
+            original = f.read()
+
+        resumed = self.client(checkpoint_every=25, workload=spec, resume=True)
+        self.assertEqual((25, 30, 35), (resumed.cycles, resumed.trace_position, resumed.phase_end))
+        self.assertEqual(5, len(resumed.event_draws))
+        for _ in range(20):
+            resumed.step()
+        resumed.checkpointer.close()
+        resumed.log.close()
+        with open(resumed.log.path) as f:
+            self.assertEqual(original, f.read())
+
+    def test_resume_needs_same_clock(self):
+        client = self.client()
+        client.checkpointer.snapshot(client)
+        client.checkpointer.close()
+        with self.assertRaises(ValueError):
+            self.client(resume=True, clock_mode=CLOCK_VECTOR)
+
+if __name__ == '__main__':
+    unittest.main()
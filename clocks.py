@@ -0,0 +1,374 @@
+import time
+from collections import namedtuple
+from framing import TIMESTAMP, FRAME_HEADER, FRAME_TIMESTAMPS, MAX_FRAME_PAYLOAD, FrameDecoder, encode_timestamps, encode_uvarint, decode_uvarint
+
+
+# Logical clock modes a machine can run with
+CLOCK_LAMPORT = "lamport"
+CLOCK_VECTOR = "vector"
+CLOCK_HYBRID = "hybrid"
+CLOCK_MODES = (CLOCK_LAMPORT, CLOCK_VECTOR, CLOCK_HYBRID)
+
+# Frame kinds carrying varint-encoded clock stamps (FRAME_TIMESTAMPS carries 4-byte Lamport stamps)
+FRAME_LAMPORT = 2
+FRAME_VECTOR = 3
+FRAME_HYBRID = 4
+FRAME_TAGGED = 0x80 # flag on the kinds above: the frame also carries the ID of every message
+
+# A received message that carries its ID: the sending machine's port and the sender's sequence
+# number for it, which together identify the message across all machines' logs
+Message = namedtuple("Message", "stamp sender seq")
+
+MAX_TIMESTAMP = 2**32 - 1 # largest Lamport stamp that fits the original 4-byte wire format
+HLC_COUNTER_BITS = 20 # low bits of a hybrid clock's scalar that hold c
+
+
+# Every clock supports the same operations: local() for an internal or send event, merge(stamp)
+# for a receive event, merge_all(stamps) for a single receive event taking in several messages,
+# stamp() for the value sent in a message, scalar() for the integer logged as "logical clock time",
+# and load(stamp) to put the clock back to an earlier stamp(), e.g. from a checkpoint. Scalars
+# preserve causality: if a happened before b, then scalar(a) < scalar(b)
+
+# The original Lamport clock, a single integer
+class LamportClock():
+    def __init__(self, machine, wall_clock=None):
+        self.time = 0
+
+    def local(self):
+        self.time += 1
+
+    def merge(self, stamp):
+        self.time = max(self.time, stamp) + 1
+
+    def merge_all(self, stamps):
+        self.time = max(self.time, max(stamps)) + 1
+
+    def stamp(self):
+        return self.time
+
+    def scalar(self):
+        return self.time
+
+    def set(self, value):
+        self.time = value
+
+    def load(self, stamp):
+        self.time = stamp
+
+    def encoder(self, framed, sender=None):
+        return LamportEncoder(framed, sender)
+
+
+# Vector clock stored sparsely as {machine: counter}, so machines need not know the cluster
+# size and entries only appear for machines whose events they have (transitively) heard of
+class VectorClock():
+    def __init__(self, machine, wall_clock=None):
+        self.machine = machine
+        self.vector = {machine: 0}
+        self.total = 0 # sum of all counters, kept up to date as the scalar
+
+    def local(self):
+        self.vector[self.machine] += 1
+        self.total += 1
+
+    def merge(self, stamp):
+        self._absorb(stamp)
+        self.local()
+
+    def merge_all(self, stamps):
+        for stamp in stamps:
+            self._absorb(stamp)
+        self.local()
+
+    # Takes the entrywise maximum with stamp
+    def _absorb(self, stamp):
+        vector = self.vector
+        for machine, counter in stamp.items():
+            mine = vector.get(machine, 0)
+            if counter > mine:
+                vector[machine] = counter
+                self.total += counter - mine
+
+    def stamp(self):
+        return dict(self.vector)
+
+    def load(self, stamp):
+        self.vector = dict(stamp)
+        self.vector.setdefault(self.machine, 0)
+        self.total = sum(self.vector.values())
+
+    def scalar(self):
+        return self.total
+
+    def encoder(self, framed, sender=None):
+        return VectorEncoder(sender)
+
+
+# Hybrid logical clock: a (l, c) pair where l tracks the largest physical time seen, in ms, and
+# c counts events that happened within the same l. Stamps stay close to physical time while
+# still respecting causality. c stays below 2**HLC_COUNTER_BITS, so that it fits its bits of the
+# scalar: a millionth event within one millisecond moves l on by one instead
+class HybridLogicalClock():
+    def __init__(self, machine, wall_clock=None):
+        self.wall_clock = wall_clock or time.time_ns
+        self.l = 0
+        self.c = 0
+
+    def local(self):
+        physical = self.wall_clock() // 1_000_000
+        if physical > self.l:
+            self.l, self.c = physical, 0
+        else:
+            self.c += 1
+            self._carry()
+
+    def merge(self, stamp):
+        l, c = stamp
+        physical = self.wall_clock() // 1_000_000
+        new_l = max(self.l, l, physical)
+        if new_l == self.l and new_l == l:
+            self.c = max(self.c, c) + 1
+        elif new_l == self.l:
+            self.c += 1
+        elif new_l == l:
+            self.c = c + 1
+        else:
+            self.c = 0
+        self.l = new_l
+        self._carry()
+
+    def _carry(self):
+        if self.c >> HLC_COUNTER_BITS:
+            self.l, self.c = self.l + 1, 0
+
+    # Merging only depends on the largest stamp, with c breaking ties between equal l
+    def merge_all(self, stamps):
+        self.merge(max(stamps))
+
+    def stamp(self):
+        return (self.l, self.c)
+
+    def load(self, stamp):
+        self.l, self.c = stamp
+
+    # l in the high bits and c in the low HLC_COUNTER_BITS bits
+    def scalar(self):
+        return (self.l << HLC_COUNTER_BITS) | self.c
+
+    def encoder(self, framed, sender=None):
+        return HybridEncoder(sender)
+
+
+CLOCKS = {CLOCK_LAMPORT: LamportClock, CLOCK_VECTOR: VectorClock, CLOCK_HYBRID: HybridLogicalClock}
+
+
+# Returns a new clock of the given mode for machine, reading physical time in ns from wall_clock
+def make_clock(mode, machine, wall_clock=None):
+    if mode not in CLOCKS:
+        raise ValueError(f"unknown clock mode {mode!r}, expected one of {CLOCK_MODES}")
+    return CLOCKS[mode](machine, wall_clock)
+
+
+# Only Lamport stamps without message IDs fit the original unframed format
+def needs_frames(mode, message_ids=False):
+    return mode != CLOCK_LAMPORT or message_ids
+
+
+# Encoders turn the messages pending for one link into the bytes of a single send. Vector and
+# hybrid encoders are stateful: each stamp is encoded relative to the previous one sent on the
+# same link, which the decoder on the other end of that connection mirrors. An encoder given a
+# sender encodes (seq, stamp) pairs into tagged frames, which start with the sender's port and
+# give each stamp the increase of its sequence number since the previous message on the link
+
+
+# Builds frames of one kind from varint-encoded messages, never splitting a message across
+# frames so that each frame can be decoded on its own. Every frame starts with prefix
+class _FrameWriter():
+    def __init__(self, kind, prefix=b""):
+        self.kind = kind
+        self.prefix = prefix
+        self.frames = []
+        self.payload = bytearray(prefix)
+        self.message_start = len(prefix) # offset in payload where the message being written began
+
+    # Called after each message is appended to payload
+    def end_message(self):
+        if len(self.payload) > MAX_FRAME_PAYLOAD:
+            self._flush(self.message_start)
+            self.payload[:0] = self.prefix
+        self.message_start = len(self.payload)
+
+    def _flush(self, n):
+        self.frames.append(FRAME_HEADER.pack(n, self.kind) + self.payload[:n])
+        del self.payload[:n]
+
+    def getvalue(self):
+        if len(self.payload) > len(self.prefix):
+            self._flush(len(self.payload))
+        return b"".join(self.frames)
+
+
+# Shared encoding loop; subclasses write one stamp with write_stamp(stamp, out)
+class _StampEncoder():
+    kind = None
+
+    def __init__(self, sender=None):
+        self.sender = sender
+        self.last_seq = 0
+
+    def encode(self, messages):
+        if self.sender is None:
+            writer = _FrameWriter(self.kind)
+            for stamp in messages:
+                self.write_stamp(stamp, writer.payload)
+                writer.end_message()
+            return writer.getvalue()
+        prefix = bytearray()
+        encode_uvarint(self.sender, prefix)
+        writer = _FrameWriter(self.kind | FRAME_TAGGED, bytes(prefix))
+        for seq, stamp in messages:
+            encode_uvarint(seq - self.last_seq, writer.payload)
+            self.last_seq = seq
+            self.write_stamp(stamp, writer.payload)
+            writer.end_message()
+        return writer.getvalue()
+
+
+class LamportEncoder(_StampEncoder):
+    kind = FRAME_LAMPORT
+
+    def __init__(self, framed, sender=None):
+        super().__init__(sender)
+        self.framed = framed
+        self.header = FRAME_HEADER.size if framed else 0
+        self._grow(64)
+
+    # Untagged stamps keep the original 4-byte format while they fit. They are packed into a
+    # buffer reused by every send on the link, so the returned view is only valid until the next
+    # call; connections must copy (or send) it before returning from sendall
+    def encode(self, messages):
+        n = len(messages)
+        if self.sender is None and (messages[0] if n == 1 else max(messages)) <= MAX_TIMESTAMP:
+            if TIMESTAMP.size * n > MAX_FRAME_PAYLOAD:
+                return encode_timestamps(messages, self.framed)
+            size = self.header + TIMESTAMP.size * n
+            if size > len(self.buffer):
+                self._grow(2 * size)
+            if self.framed:
+                FRAME_HEADER.pack_into(self.buffer, 0, TIMESTAMP.size * n, FRAME_TIMESTAMPS)
+            offset = self.header
+            for stamp in messages:
+                TIMESTAMP.pack_into(self.buffer, offset, stamp)
+                offset += TIMESTAMP.size
+            view = self.views.get(size)
+            if view is None:
+                view = self.views[size] = self.view[:size]
+            return view
+        if not self.framed:
+            raise OverflowError(f"Lamport clock {max(messages)} does not fit the 4-byte wire format; enable framed mode")
+        return super().encode(messages)
+
+    def _grow(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.views = {} # sends of each size reuse the same view of the buffer
+
+    def write_stamp(self, stamp, out):
+        encode_uvarint(stamp, out)
+
+
+class VectorEncoder(_StampEncoder):
+    kind = FRAME_VECTOR
+
+    def __init__(self, sender=None):
+        super().__init__(sender)
+        self.last = {}
+
+    # Each stamp is a count of changed entries followed by (machine, increase) pairs
+    def write_stamp(self, stamp, out):
+        last = self.last
+        changed = [(machine, counter - last.get(machine, 0)) for machine, counter in stamp.items() if counter != last.get(machine, 0)]
+        encode_uvarint(len(changed), out)
+        for machine, increase in changed:
+            encode_uvarint(machine, out)
+            encode_uvarint(increase, out)
+        last.update(stamp)
+
+
+class HybridEncoder(_StampEncoder):
+    kind = FRAME_HYBRID
+
+    def __init__(self, sender=None):
+        super().__init__(sender)
+        self.last_l = 0
+
+    # Each stamp is the increase of l since the previous stamp followed by c
+    def write_stamp(self, stamp, out):
+        l, c = stamp
+        encode_uvarint(l - self.last_l, out)
+        encode_uvarint(c, out)
+        self.last_l = l
+
+
+# Decoders for the stamps of one connection. read_stamp(data, pos) returns (stamp, position after it)
+
+def _read_lamport(data, pos):
+    return decode_uvarint(data, pos)
+
+
+class _VectorReader():
+    def __init__(self):
+        self.last = {}
+
+    def __call__(self, data, pos):
+        changed, pos = decode_uvarint(data, pos)
+        for _ in range(changed):
+            machine, pos = decode_uvarint(data, pos)
+            increase, pos = decode_uvarint(data, pos)
+            self.last[machine] = self.last.get(machine, 0) + increase
+        return dict(self.last), pos
+
+
+class _HybridReader():
+    def __init__(self):
+        self.last_l = 0
+
+    def __call__(self, data, pos):
+        increase, pos = decode_uvarint(data, pos)
+        c, pos = decode_uvarint(data, pos)
+        self.last_l += increase
+        return (self.last_l, c), pos
+
+
+# FrameDecoder handler for one frame kind, returning the stamps of untagged frames and
+# Messages for tagged ones
+class _FrameHandler():
+    def __init__(self, read_stamp, tagged):
+        self.read_stamp = read_stamp
+        self.tagged = tagged
+        self.last_seq = 0
+
+    def __call__(self, payload):
+        messages, pos, read_stamp = [], 0, self.read_stamp
+        if not self.tagged:
+            while pos < len(payload):
+                stamp, pos = read_stamp(payload, pos)
+                messages.append(stamp)
+            return messages
+        sender, pos = decode_uvarint(payload, 0)
+        while pos < len(payload):
+            increase, pos = decode_uvarint(payload, pos)
+            self.last_seq += increase
+            stamp, pos = read_stamp(payload, pos)
+            messages.append(Message(stamp, sender, self.last_seq))
+        return messages
+
+
+# Returns a FrameDecoder for one connection that understands stamps of every clock mode, with
+# or without message IDs, and frames of any other kinds in handlers
+def new_decoder(handlers=None):
+    handlers = dict(handlers or {})
+    for kind, read_stamp in ((FRAME_LAMPORT, _read_lamport), (FRAME_VECTOR, _VectorReader()), (FRAME_HYBRID, _HybridReader())):
+        handlers[kind] = _FrameHandler(read_stamp, False)
+        handlers[kind | FRAME_TAGGED] = _FrameHandler(read_stamp, True)
+    return FrameDecoder(handlers=handlers)
@@ -0,0 +1,154 @@
+import unittest
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+import clocks
+import cluster
+import framing
+import simulation
+from clocks import LamportClock, VectorClock, HybridLogicalClock
+
+class TestClocks(unittest.TestCase):
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            clocks.make_clock("atomic", 1)
+
+    def test_lamport(self):
+        clock = LamportClock(1)
+        clock.local()
+        clock.merge(10)
+        self.assertEqual(11, clock.stamp())
+        clock.merge(3)
+        self.assertEqual(12, clock.scalar())
+
+    def test_vector(self):
+        a, b = VectorClock(1), VectorClock(2)
+        a.local()
+        a.local()
+        b.local()
+        b.merge(a.stamp())
+        self.assertEqual({1: 2, 2: 2}, b.stamp())
+        self.assertEqual(4, b.scalar())
+        b.merge({1: 1, 3: 5}) # only entries that grow count towards the scalar
+        self.assertEqual({1: 2, 2: 3, 3: 5}, b.stamp())
+        self.assertEqual(10, b.scalar())
+
+    def test_hybrid_follows_physical_time(self):
+        now = [5_000_000]
+        clock = HybridLogicalClock(1, wall_clock=lambda: now[0])
+        clock.local()
+        clock.local()
+        self.assertEqual((5, 1), clock.stamp())
+        clock.merge((9, 4)) # a peer ahead of our physical time
+        self.assertEqual((9, 5), clock.stamp())
+        clock.merge((9, 2))
+        self.assertEqual((9, 6), clock.stamp())
+        now[0] = 12_000_000
+        clock.local()
+        self.assertEqual((12, 0), clock.stamp())
+        self.assertEqual(12 << 20, clock.scalar())
+
+    def test_hybrid_counter_carries_into_l(self):
+        limit = 1 << clocks.HLC_COUNTER_BITS
+        clock = HybridLogicalClock(1, wall_clock=lambda: 5_000_000)
+        clock.load((5, limit - 2))
+        scalars = [clock.scalar()]
+        clock.local()
+        self.assertEqual((5, limit - 1), clock.stamp())
+        scalars.append(clock.scalar())
+        clock.local() # c would no longer fit below l in the scalar
+        self.assertEqual((6, 0), clock.stamp())
+        scalars.append(clock.scalar())
+        self.assertEqual(6 << clocks.HLC_COUNTER_BITS, scalars[-1])
+        self.assertTrue(scalars[0] < scalars[1] < scalars[2])
+        receiver = HybridLogicalClock(2, wall_clock=lambda: 5_000_000)
+        receiver.merge((5, limit - 1))
+        self.assertEqual((6, 0), receiver.stamp())
+        self.assertLess((5 << clocks.HLC_COUNTER_BITS) + limit - 1, receiver.scalar())
+
+    def test_merge_all_is_one_receive_event(self):
+        lamport = LamportClock(1)
+        lamport.merge_all([4, 9, 2])
+        self.assertEqual(10, lamport.scalar())
+        vector = VectorClock(2)
+        vector.merge_all([{1: 3}, {1: 1, 3: 2}])
+        self.assertEqual({1: 3, 2: 1, 3: 2}, vector.stamp())
+        self.assertEqual(6, vector.scalar())
+        hybrid = HybridLogicalClock(3, wall_clock=lambda: 1_000_000)
+        hybrid.merge_all([(7, 1), (9, 2), (9, 4)])
+        self.assertEqual((9, 5), hybrid.stamp())
+
+    def test_scalar_preserves_happened_before(self):
+        now = [0]
+        for mode in clocks.CLOCK_MODES:
+            sender, receiver = clocks.make_clock(mode, 1, lambda: now[0]), clocks.make_clock(mode, 2, lambda: now[0])
+            for _ in range(5):
+                receiver.local()
+            sender.local()
+            receiver.merge(sender.stamp())
+            self.assertLess(sender.scalar(), receiver.scalar(), mode)
+
+class TestEncoding(unittest.TestCase):
+    def decode_all(self, mode, batches, framed=True):
+        encoder = clocks.make_clock(mode, 1).encoder(framed)
+        decoder = clocks.new_decoder()
+        if framed:
+            decoder.feed(framing.FRAMED_MAGIC)
+        data, received = b"", []
+        for batch in batches:
+            encoded = encoder.encode(batch)
+            data += encoded
+            received.extend(decoder.feed(encoded))
+        return data, received
+
+    def test_lamport_keeps_original_format(self):
+        data, received = self.decode_all(clocks.CLOCK_LAMPORT, [[1, 2]], framed=False)
+        self.assertEqual(b"\x00\x00\x00\x01\x00\x00\x00\x02", data)
+        self.assertEqual([1, 2], received)
+
+    def test_lamport_overflow(self):
+        with self.assertRaises(OverflowError):
+            clocks.LamportEncoder(False).encode([2**32])
+        _, received = self.decode_all(clocks.CLOCK_LAMPORT, [[2**32 - 1], [2**32, 2**40]])
+        self.assertEqual([2**32 - 1, 2**32, 2**40], received)
+
+    def test_vector_sends_only_changed_entries(self):
+        batches = [[{1: 1, 2: 7, 3: 4}], [{1: 2, 2: 7, 3: 4}, {1: 3, 2: 7, 3: 4}]]
+        data, received = self.decode_all(clocks.CLOCK_VECTOR, batches)
+        self.assertEqual(batches[0] + batches[1], received)
+        # first frame: 3 entries of 2 bytes; then two stamps of one (machine, increase) pair each
+        self.assertEqual(2 * framing.FRAME_HEADER.size + (1 + 6) + 2 * (1 + 2), len(data))
+
+    def test_hybrid(self):
+        batches = [[(1_700_000_000_000, 0), (1_700_000_000_000, 1)], [(1_700_000_000_005, 0)]]
+        data, received = self.decode_all(clocks.CLOCK_HYBRID, batches)
+        self.assertEqual([(1_700_000_000_000, 0), (1_700_000_000_000, 1), (1_700_000_000_005, 0)], received)
+        self.assertEqual(2 * framing.FRAME_HEADER.size + (6 + 1) + 2 + 2, len(data))
+
+    def test_large_batches_split_between_stamps(self):
+        stamps = [{machine: 1000 + i for machine in range(20000, 20050)} for i in range(500)]
+        data, received = self.decode_all(clocks.CLOCK_VECTOR, [stamps])
+        self.assertGreater(len(data), framing.MAX_FRAME_PAYLOAD)
+        self.assertEqual(stamps, received)
+
+class TestClockModesInSimulation(unittest.TestCase):
+    def test_modes_run_and_stay_causal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for mode in clocks.CLOCK_MODES:
+                os.makedirs(os.path.join(directory, mode))
+                with redirect_stdout(io.StringIO()):
+                    sim = simulation.Simulation(cluster.make_configs(4, "ring"), 3, latency=0.01, log_options={"directory": os.path.join(directory, mode)}, client_options={"clock_mode": mode})
+                    sim.run(30)
+                for client in sim.clients:
+                    self.assertGreater(client.logical_clock, 0, mode)
+                    self.assertTrue(client.framed or mode == clocks.CLOCK_LAMPORT)
+                if mode == clocks.CLOCK_VECTOR:
+                    # every machine hears (transitively) about every other one around the ring
+                    self.assertTrue(all(len(client.clock.vector) == 4 for client in sim.clients))
+                if mode == clocks.CLOCK_HYBRID:
+                    start_ms = sim.start_ns // 1_000_000
+                    self.assertTrue(all(abs(client.clock.l - start_ms - 30_000) < 1000 for client in sim.clients))
+
+if __name__ == '__main__':
+    unittest.main()
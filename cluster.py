@@ -0,0 +1,127 @@
+import argparse, asyncio, math, os, random, resource
+from multiprocessing import Process
+from machine import Machine
+from async_machine import AsyncMachine, run_machines
+from clocks import CLOCK_LAMPORT, CLOCK_MODES
+from netem import parse_profile
+from checkpoint import DEFAULT_EVERY
+import workload
+
+
+TOPOLOGIES = ("mesh", "ring", "star", "random")
+
+
+# Returns the neighbours of each of the n machines (by index) in the given topology. Links are
+# undirected: if j is a neighbour of i then i is a neighbour of j. "random" is a random k-regular graph
+def make_topology(n, kind="mesh", k=3, seed=None):
+    if kind == "mesh":
+        return [[j for j in range(n) if j != i] for i in range(n)]
+    if kind == "ring":
+        return [sorted({(i - 1) % n, (i + 1) % n} - {i}) for i in range(n)]
+    if kind == "star": # machine 0 is the hub
+        return [list(range(1, n))] + [[0] for _ in range(1, n)]
+    if kind == "random":
+        return _random_regular(n, k, random.Random(seed))
+    raise ValueError(f"unknown topology {kind!r}, expected one of {TOPOLOGIES}")
+
+
+# Generates a random k-regular graph with the pairing model, retrying until there are no
+# self-loops or duplicate links
+def _random_regular(n, k, rng, attempts=1000):
+    if k >= n or n * k % 2:
+        raise ValueError(f"no {k}-regular graph on {n} machines (need k < n and n * k even)")
+    for _ in range(attempts):
+        stubs = [i for i in range(n) for _ in range(k)]
+        rng.shuffle(stubs)
+        neighbours = [set() for _ in range(n)]
+        for a, b in zip(stubs[::2], stubs[1::2]):
+            if a == b or b in neighbours[a]:
+                break
+            neighbours[a].add(b)
+            neighbours[b].add(a)
+        else:
+            return [sorted(links) for links in neighbours]
+    raise ValueError(f"could not generate a {k}-regular graph on {n} machines")
+
+
+# Returns one network config per machine, of the form [host, listening port, port to connect to, ...].
+# With hosts, machines are spread round-robin over them, each listening on its host's address and
+# connecting to peers as "host:port"
+def make_configs(n, kind="mesh", base_port=11113, host="", k=3, seed=None, hosts=None):
+    ports = [base_port + i for i in range(n)]
+    if hosts:
+        return [[hosts[i % len(hosts)], ports[i]] + [f"{hosts[j % len(hosts)]}:{ports[j]}" for j in links] for i, links in enumerate(make_topology(n, kind, k, seed))]
+    return [[host, ports[i]] + [ports[j] for j in links] for i, links in enumerate(make_topology(n, kind, k, seed))]
+
+
+# Raises this process's open file limit as far as allowed and returns it
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+# Each machine uses one listening socket plus one socket per link in each direction
+def fds_needed(configs):
+    return sum(1 + 2 * (len(config) - 2) for config in configs) + 64
+
+
+# Runs a share of the cluster's machines on one asyncio event loop
+def _run_worker(configs, duration, log_options, client_options):
+    raise_fd_limit()
+    asyncio.run(run_machines([AsyncMachine(config, log_options, client_options=client_options) for config in configs], duration))
+
+
+# Launches a cluster. With the "async" runtime, machines are spread round-robin over worker
+# processes that each host their share as asyncio tasks, using enough workers to stay within
+# the file descriptor limit; with the "threads" runtime every machine gets its own process and
+# threads as in machine.py
+def launch(configs, runtime="async", workers=None, duration=None, log_options=None, client_options=None):
+    if runtime == "threads":
+        processes = [Process(target=Machine(config, log_options, client_options=client_options).run) for config in configs]
+    else:
+        limit = raise_fd_limit()
+        workers = workers or min(len(configs), os.cpu_count() or 1)
+        workers = max(workers, math.ceil(fds_needed(configs) / limit))
+        shards = [configs[i::workers] for i in range(workers)]
+        processes = [Process(target=_run_worker, args=(shard, duration, log_options, client_options)) for shard in shards if shard]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a cluster of N logical clock machines")
+    parser.add_argument("-n", "--machines", type=int, default=3)
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="mesh")
+    parser.add_argument("-k", "--degree", type=int, default=3, help="degree of the random topology")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the random topology")
+    parser.add_argument("--host", default="")
+    parser.add_argument("--hosts", nargs="+", default=None, help="spread machines over these addresses, e.g. 127.0.0.1 127.0.0.2, or the addresses of real hosts")
+    parser.add_argument("--local", nargs="+", default=None, help="with --hosts, only run the machines of these addresses, e.g. this host's")
+    parser.add_argument("--base-port", type=int, default=11113)
+    parser.add_argument("--runtime", choices=("async", "threads"), default="async")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for the async runtime (default: one per core)")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run for (async runtime only, default: forever)")
+    parser.add_argument("--clock", choices=CLOCK_MODES, default=CLOCK_LAMPORT, help="logical clock each machine keeps")
+    parser.add_argument("--netem", type=parse_profile, default=None, help="impair every link, e.g. latency=0.05,jitter=0.01,drop=0.1,partition=10-20 (threads runtime only, see netem.py)")
+    parser.add_argument("--log-dir", default=".")
+    parser.add_argument("--workload", type=workload.load, default=None, help="JSON workload spec giving the machines' events, e.g. per machine weights, phases or replayed logs (see workload.py)")
+    parser.add_argument("--checkpoint-every", type=int, default=None, help="save every machine's state to the log directory every this many clock cycles (see checkpoint.py)")
+    args = parser.parse_args()
+    if args.netem is not None and args.runtime != "threads":
+        parser.error("--netem needs --runtime threads")
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    configs = make_configs(args.machines, args.topology, args.base_port, args.host, args.degree, args.seed, args.hosts)
+    if args.local:
+        configs = [config for config in configs if config[0] in args.local]
+    launch(configs, args.runtime, args.workers, args.duration, {"directory": args.log_dir}, {"clock_mode": args.clock, "netem": args.netem,
+           "checkpoint_dir": args.log_dir if args.checkpoint_every else None, "checkpoint_every": args.checkpoint_every or DEFAULT_EVERY,
+           "workload": args.workload})
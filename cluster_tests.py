@@ -0,0 +1,85 @@
+import unittest
+import os
+import tempfile
+import cluster
+import columnar
+from logsink import EVENT_SENT
+from async_machine_tests import free_ports
+
+class TestTopologies(unittest.TestCase):
+    def assertUndirected(self, topology):
+        for i, links in enumerate(topology):
+            self.assertNotIn(i, links)
+            for j in links:
+                self.assertIn(i, topology[j])
+
+    def test_mesh(self):
+        topology = cluster.make_topology(4, "mesh")
+        self.assertEqual([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]], topology)
+
+    def test_ring(self):
+        topology = cluster.make_topology(5, "ring")
+        self.assertEqual([1, 4], topology[0])
+        self.assertEqual([2, 4], topology[3])
+        self.assertUndirected(topology)
+        self.assertEqual([[1], [0]], cluster.make_topology(2, "ring"))
+
+    def test_star(self):
+        topology = cluster.make_topology(4, "star")
+        self.assertEqual([[1, 2, 3], [0], [0], [0]], topology)
+
+    def test_random_regular(self):
+        topology = cluster.make_topology(64, "random", k=4, seed=7)
+        self.assertTrue(all(len(links) == 4 for links in topology))
+        self.assertUndirected(topology)
+        self.assertEqual(topology, cluster.make_topology(64, "random", k=4, seed=7))
+
+    def test_random_regular_impossible(self):
+        with self.assertRaises(ValueError):
+            cluster.make_topology(5, "random", k=3)
+        with self.assertRaises(ValueError):
+            cluster.make_topology(3, "random", k=3)
+
+    def test_unknown_topology(self):
+        with self.assertRaises(ValueError):
+            cluster.make_topology(3, "tree")
+
+    def test_three_machine_mesh_matches_machine_py(self):
+        self.assertEqual([["", 11113, 11114, 11115], ["", 11114, 11113, 11115], ["", 11115, 11113, 11114]], cluster.make_configs(3))
+
+    def test_configs_across_hosts(self):
+        self.assertEqual([["10.0.0.1", 11113, "10.0.0.2:11114", "10.0.0.1:11115"], ["10.0.0.2", 11114, "10.0.0.1:11113", "10.0.0.1:11115"],
+                          ["10.0.0.1", 11115, "10.0.0.1:11113", "10.0.0.2:11114"]], cluster.make_configs(3, hosts=["10.0.0.1", "10.0.0.2"]))
+
+    def test_fds_needed(self):
+        self.assertEqual(3 * (1 + 2 * 2) + 64, cluster.fds_needed(cluster.make_configs(3)))
+
+class TestLaunch(unittest.TestCase):
+    def test_ring_across_workers(self):
+        base = free_ports(1)[0]
+        configs = cluster.make_configs(6, "ring", base_port=base, host="127.0.0.1")
+        with tempfile.TemporaryDirectory() as directory:
+            cluster.launch(configs, workers=2, duration=1, log_options={"directory": directory})
+            self.assertEqual(sorted(f"log{config[1]}.txt" for config in configs), sorted(os.listdir(directory)))
+
+    def test_mesh_across_loopback_addresses(self):
+        base = free_ports(1)[0]
+        configs = cluster.make_configs(4, base_port=base, hosts=["127.0.0.1", "127.0.0.2"])
+        with tempfile.TemporaryDirectory() as directory:
+            cluster.launch(configs, workers=2, duration=1, log_options={"directory": directory})
+            self.assertEqual(sorted(f"log{config[1]}.txt" for config in configs), sorted(os.listdir(directory)))
+
+    def test_columnar_logs_across_loopback_addresses(self):
+        base = free_ports(1)[0]
+        configs = cluster.make_configs(4, base_port=base, hosts=["127.0.0.1", "127.0.0.2"])
+        with tempfile.TemporaryDirectory() as directory:
+            cluster.launch(configs, workers=2, duration=1, log_options={"directory": directory, "columnar": True},
+                           client_options={"tick_range": (20, 20), "event_weights": (1, 0, 0)})
+            for config in configs:
+                columns = columnar.load(os.path.join(directory, f"log{config[1]}{columnar.SUFFIX}"))
+                peers = {int(peer) for event, peer in zip(columns["event"], columns["peer"]) if event == EVENT_SENT}
+                self.assertTrue(peers) # "host:port" peers are logged by their listening port
+                self.assertLessEqual(peers, {port for port in range(base, base + 4) if port != config[1]})
+
+if __name__ == '__main__':
+    unittest.main()
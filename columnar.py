@@ -0,0 +1,281 @@
+import argparse, atexit, json, mmap, os, sys, time
+from array import array
+from collections import defaultdict
+from analyze_logs import DAY, EVENT_NAMES, find_logs, run_and_machine
+from logsink import parse_record, parse_message_id, read_binary_log, EVENT_RECEIVED
+try:
+    import numpy
+except ImportError: # optional, only makes loaded columns NumPy arrays
+    numpy = None
+
+
+# Columnar event tables: a directory holding one file per column, each a flat little-endian
+# array with one value per event, and meta.json naming the columns and their types. Loading
+# memory-maps the files, so the columns of many runs can be loaded without copying them, as
+# NumPy arrays if NumPy is installed and as memoryviews otherwise. Columns:
+#   machine  port of the machine that logged the event
+#   event    EVENT_RECEIVED, EVENT_SENT or EVENT_INTERNAL
+#   time_ns  time of the event in ns: time.monotonic_ns() (or the sink's clock) for native tables,
+#            the log's wall time for binary logs, and whole seconds since the first midnight
+#            for text logs, which only have the time of day
+#   clock    logical clock time
+#   queue    message queue size after a receive, 0 otherwise
+#   peer     the machine a message was sent to, or received from if the log knows (0 if not)
+COLUMNS = (("machine", "I"), ("event", "B"), ("time_ns", "q"), ("clock", "Q"), ("queue", "I"), ("peer", "I"))
+DTYPES = {"I": "<u4", "B": "|u1", "q": "<i8", "Q": "<u8"} # NumPy names of the array typecodes above
+TYPECODES = dict(COLUMNS)
+VERSION = 1
+SUFFIX = ".cols"
+
+
+# A table's columns, by name, as array.array (when built in memory), memoryview or NumPy array
+class Table():
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns["event"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+# Reads text or binary machine logs (e.g. the existing experiment directories) into one table.
+# Text logs only give the sender of received messages that carry a message ID
+def from_logs(paths):
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    for path in find_logs(paths):
+        n = len(columns["event"])
+        machine = int(run_and_machine(path)[1])
+        if path.endswith(".bin"):
+            for event, wall_ns, clock, queue_depth, sender, _ in read_binary_log(path, message_ids=True):
+                _append(columns, event, wall_ns, clock, queue_depth, sender if event == EVENT_RECEIVED else 0)
+        else:
+            day = last = 0
+            with open(path, errors="replace") as f:
+                for line in f:
+                    record = parse_record(line)
+                    if record is None:
+                        continue
+                    event, second, clock, queue_depth = record
+                    second += day
+                    if second < last - DAY // 2: # the log crossed midnight
+                        day += DAY
+                        second += DAY
+                    last = second
+                    message_id = parse_message_id(line) if event == EVENT_RECEIVED else None
+                    _append(columns, event, second * 10**9, clock, queue_depth or 0, message_id[0] if message_id else 0)
+        columns["machine"].extend(array("I", [machine]) * (len(columns["event"]) - n))
+    return Table(columns)
+
+
+def _append(columns, event, time_ns, clock, queue_depth, peer):
+    columns["event"].append(event)
+    columns["time_ns"].append(time_ns)
+    columns["clock"].append(clock)
+    columns["queue"].append(queue_depth)
+    columns["peer"].append(peer)
+
+
+# Writes a table to directory, replacing any table there
+def save(table, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, typecode in COLUMNS:
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(_little_endian(array(typecode, table[name]) if not isinstance(table[name], array) else table[name]))
+    _write_meta(directory)
+
+
+def _write_meta(directory):
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({"version": VERSION, "columns": {name: DTYPES[typecode] for name, typecode in COLUMNS}}, f)
+
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+# Memory-maps the table in directory. Rows are only counted whole in every column, so a table
+# still being written by a machine loads as of its last complete record
+def load(directory):
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("version") != VERSION:
+        raise ValueError(f"{directory} is not a version {VERSION} columnar table")
+    maps = {}
+    for name, typecode in COLUMNS:
+        with open(os.path.join(directory, name), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    rows = min(len(maps[name]) // array(typecode).itemsize for name, typecode in COLUMNS)
+    columns = {}
+    for name, typecode in COLUMNS:
+        if numpy is not None:
+            columns[name] = numpy.frombuffer(maps[name], dtype=DTYPES[typecode], count=rows)
+        elif sys.byteorder == "little":
+            columns[name] = memoryview(maps[name])[:rows * array(typecode).itemsize].cast(typecode)
+        else:
+            columns[name] = _little_endian(array(typecode, maps[name][:rows * array(typecode).itemsize]))
+    return Table(columns)
+
+
+# Native columnar writer with the interface of a LogSink: it buffers one array per column and
+# appends them to the column files every flush_every records, every flush_interval_ms
+# milliseconds, and on close/shutdown. Records are stamped with clock(), time.monotonic_ns() by default
+class ColumnarSink():
+    def __init__(self, path, machine, flush_every=256, flush_interval_ms=1000, clock=time.monotonic_ns, message_ids=False):
+        self.path = path
+        self.machine = machine
+        self.clock = clock
+        self.message_ids = message_ids # message IDs are not kept, but machines set this on every sink
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval_ms / 1000 if flush_interval_ms else None
+        self.buffers = {name: array(typecode) for name, typecode in COLUMNS}
+        self.files = None # opened lazily on the first flush so that idle machines create no files
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    # Returns a sink writing to log{port}.cols in directory
+    @classmethod
+    def for_machine(cls, port, directory=".", **options):
+        return cls(os.path.join(directory, f"log{port}{SUFFIX}"), port, **options)
+
+    def record(self, event, clock, queue_depth=0, wall_ns=None, sender=0, seq=0, peer=0):
+        buffers = self.buffers
+        buffers["machine"].append(self.machine)
+        buffers["event"].append(event)
+        buffers["time_ns"].append(self.clock() if wall_ns is None else wall_ns)
+        buffers["clock"].append(clock)
+        buffers["queue"].append(queue_depth)
+        buffers["peer"].append(peer or (sender if event == EVENT_RECEIVED else 0))
+        self.pending += 1
+        if self.flush_every and self.pending >= self.flush_every:
+            self.flush()
+        elif self.flush_interval is not None and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        if self.files is None:
+            self._open()
+        for name, _ in COLUMNS:
+            self.files[name].write(_little_endian(self.buffers[name]))
+            self.files[name].flush()
+            del self.buffers[name][:]
+        self.pending = 0
+
+    # Flushes buffered records and returns the number of records in the table, for checkpoints
+    def position(self):
+        self.flush()
+        path = os.path.join(self.path, "event")
+        return os.path.getsize(path) // array(TYPECODES["event"]).itemsize if os.path.exists(path) else 0
+
+    # Cuts the table back to its first position records, dropping buffered records too
+    def truncate(self, position):
+        for name, typecode in COLUMNS:
+            del self.buffers[name][:]
+            path = os.path.join(self.path, name)
+            if os.path.exists(path):
+                os.truncate(path, position * array(typecode).itemsize)
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        if self.files is not None:
+            for f in self.files.values():
+                f.close()
+            self.files = None
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open(self):
+        os.makedirs(self.path, exist_ok=True)
+        _write_meta(self.path)
+        self.files = {name: open(os.path.join(self.path, name), "ab") for name, _ in COLUMNS}
+        atexit.register(self.close) # make sure buffered records survive interpreter shutdown
+
+
+# Per machine event counts, final clock, mean and largest clock jump and queue size of a table,
+# computed with whole-column NumPy operations when NumPy is installed
+def summarize(table):
+    result = {}
+    if numpy is not None:
+        order = numpy.argsort(table["machine"], kind="stable") # keeps each machine's log order
+        machines, starts = numpy.unique(table["machine"][order], return_index=True)
+        for machine, rows in zip(machines.tolist(), numpy.split(order, starts[1:])):
+            events, clocks, queues = table["event"][rows], table["clock"][rows].astype(numpy.int64), table["queue"][rows]
+            jumps = numpy.diff(clocks, prepend=0)
+            jumps = jumps[jumps != 0] # the extra records of a broadcast repeat the same clock
+            received = queues[events == EVENT_RECEIVED]
+            result[machine] = _summary(numpy.bincount(events, minlength=3).tolist(), int(clocks[-1]), jumps.tolist(), received.tolist())
+        return result
+    rows = defaultdict(list)
+    for i, machine in enumerate(table["machine"]):
+        rows[machine].append(i)
+    for machine, indices in sorted(rows.items()):
+        counts, jumps, received, previous = [0, 0, 0], [], [], 0
+        for i in indices:
+            event, clock = table["event"][i], table["clock"][i]
+            counts[event] += 1
+            if clock != previous:
+                jumps.append(clock - previous)
+                previous = clock
+            if event == EVENT_RECEIVED:
+                received.append(table["queue"][i])
+        result[machine] = _summary(counts, previous, jumps, received)
+    return result
+
+
+def _summary(counts, final_clock, jumps, queues):
+    return {"events": {EVENT_NAMES[e]: counts[e] for e in EVENT_NAMES}, "final_clock": final_clock,
+            "mean_jump": round(sum(jumps) / len(jumps), 3) if jumps else 0, "max_jump": max(jumps, default=0),
+            "mean_queue": round(sum(queues) / len(queues), 3) if queues else 0, "max_queue": max(queues, default=0)}
+
+
+# Groups log files by the run they belong to, e.g. base_logs/base1_log11113.txt -> base_logs/base1
+def runs(paths):
+    grouped = defaultdict(list)
+    for path in find_logs(paths):
+        grouped[run_and_machine(path)[0]].append(path)
+    return dict(sorted(grouped.items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert machine logs into columnar tables, and summarize tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="write one table per run, e.g. base_logs/base1_log*.txt -> OUT/base_logs/base1.cols")
+    convert.add_argument("paths", nargs="+", help="log files or directories")
+    convert.add_argument("-o", "--out", default="columnar")
+    stats = commands.add_parser("stats", help="summarize tables")
+    stats.add_argument("tables", nargs="+")
+    stats.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        for run, paths in runs(args.paths).items():
+            directory, name = os.path.split(run) # runs keep their directory, as runs of different directories share names
+            out = os.path.join(args.out, os.path.basename(directory), name + SUFFIX)
+            table = from_logs(paths)
+            save(table, out)
+            print(f"{out}: {len(table)} events from {len(paths)} logs")
+    else:
+        results = {directory: summarize(load(directory)) for directory in args.tables}
+        if args.json:
+            print(json.dumps(results, indent=2))
+            sys.exit()
+        for directory, machines in results.items():
+            print(f"== {directory}")
+            for machine, s in machines.items():
+                events = ", ".join(f"{name} {count}" for name, count in s["events"].items())
+                print(f"  machine {machine}: {events}, final clock {s['final_clock']}, clock jumps mean {s['mean_jump']} max {s['max_jump']}, "
+                      f"queue size mean {s['mean_queue']} max {s['max_queue']}")
@@ -0,0 +1,83 @@
+import unittest
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+import analyze_logs
+import cluster
+import columnar
+import logsink
+import simulation
+from logsink import EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_text_and_binary_logs_round_trip(self):
+        with logsink.LogSink(self.path("run_log11113.txt")) as sink:
+            sink.record(EVENT_INTERNAL, 1, wall_ns=10**9)
+            sink.record(EVENT_RECEIVED, 5, 2, wall_ns=3 * 10**9, sender=22224, seq=7)
+        with logsink.LogSink(self.path("run_log22224.bin"), binary=True, message_ids=True) as sink:
+            sink.record(EVENT_SENT, 4, wall_ns=2_500_000_000, sender=22224, seq=7)
+        table = columnar.from_logs([self.dir.name])
+        columnar.save(table, self.path("run.cols"))
+        loaded = columnar.load(self.path("run.cols"))
+        self.assertEqual(3, len(loaded))
+        self.assertEqual([11113, 11113, 22224], list(loaded["machine"]))
+        self.assertEqual([EVENT_INTERNAL, EVENT_RECEIVED, EVENT_SENT], list(loaded["event"]))
+        self.assertEqual([1, 5, 4], list(loaded["clock"]))
+        self.assertEqual([0, 2, 0], list(loaded["queue"]))
+        self.assertEqual([0, 22224, 0], list(loaded["peer"]))
+        self.assertEqual(2 * 10**9, loaded["time_ns"][1] - loaded["time_ns"][0]) # text logs keep whole seconds
+        self.assertEqual(2_500_000_000, loaded["time_ns"][2])
+
+    def test_native_sink(self):
+        sink = columnar.ColumnarSink.for_machine(11113, self.dir.name, flush_every=2, clock=iter(range(100, 200)).__next__)
+        sink.record(EVENT_SENT, 1, peer=22224)
+        self.assertFalse(os.path.exists(self.path("log11113.cols")))
+        sink.record(EVENT_RECEIVED, 6, 3, sender=33335, seq=1)
+        position = sink.position()
+        sink.record(EVENT_INTERNAL, 7)
+        sink.record(EVENT_INTERNAL, 8)
+        sink.truncate(position)
+        sink.record(EVENT_INTERNAL, 9)
+        sink.close()
+        table = columnar.load(self.path("log11113.cols"))
+        self.assertEqual([(11113, EVENT_SENT, 100, 1, 0, 22224), (11113, EVENT_RECEIVED, 101, 6, 3, 33335), (11113, EVENT_INTERNAL, 104, 9, 0, 0)],
+                         list(zip(*(table[name] for name, _ in columnar.COLUMNS))))
+
+    def test_partly_written_record_ignored(self):
+        with columnar.ColumnarSink(self.path("t.cols"), 1) as sink:
+            sink.record(EVENT_INTERNAL, 1)
+        with open(os.path.join(self.path("t.cols"), "time_ns"), "ab") as f:
+            f.write(bytes(3))
+        self.assertEqual(1, len(columnar.load(self.path("t.cols"))))
+
+    def test_summarize(self):
+        with columnar.ColumnarSink(self.path("t.cols"), 1) as sink:
+            for event, clock, queue in ((EVENT_SENT, 1, 0), (EVENT_SENT, 1, 0), (EVENT_RECEIVED, 5, 2), (EVENT_RECEIVED, 6, 0)):
+                sink.record(event, clock, queue)
+        summary = columnar.summarize(columnar.load(self.path("t.cols")))[1]
+        self.assertEqual({"received": 2, "sent": 2, "internal": 0}, summary["events"])
+        self.assertEqual((6, 2.0, 4, 1.0, 2), (summary["final_clock"], summary["mean_jump"], summary["max_jump"], summary["mean_queue"], summary["max_queue"]))
+
+    def test_simulated_tables_analyze_like_text_logs(self):
+        reports = []
+        for options in ({}, {"columnar": True}):
+            directory = self.path("cols" if options else "text")
+            os.makedirs(directory)
+            with redirect_stdout(io.StringIO()):
+                simulation.Simulation(cluster.make_configs(3), 1, log_options=dict(options, directory=directory)).run(120)
+            reports.append(analyze_logs.analyze([directory], workers=1))
+        text, cols = (list(report.values())[0]["machines"] for report in reports)
+        self.assertEqual(text, cols)
+
+if __name__ == '__main__':
+    unittest.main()
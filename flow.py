@@ -0,0 +1,122 @@
+import socket
+from framing import FRAME_HEADER, FRAMED_MAGIC, FrameDecoder, encode_uvarint, decode_uvarint
+
+
+# Credit-based flow control between a sending Client and the Server it sends to. The sender opens
+# with FRAME_FLOW_REQUEST, and the server then sends FRAME_FLOW_STATUS frames back over the same
+# connection: how many messages it has enqueued from this connection and how deep its message
+# queue is. The sender may only have window messages either queued at the receiver or in flight,
+# so its credits are window - queue depth - (messages sent - messages enqueued). Without credits,
+# a message is handled by the link's policy
+FRAME_FLOW_REQUEST = 7 # empty, sender to receiver
+FRAME_FLOW_STATUS = 8 # receiver to sender: messages enqueued from the connection, then queue depth, as uvarints
+
+FLOW_THROTTLE = "throttle" # hold messages back, in order, until there are credits for them
+FLOW_COALESCE = "coalesce" # hold back only the latest message, whose stamp dominates every earlier one from this sender
+FLOW_DROP = "drop" # discard messages sent without credits
+FLOW_POLICIES = (FLOW_THROTTLE, FLOW_COALESCE, FLOW_DROP)
+DEFAULT_WINDOW = 64
+
+FLOW_UPDATE = 0.02 # seconds between status updates while a receiver's state keeps changing
+REQUEST = FRAME_HEADER.pack(0, FRAME_FLOW_REQUEST)
+
+
+def encode_status(received, depth):
+    payload = bytearray()
+    encode_uvarint(received, payload)
+    encode_uvarint(depth, payload)
+    return FRAME_HEADER.pack(len(payload), FRAME_FLOW_STATUS) + payload
+
+
+# Sending side of one flow-controlled link. sock is the TCP socket the link's messages (or, for
+# shared memory links, its doorbells) go over, which the status frames come back on
+class FlowControl():
+    def __init__(self, sock, policy=FLOW_THROTTLE, window=DEFAULT_WINDOW):
+        if policy not in FLOW_POLICIES:
+            raise ValueError(f"unknown flow control policy {policy!r}, expected one of {FLOW_POLICIES}")
+        self.sock = sock
+        self.policy = policy
+        self.window = window
+        self.sent = 0
+        self.received = 0 # enqueued by the receiver, as of its latest status
+        self.depth = 0 # the receiver's queue depth, as of its latest status
+        self.pending = [] # messages held back for want of credits
+        self.dropped = 0 # discarded by the drop policy
+        self.coalesced = 0 # superseded by a later message under the coalesce policy
+        self.max_pending = 0
+        self.decoder = FrameDecoder(256, {FRAME_FLOW_STATUS: self._status})
+        self.decoder.feed(FRAMED_MAGIC) # the receiver only ever sends frames back
+        sock.sendall(REQUEST)
+
+    def credits(self):
+        return self.window - self.depth - (self.sent - self.received)
+
+    # Returns the messages that may be sent now, given one more message to send
+    def offer(self, message):
+        self.poll()
+        if self.policy == FLOW_DROP:
+            if self.credits() > 0:
+                self.sent += 1
+                return [message]
+            self.dropped += 1
+            return []
+        if self.policy == FLOW_COALESCE and self.pending:
+            self.coalesced += len(self.pending)
+            self.pending.clear()
+        self.pending.append(message)
+        self.max_pending = max(self.max_pending, len(self.pending))
+        return self.release(poll=False)
+
+    # Returns the held back messages that there are now credits for
+    def release(self, poll=True):
+        if not self.pending:
+            return []
+        if poll:
+            self.poll()
+        n = min(len(self.pending), self.credits())
+        if n <= 0:
+            return []
+        ready = self.pending[:n]
+        del self.pending[:n]
+        self.sent += n
+        return ready
+
+    # Reads whatever status frames have arrived, without blocking
+    def poll(self):
+        while True:
+            try:
+                data = self.sock.recv(4096, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError: # the connection broke; sending will fail on its own
+                return
+            if not data: # the receiver is gone; sending will fail on its own
+                return
+            self.decoder.feed(data)
+
+    def _status(self, payload):
+        self.received, pos = decode_uvarint(payload, 0)
+        self.depth, _ = decode_uvarint(payload, pos)
+
+
+# Receiving side of one flow-controlled connection, kept by the Server. Status frames are only
+# sent when something changed, and a frame the socket could not take whole is finished first
+class FlowReporter():
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = 0
+        self.reported = None
+        self.unsent = b""
+
+    def report(self, depth):
+        try:
+            if not self.unsent:
+                if (self.received, depth) == self.reported:
+                    return
+                self.reported = (self.received, depth)
+                self.unsent = encode_status(self.received, depth)
+            self.unsent = self.unsent[self.sock.send(self.unsent):]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError: # the sender is gone; the server notices when it next reads
+            self.unsent = b""
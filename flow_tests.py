@@ -0,0 +1,117 @@
+import unittest
+from unittest import mock
+import io
+import socket
+import threading
+import time
+from contextlib import redirect_stdout
+import flow
+import machine
+from async_machine_tests import free_ports
+from flow import FlowControl, FlowReporter
+from framing import FRAME_HEADER
+from message_queue import MessageQueue
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+class TestFlowControl(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+
+    def tearDown(self):
+        self.sender.close()
+        self.receiver.close()
+
+    def control(self, policy):
+        control = FlowControl(self.sender, policy, window=2)
+        self.assertEqual(flow.REQUEST, self.receiver.recv(16))
+        return control
+
+    def test_throttle_holds_messages_in_order(self):
+        control = self.control(flow.FLOW_THROTTLE)
+        self.assertEqual([1], control.offer(1))
+        self.assertEqual([2], control.offer(2))
+        self.assertEqual([], control.offer(3))
+        self.assertEqual([], control.offer(4))
+        self.assertEqual([3, 4], control.pending)
+        self.receiver.sendall(flow.encode_status(2, 1)) # both enqueued, one still in the queue
+        self.assertEqual([3], control.release())
+        self.receiver.sendall(flow.encode_status(3, 0))
+        self.assertEqual([4], control.release())
+        self.assertEqual((4, 2), (control.sent, control.max_pending))
+
+    def test_coalesce_keeps_latest(self):
+        control = self.control(flow.FLOW_COALESCE)
+        control.offer(1)
+        control.offer(2)
+        for stamp in (3, 4, 5):
+            self.assertEqual([], control.offer(stamp))
+        self.assertEqual(([5], 2), (control.pending, control.coalesced))
+        self.receiver.sendall(flow.encode_status(2, 0))
+        self.assertEqual([5], control.release())
+
+    def test_drop(self):
+        control = self.control(flow.FLOW_DROP)
+        control.offer(1)
+        control.offer(2)
+        self.assertEqual([], control.offer(3))
+        self.assertEqual(([], 1), (control.pending, control.dropped))
+        self.receiver.sendall(flow.encode_status(2, 1))
+        self.assertEqual([4], control.offer(4))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            FlowControl(self.sender, "wait")
+
+class TestFlowReporter(unittest.TestCase):
+    def test_reports_changes_only(self):
+        sock = mock.Mock(name="sock")
+        sock.send.side_effect = lambda data: len(data)
+        reporter = FlowReporter(sock)
+        reporter.received = 3
+        reporter.report(2)
+        reporter.report(2)
+        sock.send.assert_called_once_with(flow.encode_status(3, 2))
+
+    def test_finishes_partial_frame(self):
+        sock = mock.Mock(name="sock")
+        sock.send.side_effect = [1, BlockingIOError, FRAME_HEADER.size + 1]
+        reporter = FlowReporter(sock)
+        reporter.report(5)
+        reporter.report(6) # the rest of the first status goes out before a new one is made
+        reporter.report(6)
+        frame = flow.encode_status(0, 5)
+        self.assertEqual([mock.call(frame), mock.call(frame[1:]), mock.call(frame[1:])], sock.send.call_args_list)
+        self.assertEqual(b"", reporter.unsent)
+
+class TestFlowControlledMachines(unittest.TestCase):
+    def test_receiver_queue_stays_within_window(self):
+        port, = free_ports(1)
+        messages = MessageQueue()
+        server = machine.Server(["127.0.0.1", port], messages)
+        threading.Thread(target=server.run, daemon=True).start()
+        with redirect_stdout(io.StringIO()):
+            client = machine.Client(["127.0.0.1", 0, port], MessageQueue(), log=mock.Mock(), flow=flow.FLOW_THROTTLE, flow_window=4)
+        for _ in range(10):
+            client.write_message([port])
+        self.assertTrue(wait_for(lambda: len(messages) == 4))
+        time.sleep(0.05)
+        self.assertEqual(4, len(messages))
+        self.assertEqual(6, len(client.flow[port].pending))
+        received = [messages.pop() for _ in range(4)]
+        self.assertTrue(wait_for(lambda: client.release_flow() or len(messages) == 4)) # the server reports the drained queue
+        received += [messages.pop() for _ in range(4)]
+        self.assertTrue(wait_for(lambda: client.release_flow() or len(messages) == 2))
+        received += [messages.pop() for _ in range(2)]
+        self.assertEqual(list(range(1, 11)), received)
+
+    def test_flow_needs_own_connections(self):
+        with self.assertRaises(ValueError):
+            machine.Client(["127.0.0.1", 0, 1], MessageQueue(), log=mock.Mock(), connections={1: mock.Mock()}, flow=flow.FLOW_DROP)
+
+if __name__ == '__main__':
+    unittest.main()
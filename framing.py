@@ -0,0 +1,131 @@
+import struct
+
+
+# The original wire format is a bare stream of 4-byte big-endian logical clock timestamps.
+# Several timestamps can be coalesced into one send simply by concatenating them, which
+# every receiver (old or new) already understands.
+TIMESTAMP = struct.Struct('>I')
+
+# Senders may instead open a connection with FRAMED_MAGIC and then send length-prefixed frames
+# of the form (payload length, frame kind, payload). Receivers detect the magic per connection,
+# so old machines keep working; new machines only send frames to peers configured as framed.
+FRAMED_MAGIC = b"LCF1"
+FRAME_HEADER = struct.Struct('>HB')
+MAX_FRAME_PAYLOAD = 0xFFFF
+FRAME_TIMESTAMPS = 1 # payload is a sequence of 4-byte timestamps
+
+
+# Encodes a list of timestamps into the bytes for a single send
+def encode_timestamps(timestamps, framed=False):
+    payload = struct.pack(f'>{len(timestamps)}I', *timestamps)
+    if not framed:
+        return payload
+    return encode_frames(FRAME_TIMESTAMPS, payload, TIMESTAMP.size)
+
+
+# Appends n as an unsigned LEB128 varint (7 bits per byte, low bits first) to out
+def encode_uvarint(n, out):
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+# Decodes the varint starting at data[pos], returning (value, position after it)
+def decode_uvarint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Wraps payload into one or more frames of the given kind, splitting only on multiples of unit bytes
+def encode_frames(kind, payload, unit=1):
+    if len(payload) <= MAX_FRAME_PAYLOAD:
+        return FRAME_HEADER.pack(len(payload), kind) + payload
+    step = MAX_FRAME_PAYLOAD - MAX_FRAME_PAYLOAD % unit
+    return b"".join(FRAME_HEADER.pack(len(payload[i:i + step]), kind) + payload[i:i + step] for i in range(0, len(payload), step))
+
+
+# Per-connection decoder that drains every complete message available on a socket per call.
+# Bytes are received with recv_into into a reusable buffer and unpacked with struct.iter_unpack;
+# a partial message at the end of the buffer is kept for the next call. Frames of kinds other
+# than FRAME_TIMESTAMPS are passed to handlers[kind](payload); a handler that returns a list
+# of decoded messages has them added to the result
+class FrameDecoder():
+    def __init__(self, buffer_size=65536, handlers=None):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # offset of the first undecoded byte
+        self.end = 0 # offset one past the last received byte
+        self.framed = None # unknown until the first 4 bytes of the connection arrive
+        self.handlers = handlers or {}
+
+    # Receives whatever is available on sock and returns the messages it completed,
+    # or None if the peer closed the connection
+    def receive(self, sock):
+        if self.end == len(self.buffer):
+            self._make_room(1)
+        n = sock.recv_into(self.view[self.end:])
+        if n == 0:
+            return None
+        self.end += n
+        return self._decode()
+
+    # Decodes bytes obtained some other way (e.g. from an asyncio stream), returning completed timestamps
+    def feed(self, data):
+        if len(data) > len(self.buffer) - self.end:
+            self._make_room(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return self._decode()
+
+    def _decode(self):
+        timestamps = []
+        if self.framed is None:
+            if self.end - self.start < len(FRAMED_MAGIC):
+                return timestamps
+            self.framed = self.buffer[self.start:self.start + len(FRAMED_MAGIC)] == FRAMED_MAGIC
+            if self.framed:
+                self.start += len(FRAMED_MAGIC)
+        if self.framed:
+            self._decode_frames(timestamps)
+        else:
+            usable = (self.end - self.start) & ~3 # only whole 4-byte timestamps
+            timestamps.extend([t for t, in TIMESTAMP.iter_unpack(self.view[self.start:self.start + usable])])
+            self.start += usable
+        if self.start == self.end:
+            self.start = self.end = 0
+        return timestamps
+
+    def _decode_frames(self, timestamps):
+        view, start, end = self.view, self.start, self.end
+        while end - start >= FRAME_HEADER.size:
+            length, kind = FRAME_HEADER.unpack_from(view, start)
+            if end - start - FRAME_HEADER.size < length:
+                break
+            payload = view[start + FRAME_HEADER.size:start + FRAME_HEADER.size + length]
+            if kind == FRAME_TIMESTAMPS:
+                timestamps.extend([t for t, in TIMESTAMP.iter_unpack(payload)])
+            elif kind in self.handlers:
+                decoded = self.handlers[kind](bytes(payload))
+                if decoded:
+                    timestamps.extend(decoded)
+            start += FRAME_HEADER.size + length
+        self.start = start
+
+    # Ensures there are at least n free bytes after end, first by moving the undecoded
+    # remainder to the front of the buffer and then, if necessary, by growing it
+    def _make_room(self, n):
+        remaining = self.end - self.start
+        if remaining + n > len(self.buffer):
+            buffer = bytearray(max(2 * len(self.buffer), remaining + n))
+            buffer[:remaining] = self.buffer[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        elif self.start:
+            self.buffer[:remaining] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, remaining
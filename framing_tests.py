@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+import socket
+import struct
+import framing
+from framing import FrameDecoder, encode_timestamps
+
+class TestFraming(unittest.TestCase):
+    def test_legacy_encoding_is_concatenated_timestamps(self):
+        self.assertEqual(struct.pack(">I", 7), encode_timestamps([7]))
+        self.assertEqual(struct.pack(">I", 7) + struct.pack(">I", 9), encode_timestamps([7, 9]))
+
+    def test_framed_encoding(self):
+        self.assertEqual(framing.FRAME_HEADER.pack(8, framing.FRAME_TIMESTAMPS) + struct.pack(">2I", 7, 9), encode_timestamps([7, 9], framed=True))
+
+    def test_large_payload_split_on_units(self):
+        timestamps = list(range(20000))
+        data = framing.FRAMED_MAGIC + encode_timestamps(timestamps, framed=True)
+        self.assertEqual(timestamps, FrameDecoder(buffer_size=16).feed(data))
+
+    def test_legacy_decoding_keeps_partial_timestamp(self):
+        decoder = FrameDecoder()
+        data = encode_timestamps([1, 2, 3])
+        self.assertEqual([], decoder.feed(data[:3]))
+        self.assertEqual([1, 2], decoder.feed(data[3:10]))
+        self.assertEqual([3], decoder.feed(data[10:]))
+        self.assertFalse(decoder.framed)
+
+    def test_framed_decoding_byte_by_byte(self):
+        decoder = FrameDecoder(buffer_size=8)
+        data = framing.FRAMED_MAGIC + encode_timestamps([4, 5], framed=True) + encode_timestamps([6], framed=True)
+        received = []
+        for i in range(len(data)):
+            received.extend(decoder.feed(data[i:i + 1]))
+        self.assertEqual([4, 5, 6], received)
+        self.assertTrue(decoder.framed)
+
+    def test_other_frame_kinds_go_to_handlers(self):
+        handler = mock.Mock(return_value=None)
+        decoder = FrameDecoder(handlers={9: handler})
+        data = framing.FRAMED_MAGIC + framing.encode_frames(9, b"abc") + encode_timestamps([1], framed=True) + framing.encode_frames(10, b"ignored")
+        self.assertEqual([1], decoder.feed(data))
+        handler.assert_called_once_with(b"abc")
+
+    def test_handlers_can_return_messages(self):
+        decoder = FrameDecoder(handlers={9: lambda payload: list(payload)})
+        data = framing.FRAMED_MAGIC + encode_timestamps([1], framed=True) + framing.encode_frames(9, bytes([7, 8]))
+        self.assertEqual([1, 7, 8], decoder.feed(data))
+
+    def test_uvarint_round_trip(self):
+        out = bytearray()
+        values = [0, 1, 127, 128, 300, 2**32, 2**70]
+        for value in values:
+            framing.encode_uvarint(value, out)
+        self.assertEqual(b"\x00\x01\x7f\x80\x01", bytes(out[:5]))
+        pos, decoded = 0, []
+        while pos < len(out):
+            value, pos = framing.decode_uvarint(out, pos)
+            decoded.append(value)
+        self.assertEqual(values, decoded)
+
+    def test_receive_from_socket(self):
+        left, right = socket.socketpair()
+        with left, right:
+            decoder = FrameDecoder(buffer_size=6)
+            left.sendall(encode_timestamps([10, 20, 30]))
+            received = []
+            while len(received) < 3:
+                received.extend(decoder.receive(right))
+            self.assertEqual([10, 20, 30], received)
+            left.close()
+            self.assertIsNone(decoder.receive(right))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import argparse, cProfile, io, json, pstats, socket, sys, threading, time
+from multiprocessing import get_context
+from urllib.request import urlopen
+from framing import FRAMED_MAGIC, encode_timestamps
+from machine import Server, peer_address, tune
+from message_queue import MessageQueue, OVERFLOW_BLOCK, OVERFLOW_POLICIES
+
+# Synthetic traffic a load generator sends into a machine's listening port
+MODE_CONSTANT = "constant" # one message per write at a steady rate, over one connection
+MODE_BURSTY = "bursty" # the same mean rate, in bursts of back-to-back writes
+MODE_CONNECTIONS = "connections" # a steady rate spread round-robin over many concurrent connections
+MODES = (MODE_CONSTANT, MODE_BURSTY, MODE_CONNECTIONS)
+DEFAULT_CONNECTIONS = 256 # connections of the connections mode
+DEFAULT_BURST = 100 # writes per burst of the bursty mode
+
+SATURATION = 0.9 # a rate saturates the server when it enqueues less than this share of what it was offered
+DRAIN_TIMEOUT = 10 # seconds to wait for the server to catch up with its backlog after a rate step
+PROFILED = r"machine\.py|framing\.py|message_queue\.py|selectors\.py" # what the profile report shows
+
+
+# Yields (seconds from the start, connection) for every write of duration seconds of traffic at
+# rate messages per second
+def schedule(mode, rate, duration, connections=1, burst=DEFAULT_BURST):
+    n = int(rate * duration)
+    if mode == MODE_BURSTY:
+        for i in range(n):
+            yield i // burst * burst / rate, i % connections
+    else:
+        for i in range(n):
+            yield i / rate, i % connections
+
+
+# Stands in for a machine's message queue: a real MessageQueue that also counts the messages
+# enqueued and, for timed traffic, how long each took from its sender to being enqueued.
+# Messages are then the sender's time.perf_counter_ns() in microseconds, as in bench_transport.py
+class LoadQueue(MessageQueue):
+    def __init__(self, maxsize=None, overflow=OVERFLOW_BLOCK):
+        super().__init__(maxsize, overflow)
+        self.received = 0
+        self.latencies = []
+
+    def put_many(self, items):
+        now = time.perf_counter_ns() // 1000 & 0xFFFFFFFF
+        self.latencies.extend((now - stamp) & 0xFFFFFFFF for stamp in items)
+        self.received += len(items)
+        super().put_many(items)
+
+
+# Generator process: opens connections to address, reports that it is ready, then writes the
+# schedule's messages, each when it is due, and reports how many it sent in how long and the CPU
+# time it used. It sleeps whenever it is ahead, so on a single core it leaves the server the rest.
+# Sends block while the server does not read, so a saturated server slows the generator down.
+# Stamps are the send time if timed, else 0, which leaves a real machine's Lamport clock alone
+def _generate(address, mode, rate, duration, connections, burst, framed, timed, results):
+    start = time.perf_counter()
+    socks = [socket.create_connection(address) for _ in range(connections)]
+    for sock in socks:
+        tune(sock)
+        if framed:
+            sock.sendall(FRAMED_MAGIC)
+    results.put(time.perf_counter() - start)
+    cpu, sent, start = time.process_time(), 0, time.perf_counter()
+    for offset, i in schedule(mode, rate, duration, connections, burst):
+        wait = start + offset - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        socks[i].sendall(encode_timestamps([time.perf_counter_ns() // 1000 & 0xFFFFFFFF if timed else 0], framed))
+        sent += 1
+    results.put({"sent": sent, "seconds": time.perf_counter() - start, "cpu_s": time.process_time() - cpu})
+    time.sleep(0.1)
+    for sock in socks:
+        sock.close()
+
+
+# Returns the sum of a machine's lc_messages_received_total counters and its lc_queue_depth
+# gauge, read from its metrics endpoint (see metrics.py)
+def scrape(url):
+    received = depth = 0
+    with urlopen(url, timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            if line.startswith("lc_messages_received_total{"):
+                received += int(float(line.rsplit(" ", 1)[1]))
+            elif line.startswith("lc_queue_depth{"):
+                depth = int(float(line.rsplit(" ", 1)[1]))
+    return received, depth
+
+
+# A machine's server running in this process, with a consumer that takes one message per clock
+# cycle from its queue like a client ticking at consume_rate. CPU time is that of the server
+# thread alone, and with profile the server thread runs under cProfile
+class Target():
+    def __init__(self, consume_rate=6, queue_size=None, overflow=OVERFLOW_BLOCK, profile=False):
+        self.messages = LoadQueue(queue_size, overflow)
+        self.server = Server(["127.0.0.1", 0], self.messages)
+        self.address = self.server.lsock.getsockname()
+        self.profiler = cProfile.Profile() if profile else None
+        self.consume_rate = consume_rate
+        self.peak_queue = 0
+        self.consuming = threading.Lock() # the queue has a single consumer, which reset stands in for
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        self.consumer = threading.Thread(target=self._consume, daemon=True)
+        self.consumer.start()
+
+    def _serve(self):
+        if self.profiler is not None:
+            self.profiler.enable() # cProfile only follows the thread that enables it
+        try:
+            self.server.run()
+        except OSError:
+            if not self.stopping.is_set():
+                raise
+        finally:
+            self.server.sel.close()
+            self.server.lsock.close()
+
+    def _consume(self):
+        while not self.stopping.wait(1 / self.consume_rate):
+            with self.consuming:
+                self.peak_queue = max(self.peak_queue, len(self.messages))
+                if self.messages:
+                    self.messages.pop()
+
+    # Returns (messages enqueued so far, queue length, server thread CPU seconds)
+    def sample(self):
+        return self.messages.received, len(self.messages), time.clock_gettime(time.pthread_getcpuclockid(self.thread.ident))
+
+    # Empties the queue between rate steps
+    def reset(self):
+        with self.consuming:
+            self.messages.drain()
+            self.messages.latencies.clear()
+            self.peak_queue = 0
+
+    # The server thread's profile, read once the load has stopped: the server then sits idle in select
+    def stats(self):
+        return pstats.Stats(self.profiler, stream=io.StringIO())
+
+    # Stops the server and consumer threads. Shutting the listening socket down wakes the server's
+    # select, and the accept that follows fails, which ends Server.run
+    def close(self):
+        self.stopping.set()
+        self.server.lsock.shutdown(socket.SHUT_RDWR)
+        self.thread.join()
+        self.consumer.join()
+
+
+# The same samples from a machine running elsewhere, through its metrics endpoint if it has one
+class RemoteTarget():
+    def __init__(self, address, metrics_url=None):
+        self.address = address
+        self.metrics_url = metrics_url
+        self.peak_queue = None
+
+    def sample(self):
+        if self.metrics_url is None:
+            return None, None, None
+        return scrape(self.metrics_url) + (None,)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Offers target rate messages per second of traffic in mode for duration seconds, and returns
+# what the generator achieved and what the server enqueued meanwhile: messages per second, queue
+# growth per second, server CPU share and time per message, enqueue latency percentiles and how
+# long the server took to catch up with its backlog once the generator stopped
+def step(target, mode, rate, duration=2.0, connections=1, burst=DEFAULT_BURST, framed=False):
+    target.reset()
+    before = target.sample()[0]
+    context = get_context("spawn")
+    results = context.Queue()
+    timed = isinstance(target, Target)
+    generator = context.Process(target=_generate, args=(target.address, mode, rate, duration, connections, burst, framed, timed, results), daemon=True)
+    generator.start()
+    connect = results.get(timeout=60)
+    received, queue, cpu = target.sample()
+    start = time.perf_counter()
+    sent = results.get(timeout=60 + 10 * duration)
+    seconds = time.perf_counter() - start
+    end_received, end_queue, end_cpu = target.sample()
+    catch_up = 0.0
+    if received is not None:
+        while target.sample()[0] - before < sent["sent"] and catch_up < DRAIN_TIMEOUT:
+            time.sleep(0.001)
+            catch_up = time.perf_counter() - start - seconds
+    generator.join()
+    result = {"mode": mode, "connections": connections, "rate": rate, "connect_ms": round(connect * 1e3, 2),
+              "sent_per_second": round(sent["sent"] / sent["seconds"]), "generator_cpu_share": round(sent["cpu_s"] / sent["seconds"], 3),
+              "received_per_second": None, "queue_growth_per_second": None, "peak_queue": target.peak_queue,
+              "server_cpu_share": None, "server_cpu_us_per_message": None, "p50_us": None, "p99_us": None, "catch_up_ms": None}
+    if received is not None:
+        enqueued = end_received - received
+        result.update({"received_per_second": round(enqueued / seconds), "queue_growth_per_second": round((end_queue - queue) / seconds),
+                       "catch_up_ms": round(catch_up * 1e3, 1)})
+    if cpu is not None:
+        result.update({"server_cpu_share": round((end_cpu - cpu) / seconds, 3),
+                       "server_cpu_us_per_message": round((end_cpu - cpu) / enqueued * 1e6, 2) if enqueued else None})
+        latencies = sorted(target.messages.latencies)
+        if latencies:
+            result.update({"p50_us": latencies[len(latencies) // 2], "p99_us": latencies[len(latencies) * 99 // 100]})
+    return result
+
+
+# Returns whether the server (or, when only sends are known, the link) failed to keep up with a step
+def saturated(result):
+    achieved = result["sent_per_second"] if result["received_per_second"] is None else result["received_per_second"]
+    return achieved < SATURATION * result["rate"]
+
+
+# Doubles the offered rate from start until a step saturates or max_rate is passed, and returns
+# every step plus the highest rate the server kept up with
+def saturate(target, mode, start=1000, max_rate=1_000_000, duration=2.0, connections=1, burst=DEFAULT_BURST, framed=False):
+    steps, sustained, rate = [], None, start
+    while rate <= max_rate:
+        result = step(target, mode, rate, duration, connections, burst, framed)
+        steps.append(result)
+        if saturated(result):
+            break
+        sustained = rate
+        rate *= 2
+    return {"mode": mode, "connections": connections, "sustained_rate": sustained,
+            "peak_received_per_second": max((r["received_per_second"] or r["sent_per_second"] for r in steps), default=0), "steps": steps}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive a machine's listening port with synthetic traffic at rising rates and report where its server saturates")
+    parser.add_argument("--mode", choices=MODES + ("all",), default="all")
+    parser.add_argument("--start", type=int, default=1000, help="messages per second of the first step; each step doubles it")
+    parser.add_argument("--max-rate", type=int, default=1_000_000)
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per step")
+    parser.add_argument("--connections", type=int, default=None, help=f"connections to send over (default: 1, or {DEFAULT_CONNECTIONS} in connections mode)")
+    parser.add_argument("--burst", type=int, default=DEFAULT_BURST, help="writes per burst in bursty mode")
+    parser.add_argument("--framed", action="store_true", help="send frames instead of bare timestamps")
+    parser.add_argument("--consume-rate", type=float, default=6, help="messages per second taken from the queue, one per clock cycle at this tick rate")
+    parser.add_argument("--queue-size", type=int, default=None)
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=OVERFLOW_BLOCK)
+    parser.add_argument("--target", default=None, help="host:port of a running machine to drive instead of a server in this process (Lamport clocks only)")
+    parser.add_argument("--metrics", default=None, help="with --target, the machine's metrics URL, e.g. http://127.0.0.1:9100/metrics, to read what it received")
+    parser.add_argument("--profile", default=None, help="profile the server thread and write pstats to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.target:
+        target = RemoteTarget(peer_address(["127.0.0.1"], args.target), args.metrics)
+    else:
+        target = Target(args.consume_rate, args.queue_size, args.overflow, profile=args.profile is not None)
+    modes = MODES if args.mode == "all" else (args.mode,)
+    results = [saturate(target, mode, args.start, args.max_rate, args.duration,
+                        args.connections or (DEFAULT_CONNECTIONS if mode == MODE_CONNECTIONS else 1), args.burst, args.framed) for mode in modes]
+    if args.profile and not args.target:
+        stats = target.stats()
+        stats.dump_stats(args.profile)
+    target.close()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    print(f"{'mode':11} {'conns':>5} {'rate':>7} {'sent/s':>7} {'gen cpu':>7} {'recv/s':>7} {'queue/s':>7} {'peak queue':>10} {'server cpu':>10} "
+          f"{'us/msg':>6} {'p50 us':>7} {'p99 us':>8} {'catch up ms':>11}")
+    for r in results:
+        for s in r["steps"]:
+            print(f"{s['mode']:11} {s['connections']:5} {s['rate']:7} {s['sent_per_second']:7} {s['generator_cpu_share']:7} {str(s['received_per_second']):>7} {str(s['queue_growth_per_second']):>7} "
+                  f"{str(s['peak_queue']):>10} {str(s['server_cpu_share']):>10} {str(s['server_cpu_us_per_message']):>6} {str(s['p50_us']):>7} {str(s['p99_us']):>8} {str(s['catch_up_ms']):>11}")
+        if saturated(r["steps"][-1]):
+            print(f"{r['mode']} saturates above {r['sustained_rate']} messages/s offered, peaking at {r['peak_received_per_second']} received/s")
+        else:
+            print(f"{r['mode']} kept up with every rate up to {r['sustained_rate']} messages/s")
+    if args.profile and not args.target:
+        print(f"\nserver thread profile (all of it in {args.profile}):")
+        stats.stream = sys.stdout
+        stats.sort_stats("cumulative").print_stats(PROFILED, 20)
+    return results
+
+
+if __name__ == '__main__':
+    main()
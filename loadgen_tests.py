@@ -0,0 +1,36 @@
+import unittest
+from unittest import mock
+import io
+import loadgen
+from metrics import MachineMetrics
+from message_queue import MessageQueue
+
+class TestLoadgen(unittest.TestCase):
+    def test_schedules(self):
+        self.assertEqual([(0.0, 0), (0.25, 1), (0.5, 2), (0.75, 0)], list(loadgen.schedule(loadgen.MODE_CONNECTIONS, 4, 1, connections=3)))
+        self.assertEqual([(0.0, 0), (0.0, 0), (0.5, 0), (0.5, 0)], list(loadgen.schedule(loadgen.MODE_BURSTY, 4, 1, burst=2)))
+
+    @mock.patch("loadgen.urlopen")
+    def test_scrape(self, mock_urlopen):
+        machine = MachineMetrics(11113, MessageQueue())
+        machine.messages.put_many([1, 2])
+        machine.add_received(("127.0.0.1", 5000), 7)
+        machine.add_received(("127.0.0.1", 5001), 3)
+        mock_urlopen.return_value.__enter__.return_value = io.BytesIO(machine.render().encode())
+        self.assertEqual((10, 2), loadgen.scrape("http://127.0.0.1:9100/metrics"))
+
+    def test_step_against_server(self):
+        target = loadgen.Target(consume_rate=1000)
+        self.addCleanup(target.close)
+        for mode in loadgen.MODES:
+            with self.subTest(mode=mode):
+                result = loadgen.step(target, mode, 2000, duration=0.2, connections=8 if mode == loadgen.MODE_CONNECTIONS else 1, burst=50)
+                self.assertEqual(2000, result["rate"])
+                self.assertLess(0, result["received_per_second"])
+                self.assertLess(result["catch_up_ms"], loadgen.DRAIN_TIMEOUT * 1000) # every message sent was enqueued
+                self.assertLess(0, result["server_cpu_share"])
+                self.assertFalse(loadgen.saturated(dict(result, received_per_second=1800)))
+                self.assertTrue(loadgen.saturated(dict(result, received_per_second=1700)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+import struct, time, atexit, sys, os
+from datetime import datetime
+
+
+# Event types recorded by every machine
+EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL = 0, 1, 2
+
+# Binary logs start with a small header followed by fixed-size little-endian records of the
+# form (event type, wall time in ns since the epoch, logical clock, message queue size).
+# Version 2 records, written by sinks with message_ids, add the message's (sender, sequence number) ID
+BINARY_MAGIC = b"LCLG"
+BINARY_VERSION = 1
+BINARY_VERSION_IDS = 2
+HEADER = struct.Struct("<4sB")
+RECORD = struct.Struct("<BqQI")
+RECORD_IDS = struct.Struct("<BqQIIQ")
+
+
+# Formats one log record exactly as the original machines wrote it to log{port}.txt, followed
+# by the message ID for sent and received messages that have one (sender 0 means none)
+def format_record(event, wall_ns, clock, queue_depth, sender=0, seq=0):
+    return _format_line(event, system_time(wall_ns // 1_000_000_000), clock, queue_depth, sender, seq)
+
+
+# Formats a wall time in whole seconds since the epoch as the local time of day, as in the logs
+def system_time(second):
+    return datetime.fromtimestamp(second).strftime("%H:%M:%S")
+
+
+def _format_line(event, system_time, clock, queue_depth, sender, seq):
+    message_id = ", message id " + str(sender) + ":" + str(seq) if sender else ""
+    if event == EVENT_RECEIVED:
+        return "Received a message: system time " + system_time + ", logical clock time " + str(clock) + ", remaining message queue size " + str(queue_depth) + message_id + "\n"
+    if event == EVENT_SENT:
+        return "Sent a message: system time " + system_time + ", logical clock time " + str(clock) + message_id + "\n"
+    return "Internal event: system time " + system_time + ", logical clock time " + str(clock) + "\n"
+
+
+# Parses one text log line back into (event, seconds since midnight, logical clock, queue size),
+# returning None for lines that are not log records. Sent and internal events have queue size None
+def parse_record(line):
+    head, sep, rest = line.partition(": system time ")
+    event = _EVENT_NAMES.get(head)
+    if event is None or not sep:
+        return None
+    try:
+        hours, minutes, seconds = rest[0:2], rest[3:5], rest[6:8]
+        fields = rest[9:].split(", ")
+        clock = int(fields[0].rpartition(" ")[2])
+        queue_depth = int(fields[1].rpartition(" ")[2]) if event == EVENT_RECEIVED and len(fields) > 1 else None
+        return event, int(hours) * 3600 + int(minutes) * 60 + int(seconds), clock, queue_depth
+    except (ValueError, IndexError):
+        return None
+
+_EVENT_NAMES = {"Received a message": EVENT_RECEIVED, "Sent a message": EVENT_SENT, "Internal event": EVENT_INTERNAL}
+
+
+# Returns the (sender, sequence number) message ID at the end of a text log line, or None
+def parse_message_id(line):
+    _, sep, message_id = line.rpartition(", message id ")
+    if not sep:
+        return None
+    sender, _, seq = message_id.partition(":")
+    try:
+        return int(sender), int(seq)
+    except ValueError:
+        return None
+
+
+# Per-machine log sink that keeps its file open and buffers records in memory, flushing them
+# every flush_every records, every flush_interval_ms milliseconds, and on close/shutdown.
+# Records are stamped with clock(), the wall time in ns, unless given a time explicitly.
+# Binary sinks only keep message IDs with message_ids, which selects the wider version 2 records.
+# Recording allocates as little as possible: text sinks format the time of day once per second,
+# and binary sinks pack records into a preallocated buffer
+class LogSink():
+    def __init__(self, path, flush_every=256, flush_interval_ms=1000, binary=False, clock=time.time_ns, message_ids=False):
+        self.path = path
+        self.clock = clock
+        self.message_ids = message_ids
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval_ms / 1000 if flush_interval_ms else None
+        self.binary = binary
+        self.file = None # opened lazily on the first flush so that idle machines create no files
+        self.buffer = bytearray(RECORD_IDS.size * min(flush_every or 256, 4096)) if binary else []
+        self.used = 0 # bytes of the binary buffer holding records
+        self.second = None # wall time second whose time of day is in system_time
+        self.system_time = None
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    # Returns a sink writing to the conventional log file of the machine listening on port, or
+    # with columnar, a columnar.ColumnarSink writing to the log{port}.cols table
+    @classmethod
+    def for_machine(cls, port, directory=".", columnar=False, **options):
+        if columnar:
+            from columnar import ColumnarSink # columnar.py reads logs with this module
+            return ColumnarSink.for_machine(port, directory, **options)
+        return cls(os.path.join(directory, f"log{port}.{'bin' if options.get('binary') else 'txt'}"), **options)
+
+    # Buffers one record, flushing if the count or time threshold has been reached. peer, the
+    # machine a message went to, is only kept by columnar sinks
+    def record(self, event, clock, queue_depth=0, wall_ns=None, sender=0, seq=0, peer=0):
+        if wall_ns is None:
+            wall_ns = self.clock()
+        if not self.binary:
+            second = wall_ns // 1_000_000_000
+            if second != self.second:
+                self.second, self.system_time = second, system_time(second)
+            self.buffer.append(_format_line(event, self.system_time, clock, queue_depth, sender, seq))
+        else:
+            record = RECORD_IDS if self.message_ids else RECORD
+            if self.used + record.size > len(self.buffer):
+                self.buffer.extend(bytes(len(self.buffer) + record.size))
+            if self.message_ids:
+                record.pack_into(self.buffer, self.used, event, wall_ns, clock, queue_depth, sender, seq)
+            else:
+                record.pack_into(self.buffer, self.used, event, wall_ns, clock, queue_depth)
+            self.used += record.size
+        self.pending += 1
+        if self.flush_every and self.pending >= self.flush_every:
+            self.flush()
+        elif self.flush_interval is not None and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Writes all buffered records to the log file
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        if self.file is None:
+            self._open()
+        if self.binary:
+            with memoryview(self.buffer) as view:
+                self.file.write(view[:self.used])
+            self.used = 0
+        else:
+            self.file.write("".join(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+        self.pending = 0
+
+    # Flushes buffered records and returns the length of the log file, which a checkpoint keeps
+    def position(self):
+        self.flush()
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    # Cuts the log file back to position, dropping buffered records too, when a machine restarts
+    # from a checkpoint taken at that position
+    def truncate(self, position):
+        if not self.binary:
+            self.buffer.clear()
+        self.used = self.pending = 0
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            atexit.unregister(self.close)
+        if os.path.exists(self.path):
+            os.truncate(self.path, position)
+
+    # Flushes remaining records and closes the log file
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Opens the log file for appending, writing the binary header if the file is new
+    def _open(self):
+        if self.binary:
+            self.file = open(self.path, "ab")
+            if self.file.tell() == 0:
+                self.file.write(HEADER.pack(BINARY_MAGIC, BINARY_VERSION_IDS if self.message_ids else BINARY_VERSION))
+        else:
+            self.file = open(self.path, "a")
+        atexit.register(self.close) # make sure buffered records survive interpreter shutdown
+
+
+# Streams the records of a binary log file as (event, wall_ns, clock, queue_depth) tuples, or
+# with message_ids as (event, wall_ns, clock, queue_depth, sender, seq) tuples (sender 0 if the
+# log has no message IDs)
+def read_binary_log(path, chunk_records=4096, message_ids=False):
+    with open(path, "rb") as f:
+        magic, version = HEADER.unpack(f.read(HEADER.size))
+        if magic != BINARY_MAGIC or version not in (BINARY_VERSION, BINARY_VERSION_IDS):
+            raise ValueError(f"{path} is not a version {BINARY_VERSION} or {BINARY_VERSION_IDS} binary machine log")
+        record = RECORD_IDS if version == BINARY_VERSION_IDS else RECORD
+        while True:
+            chunk = f.read(record.size * chunk_records)
+            if not chunk:
+                return
+            usable = len(chunk) - len(chunk) % record.size # ignore a torn trailing record
+            records = record.iter_unpack(memoryview(chunk)[:usable])
+            if message_ids == (record is RECORD_IDS):
+                yield from records
+            elif message_ids:
+                yield from (r + (0, 0) for r in records)
+            else:
+                yield from (r[:4] for r in records)
+
+
+# Converts a binary log file into the text format written by the original machines
+def convert_binary_log(src, dst):
+    with open(dst, "w") as out:
+        for record in read_binary_log(src, message_ids=True):
+            out.write(format_record(*record))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("usage: python logsink.py <binary log> <text log>")
+    convert_binary_log(sys.argv[1], sys.argv[2])
@@ -0,0 +1,95 @@
+import unittest
+from unittest import mock
+import os
+import tempfile
+from datetime import datetime
+import logsink
+
+WALL_NS = int(datetime(2023, 3, 1, 10, 46, 42).timestamp() * 1e9)
+
+class TestLogSink(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "log11113.txt")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_format_record_matches_original_lines(self):
+        self.assertEqual("Received a message: system time 10:46:42, logical clock time 9, remaining message queue size 0\n", logsink.format_record(logsink.EVENT_RECEIVED, WALL_NS, 9, 0))
+        self.assertEqual("Sent a message: system time 10:46:42, logical clock time 10\n", logsink.format_record(logsink.EVENT_SENT, WALL_NS, 10, 0))
+        self.assertEqual("Internal event: system time 10:46:42, logical clock time 11\n", logsink.format_record(logsink.EVENT_INTERNAL, WALL_NS, 11, 0))
+
+    def test_parse_record(self):
+        self.assertEqual((logsink.EVENT_RECEIVED, 38802, 9, 0), logsink.parse_record("Received a message: system time 10:46:42, logical clock time 9, remaining message queue size 0\n"))
+        self.assertEqual((logsink.EVENT_SENT, 38802, 10, None), logsink.parse_record("Sent a message: system time 10:46:42, logical clock time 10\n"))
+        self.assertEqual((logsink.EVENT_INTERNAL, 38802, 11, None), logsink.parse_record("Internal event: system time 10:46:42, logical clock time 11"))
+        self.assertIsNone(logsink.parse_record("Machine 11113 has tick rate 3\n"))
+        self.assertIsNone(logsink.parse_record("Internal event: system time 10:46:42, logical clock time \n"))
+
+    def test_for_machine_picks_extension(self):
+        self.assertEqual(os.path.join(".", "log11113.txt"), logsink.LogSink.for_machine(11113).path)
+        self.assertEqual(os.path.join("runs", "log11113.txt"), logsink.LogSink.for_machine(11113, directory="runs").path)
+        self.assertEqual(os.path.join(".", "log11113.bin"), logsink.LogSink.for_machine(11113, binary=True).path)
+
+    def test_records_buffered_until_flush_every(self):
+        sink = logsink.LogSink(self.path, flush_every=3, flush_interval_ms=None)
+        sink.record(logsink.EVENT_INTERNAL, 1, wall_ns=WALL_NS)
+        sink.record(logsink.EVENT_INTERNAL, 2, wall_ns=WALL_NS)
+        self.assertFalse(os.path.exists(self.path))
+        sink.record(logsink.EVENT_INTERNAL, 3, wall_ns=WALL_NS)
+        with open(self.path) as f:
+            self.assertEqual(3, len(f.readlines()))
+        sink.close()
+
+    def test_flush_interval(self):
+        sink = logsink.LogSink(self.path, flush_every=None, flush_interval_ms=50)
+        with mock.patch("time.monotonic", return_value=sink.last_flush + 0.01):
+            sink.record(logsink.EVENT_INTERNAL, 1, wall_ns=WALL_NS)
+        self.assertEqual(1, sink.pending)
+        with mock.patch("time.monotonic", return_value=sink.last_flush + 0.06):
+            sink.record(logsink.EVENT_INTERNAL, 2, wall_ns=WALL_NS)
+        self.assertEqual(0, sink.pending)
+        sink.close()
+
+    def test_close_flushes_and_appends(self):
+        with open(self.path, "w") as f:
+            f.write("Internal event: system time 10:46:41, logical clock time 1\n")
+        with logsink.LogSink(self.path) as sink:
+            sink.record(logsink.EVENT_SENT, 2, wall_ns=WALL_NS)
+        with open(self.path) as f:
+            self.assertEqual(["Internal event: system time 10:46:41, logical clock time 1\n", "Sent a message: system time 10:46:42, logical clock time 2\n"], f.readlines())
+
+    def test_position_and_truncate(self):
+        sink = logsink.LogSink(self.path, flush_every=None, flush_interval_ms=None)
+        self.assertEqual(0, sink.position())
+        sink.record(logsink.EVENT_INTERNAL, 1, wall_ns=WALL_NS)
+        position = sink.position()
+        sink.record(logsink.EVENT_INTERNAL, 2, wall_ns=WALL_NS)
+        sink.flush()
+        sink.record(logsink.EVENT_INTERNAL, 3, wall_ns=WALL_NS)
+        sink.truncate(position)
+        sink.record(logsink.EVENT_INTERNAL, 4, wall_ns=WALL_NS)
+        sink.close()
+        with open(self.path) as f:
+            self.assertEqual(["Internal event: system time 10:46:42, logical clock time 1\n", "Internal event: system time 10:46:42, logical clock time 4\n"], f.readlines())
+
+    def test_binary_log_converts_to_text(self):
+        binary_path = os.path.join(self.dir.name, "log11113.bin")
+        records = [(logsink.EVENT_INTERNAL, WALL_NS, 1, 0), (logsink.EVENT_RECEIVED, WALL_NS, 9, 4), (logsink.EVENT_SENT, WALL_NS + 10**9, 10, 0)]
+        with logsink.LogSink(binary_path, flush_every=2, binary=True) as sink:
+            for event, wall_ns, clock, depth in records:
+                sink.record(event, clock, depth, wall_ns=wall_ns)
+        self.assertEqual(records, list(logsink.read_binary_log(binary_path)))
+        logsink.convert_binary_log(binary_path, self.path)
+        with open(self.path) as f:
+            self.assertEqual("".join(logsink.format_record(*r) for r in records), f.read())
+
+    def test_read_binary_log_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"Internal event")
+        with self.assertRaises(ValueError):
+            list(logsink.read_binary_log(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,87 @@
-import socket, selectors, types, struct
+import socket, selectors, types, os
 import random, time, threading
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
+from logsink import LogSink, EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+from message_queue import MessageQueue, OVERFLOW_BLOCK, OVERFLOW_BACKPRESSURE
+from framing import FRAMED_MAGIC
+from clocks import CLOCK_LAMPORT, Message, make_clock, needs_frames, new_decoder
+from scheduler import TickScheduler, POLICY_CATCH_UP
+from metrics import MachineMetrics, MetricsServer
+from shm_transport import ShmLink, DEFAULT_CAPACITY, is_local, link_handlers
+from netem import EmulatedLink, loses_messages
+from flow import FlowControl, FlowReporter, FLOW_UPDATE, FRAME_FLOW_REQUEST, DEFAULT_WINDOW
+from checkpoint import Checkpointer, DEFAULT_EVERY, checkpoint_path, read, restore
+from workload import SEND_ONE, SEND_ALL, compile as compile_workload, from_weights
+try: 
+    import numpy
+except ImportError: # optional, only needed to draw random choices with DRAW_NUMPY
+    numpy = None
 
 
-# Class representing each of the 3 model machines
+# Class representing each of the model machines (3 by default, see cluster.py for N)
 class Machine(): 
-    def __init__(self, config): 
-        self.messages = [] # message queue containing other machines' timestamps
-        self.config = config # network config of the form [host, listening port, port to connect to, port to connect to]
+    def __init__(self, config, log_options=None, queue_size=None, overflow=OVERFLOW_BLOCK, client_options=None, metrics_port=None): 
+        self.messages = MessageQueue(queue_size, overflow) # message queue containing other machines' timestamps
+        self.config = config # network config of the form [host, listening port, port to connect to, ...]
+        self.log_options = log_options or {} # options for the machine's LogSink, e.g. flush policy or binary format
+        self.client_options = client_options or {} # extra Client options, e.g. framed or coalesce
+        self.metrics_port = metrics_port # if set, metrics are served at http://127.0.0.1:{metrics_port}/metrics
     
     def run(self): 
-        threading.Thread(target = Server(self.config, self.messages).run).start() # start "server" component of machine
-        time.sleep(5) # ensure all machines are up and listening properly
-        threading.Thread(target = Client(self.config, self.messages).run).start() # start "client" component of machine
+        metrics = None
+        if self.metrics_port is not None: 
+            metrics = MachineMetrics(self.config[1], self.messages)
+            MetricsServer(metrics, self.metrics_port).start()
+        threading.Thread(target = Server(self.config, self.messages, metrics).run).start() # start "server" component of machine
+        # the client retries connecting to machines that are not listening yet (see connect)
+        threading.Thread(target = Client(self.config, self.messages, LogSink.for_machine(self.config[1], **self.log_options), metrics=metrics, **self.client_options).run).start() # start "client" component of machine
+
+
+# How a client consumes its message queue in cycles that find messages in it
+CONSUME_ONE = "one" # one message per cycle, as originally
+CONSUME_BATCH = "batch" # up to consume_batch messages per cycle, merging them one by one
+CONSUME_DRAIN = "drain" # every queued message, merged at once (a single max() for Lamport clocks)
+CONSUME_POLICIES = (CONSUME_ONE, CONSUME_BATCH, CONSUME_DRAIN)
+# Whether a cycle that consumes several messages logs one received record per message, or a single
+# record with the resulting clock and remaining queue size
+LOG_EACH = "each"
+LOG_SUMMARY = "summary"
+
+DRAW_BLOCK = 1024 # random choices drawn at once by a client, so that cycles need not call into random
+# How a client draws its blocks of random choices. Both take every choice from the client's rng,
+# so a seed gives the same run every time with the same backend, but not across backends
+DRAW_RANDOM = "random" # random.choices
+DRAW_NUMPY = "numpy" # a NumPy generator seeded from rng, cheaper per choice (needs NumPy)
+DRAW_BACKENDS = (DRAW_RANDOM, DRAW_NUMPY)
+
+# Connecting to a machine that is not listening (yet) is retried with exponential backoff, from
+# CONNECT_RETRY_FIRST to CONNECT_RETRY_MAX seconds between attempts, for up to CONNECT_TIMEOUT
+# seconds at startup and for as long as it takes when reopening a broken connection. An attempt
+# to reach a host that does not answer gives up after CONNECT_ATTEMPT_TIMEOUT seconds
+CONNECT_RETRY_FIRST = 0.001
+CONNECT_RETRY_MAX = 0.5
+CONNECT_TIMEOUT = 30
+CONNECT_ATTEMPT_TIMEOUT = 2.0
+# TCP keepalive, so that a peer host that vanishes without closing its connections is noticed:
+# probes start after KEEPALIVE_IDLE idle seconds, every KEEPALIVE_INTERVAL seconds, and the
+# connection breaks after KEEPALIVE_COUNT unanswered ones
+KEEPALIVE_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_COUNT = 10, 5, 3
+
+RING_POLL = 0.01 # longest a message can wait in a shared memory ring if its doorbell is lost
+# How long the server keeps polling shared memory rings before it goes idle. Messages that arrive
+# meanwhile need no doorbell, but spinning only pays off when the sender has a core of its own
+DEFAULT_RING_SPIN = 0.00005 if (os.cpu_count() or 1) > 1 else 0
 
 
 # Each machine has a "server" component represented by this class, responsible for
 # accepting connections from other machines and constantly receiving messages into the queue
 class Server(): 
-    def __init__(self, config, messages): 
-        # Establish listening socket so that other machines can connect
+    def __init__(self, config, messages, metrics=None, ring_spin=DEFAULT_RING_SPIN): 
+        # Establish listening socket so that other machines can connect, reusing the port even if
+        # connections of a previous run of this machine linger in TIME_WAIT, so that it can restart
         self.lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM) 
+        self.lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.lsock.bind((config[0], config[1]))
         self.lsock.listen() 
         self.lsock.setblocking(False) 
@@ -30,110 +90,526 @@ class Server():
         self.sel = selectors.DefaultSelector() 
         self.sel.register(self.lsock, selectors.EVENT_READ, data=None)
         self.messages = messages
+        self.metrics = metrics
+        self.rings = {} # connection -> its data, for connections whose peer sends through shared memory
+        self.flows = {} # connection -> its data, for connections whose peer asked for flow control (see flow.py)
+        self.ring_spin = ring_spin
 
     # Accepts new connection from another machine, registering read events from that socket 
     # in selector, so that we know when there are messages to receive into messages queue
     def accept_wrapper(self): 
         conn, addr = self.lsock.accept() 
         conn.setblocking(False) 
-        data = types.SimpleNamespace(addr=addr)
+        tune(conn)
+        data = types.SimpleNamespace(addr=addr, ring=None, flow=None)
+
+        def attached(ring): # the peer moved this connection to a shared memory ring
+            data.ring, data.ring_decoder = ring, new_decoder()
+            data.ring_decoder.feed(FRAMED_MAGIC)
+            self.rings[conn] = data
+
+        def flow_requested(payload): # the peer wants to hear how many of its messages are queued
+            data.flow = FlowReporter(conn)
+            self.flows[conn] = data
+
+        handlers = link_handlers(attached)
+        handlers[FRAME_FLOW_REQUEST] = flow_requested
+        data.decoder = new_decoder(handlers)
         self.sel.register(conn, selectors.EVENT_READ, data=data)
 
-    # Receives timestamp message from connection and enqueues into message queue
+    # Receives every complete timestamp message available on the connection and enqueues them
+    # into message queue, closing the connection if the other machine disconnected
     def service_connection(self, key, mask): 
         sock = key.fileobj
-        raw_time = self.recvall(sock, 4)
-        time = int(struct.unpack('>I', raw_time)[0])
-        self.messages.append(time)
+        try: 
+            times = key.data.decoder.receive(sock)
+        except BlockingIOError: # spurious wakeup, nothing to read yet
+            return
+        except ConnectionError: 
+            times = None
+        if times is None: 
+            self.sel.unregister(sock)
+            sock.close()
+            self.flows.pop(sock, None)
+            if self.rings.pop(sock, None) is not None: 
+                self.enqueue(key.data, key.data.ring_decoder.feed(key.data.ring.read()))
+                key.data.ring.close()
+            return
+        self.enqueue(key.data, times)
+
+    # Receives every complete timestamp message available in a connection's shared memory ring
+    def service_ring(self, data): 
+        self.enqueue(data, data.ring_decoder.feed(data.ring.read()))
+
+    def enqueue(self, data, times): 
+        if not times: 
+            return
+        self.messages.put_many(times)
+        if data.flow is not None: 
+            data.flow.received += len(times)
+        if self.metrics is not None: 
+            self.metrics.add_received(data.addr, len(times))
+        if self.messages.overflow == OVERFLOW_BACKPRESSURE and self.messages.full(): 
+            self.messages.wait_not_full() # stop reading from peers until the client catches up, so their sends back up
         
-    # Helper function that receives all n bytes from specified socket
-    def recvall(self, sock, n): 
-        data = bytearray() 
-        while len(data) < n: 
-            packet = sock.recv(n - len(data))
-            if not packet: return None 
-            data.extend(packet) 
-        return data
-
-    # Main loop that listens for socket activity
+    # Main loop that listens for socket activity, and drains the shared memory rings after every
+    # wakeup. Flow-controlled peers are then told how much of the queue is theirs; while there are
+    # any, the loop also wakes every FLOW_UPDATE seconds, as the client draining the queue frees credits
     def run(self): 
         while True: 
-            events = self.sel.select(timeout=None) 
+            timeout = self._arm_rings()
+            if self.flows: 
+                timeout = FLOW_UPDATE if timeout is None else min(timeout, FLOW_UPDATE)
+            events = self.sel.select(timeout=timeout) 
             for key, mask in events: 
                 if key.data is None: # no data means new connection to accept
                     self.accept_wrapper() 
                 else: # data existing means old connection/machine sending a message that we should receive
                     self.service_connection(key, mask)
+            for data in list(self.rings.values()): 
+                self.service_ring(data)
+            for data in self.flows.values(): 
+                data.flow.report(len(self.messages))
+
+    # Tells shared memory peers that we are about to wait, so their next write rings the doorbell,
+    # and returns how long select may block. Without memory barriers a writer can miss the flag,
+    # so rings are also checked every RING_POLL seconds
+    def _arm_rings(self): 
+        if not self.rings: 
+            return None
+        if self.ring_spin: 
+            deadline = time.perf_counter() + self.ring_spin
+            while time.perf_counter() < deadline: 
+                if any(data.ring.pending() for data in self.rings.values()): 
+                    return 0
+        for data in self.rings.values(): 
+            data.ring.set_waiting()
+            if data.ring.pending(): 
+                return 0
+        return RING_POLL
+
+
+# Returns the (host, port) address of a peer listed in a config: either a port on the config's
+# own host, or "host:port" for a machine on another host (machines are still identified by
+# their listening port alone, so ports must be unique across hosts)
+def peer_address(config, peer): 
+    if isinstance(peer, str) and ":" in peer: 
+        host, _, port = peer.rpartition(":")
+        return host, int(port)
+    return config[0], peer
+
+
+# Disables Nagle's algorithm, so that every small send goes out at once instead of waiting for
+# the previous one to be acknowledged, and turns on keepalive probes where the platform has them
+def tune(sock): 
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"): 
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+
+
+# Opens the connection from the machine with the given config to peer, retrying for up to
+# retry_for seconds (forever if None) while it cannot be reached. sock, if given, is the socket
+# for the first attempt
+def connect(config, peer, framed, shm=False, shm_capacity=DEFAULT_CAPACITY, retry_for=0, sock=None): 
+    address = peer_address(config, peer)
+    deadline = None if retry_for is None else time.monotonic() + retry_for
+    delay = CONNECT_RETRY_FIRST
+    while True: 
+        if sock is None: 
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try: 
+            sock.settimeout(CONNECT_ATTEMPT_TIMEOUT)
+            sock.connect(address) 
+            break
+        except OSError: 
+            sock.close()
+            sock = None
+            if deadline is not None and time.monotonic() + delay > deadline: 
+                raise
+            time.sleep(delay)
+            delay = min(2 * delay, CONNECT_RETRY_MAX)
+    sock.setblocking(True)
+    tune(sock)
+    print(f"Machine {config[1]} connected to machine {peer}!")
+    if framed: 
+        sock.sendall(FRAMED_MAGIC)
+    return ShmLink(sock, shm_capacity) if shm and is_local(sock) else sock
+
+
+# Connects to all peers at once, so that startup waits for the slowest peer rather than for
+# every peer in turn. The sockets are created up front, in the order of peers
+def connect_all(config, peers, framed, shm=False, shm_capacity=DEFAULT_CAPACITY, retry_for=CONNECT_TIMEOUT): 
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_STREAM) for _ in peers]
+    if len(peers) <= 1: 
+        return {peer: connect(config, peer, framed, shm, shm_capacity, retry_for, sock) for peer, sock in zip(peers, socks)}
+    with ThreadPoolExecutor(max_workers=len(peers)) as pool: 
+        links = pool.map(lambda peer, sock: connect(config, peer, framed, shm, shm_capacity, retry_for, sock), peers, socks)
+        return dict(zip(peers, links))
 
 
 # Each machine also has a "client" component represented by this class, responsible for
 # connecting to other machines and reading messages from the queue, sending messages, or doing internal events
 class Client(): 
-    def __init__(self, config, messages):
-        # Connect to other 2 machines
-        self.sock1 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock1.setblocking(True)
-        self.sock1.connect((config[0], config[2])) 
-        print(f"Machine {config[1]} connected to machine {config[2]}!")
-        self.sock2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock2.setblocking(True) 
-        self.sock2.connect((config[0], config[3]))
-        print(f"Machine {config[1]} connected to machine {config[3]}!")
+    def __init__(self, config, messages, log=None, framed=False, coalesce=1, connections=None, rng=None, tick_range=(1, 6), event_weights=(2, 1, 7), schedule_policy=POLICY_CATCH_UP, metrics=None, clock_mode=CLOCK_LAMPORT, wall_clock=None, message_ids=False, shm=False, shm_capacity=DEFAULT_CAPACITY, netem=None, flow=None, flow_window=DEFAULT_WINDOW, consume=CONSUME_ONE, consume_batch=4, log_received=LOG_EACH, checkpoint_dir=None, checkpoint_every=DEFAULT_EVERY, resume=False, connect_timeout=CONNECT_TIMEOUT, workload=None, draws=DRAW_RANDOM):
+        # Connect to every other machine listed in the config (by port on the same host, or as
+        # "host:port"), all at once and waiting up to connect_timeout seconds for each one to
+        # listen, announcing the framed wire format if
+        # it is enabled (vector and hybrid stamps, message IDs and shared memory links only exist as
+        # frames). With shm, messages to machines on the same host go through shared memory rings
+        # instead (see shm_transport.py). Other runtimes can instead pass ready-made connections:
+        # any objects with a sendall method. A connection the client opened itself is reopened in
+        # the background if the machine at the other end goes away, e.g. to restart from a checkpoint
+        framed = framed or shm or flow is not None or needs_frames(clock_mode, message_ids)
+        if netem is not None and loses_messages(netem) and (clock_mode != CLOCK_LAMPORT or message_ids): 
+            raise ValueError("links that drop, reorder or partition need Lamport clocks without message IDs, whose stamps are not delta-encoded")
+        if flow is not None and (connections is not None or netem is not None or coalesce > 1): 
+            raise ValueError("flow control needs connections the client opens itself, without netem or coalescing")
+        if consume not in CONSUME_POLICIES: 
+            raise ValueError(f"unknown consumption policy {consume!r}, expected one of {CONSUME_POLICIES}")
+        if consume_batch < 1: 
+            raise ValueError(f"consume_batch must be at least 1, got {consume_batch}")
+        if log_received == LOG_SUMMARY and message_ids: 
+            raise ValueError("summarized received records would lose message IDs")
+        if draws not in DRAW_BACKENDS: 
+            raise ValueError(f"unknown draw backend {draws!r}, expected one of {DRAW_BACKENDS}")
+        if draws == DRAW_NUMPY and numpy is None: 
+            raise ValueError("drawing with NumPy needs NumPy installed")
+        self.own_connections = connections is None
+        if connections is None: 
+            connections = connect_all(config, config[2:], framed, shm, shm_capacity, connect_timeout)
 
         # Store network configuration/connections and messages queue
         self.config = config
         self.messages = messages
-        self.connections = {config[2]: self.sock1, config[3]: self.sock2}
+        self.connections = connections
+        self.peers = list(config[2:]) # ports of the machines this machine sends to
+        self.peer_ports = {peer: peer_address(config, peer)[1] for peer in self.peers} # what logs record them as, "host:port" peers by port
+        self.log = log if log is not None else LogSink.for_machine(config[1])
+
+        # With message_ids every message carries (this machine's port, sequence number), logged by
+        # both the sender and the receiver so that causal.py can match sends to receives
+        self.message_ids = message_ids
+        self.sequence = 0
+        if message_ids: 
+            self.log.message_ids = True # binary logs need the wider records to keep the IDs
+
+        # Messages consumed per cycle that finds the queue non-empty, and how they are logged
+        self.consume = consume
+        self.consume_batch = consume_batch
+        self.log_received = log_received
+
+        # Timestamps waiting to be sent to each machine; with coalesce > 1 they are held for that
+        # many clock cycles and then sent together in a single frame per machine
+        self.framed = framed
+        self.shm = shm
+        self.shm_capacity = shm_capacity
+        self.down = {} # port -> its reopened connection (None until then), for machines whose connection broke
+        self.coalesce = coalesce
+        self.outbox = {port: [] for port in self.connections}
+        self.cycles = 0
+
+        # Initialize logical clock (Lamport, vector or hybrid, see clocks.py; hybrid clocks read
+        # physical time in ns from wall_clock) with one stamp encoder per connection, and clock tick
+        # rate, drawing all random choices from rng (the random module by default) so that runs can be seeded per machine
+        self.clock = make_clock(clock_mode, config[1], wall_clock)
+        self.draws = draws
+        self.encoders = {port: self.clock.encoder(framed, config[1] if message_ids else None) for port in self.connections}
+        self.rng = rng if rng is not None else random
+        self.workload = compile_workload(workload, config[1], self.peers) if workload is not None else from_weights(event_weights, config[1], self.peers)
+        self.tick = self.rng.randint(*(self.workload.tick_range or tick_range))
+
+        # With flow (a flow control policy, see flow.py), each machine may have at most flow_window
+        # messages queued or in flight at every receiver, and the policy decides what happens to the rest
+        self.flow = None
+        self.flow_policy, self.flow_window = flow, flow_window
+        if flow is not None: 
+            self.flow = {port: self._flow_control(link) for port, link in self.connections.items()}
+
+        # With netem (a netem.LinkProfile), every connection goes through an emulated link that
+        # delays, throttles, drops, reorders or partitions what is sent over it
+        if netem is not None: 
+            self.connections = {port: EmulatedLink(link, netem, lambda port=port: connect(config, port, framed, shm, shm_capacity), random.Random(self.rng.random()))
+                                for port, link in self.connections.items()}
 
-        # Initialize logical clock and clock tick rate
-        self.logical_clock = 0 
-        self.tick = random.randint(1, 6)
+        # Cycles without a message to read send to one machine, send to all machines or perform an
+        # internal event, as a workload decides (see workload.py): either a spec, which can give
+        # each machine its own event and target weights, phases and recorded events to replay, or
+        # just event_weights, relative weights of the three events (by default the original 2/10,
+        # 1/10 and 7/10) with every machine equally likely to get a single message. Each phase is
+        # compiled into tables holding every event and machine as often as its weight, so drawing
+        # from one costs the same however many machines there are. Draws come DRAW_BLOCK at a time,
+        # from the trace being replayed while it lasts
+        self._enter_phase()
+        self.one_peer = [None] # reused list of the single machine a message goes to
+        self.one_message = [None] # reused list of the single message sent when not coalescing
+
+        # Clock cycles are paced by a TickScheduler, created when the machine starts running so
+        # that it uses the final tick rate
+        self.schedule_policy = schedule_policy
+        self.scheduler = None
+
+        # Optional MachineMetrics to report events, sends and cycle timings into
+        self.metrics = metrics
+        if metrics is not None: 
+            metrics.client = self
+
+        # With checkpoint_dir, the machine's state is saved there every checkpoint_every clock
+        # cycles (see checkpoint.py), and with resume it starts from its latest checkpoint, if any
+        self.checkpointer = None
+        if checkpoint_dir is not None: 
+            path = checkpoint_path(config[1], checkpoint_dir)
+            snapshot = read(path) if resume else None
+            if snapshot is not None: 
+                restore(self, snapshot)
+                print(f"Machine {config[1]} resumed from its checkpoint after {self.cycles} cycles, at logical clock time {self.clock.scalar()}")
+            self.checkpointer = Checkpointer(path, checkpoint_every)
         print(f"Machine {config[1]} has tick rate {self.tick}")
     
-    # Reads a message from the message queue if queue non-empty, updating logical clock
-    # as appropriate, and returns True; otherwise, does nothing and returns False
+    # The logical clock time as logged: the Lamport time, or the scalar summary of a vector or hybrid clock
+    @property
+    def logical_clock(self): 
+        return self.clock.scalar()
+
+    @logical_clock.setter
+    def logical_clock(self, value): 
+        self.clock.set(value)
+
+    # Reads a message (or, depending on the consumption policy, several) from the message queue
+    # if queue non-empty, updating logical clock as appropriate, and returns True; otherwise,
+    # does nothing and returns False
     def read_message(self): 
         if not self.messages: 
             return False
-        time = self.messages.pop(0) # get the left-most/earliest message in the list/queue
-        self.logical_clock = max(self.logical_clock, time) + 1
-        with open(f"log{self.config[1]}.txt", "a+") as f: 
-            f.write("Received a message: system time " + datetime.now().strftime("%H:%M:%S") + ", logical clock time " + str(self.logical_clock) + ", remaining message queue size " + str(len(self.messages)) + "\n")
+        if self.consume != CONSUME_ONE: 
+            self.read_messages()
+            return True
+        message = self.messages.pop() # get the left-most/earliest message in the queue
+        if isinstance(message, Message): 
+            self.clock.merge(message.stamp)
+            self.log.record(EVENT_RECEIVED, self.clock.scalar(), len(self.messages), sender=message.sender, seq=message.seq)
+        else: 
+            self.clock.merge(message)
+            self.log.record(EVENT_RECEIVED, self.clock.scalar(), len(self.messages))
+        if self.metrics is not None: 
+            self.metrics.events[EVENT_RECEIVED] += 1
         return True
+
+
+    # Consumes up to consume_batch messages, or all of them when draining, as one receive event
+    def read_messages(self): 
+        batch = self.messages.drain(self.consume_batch if self.consume == CONSUME_BATCH else None)
+        if self.consume == CONSUME_DRAIN: 
+            self.clock.merge_all([message.stamp if isinstance(message, Message) else message for message in batch])
+        remaining = len(self.messages)
+        for i, message in enumerate(batch): 
+            stamp, sender, seq = message if isinstance(message, Message) else (message, 0, 0)
+            if self.consume == CONSUME_BATCH: 
+                self.clock.merge(stamp)
+            if self.log_received == LOG_EACH: # queue size as if the rest of the batch were still queued
+                self.log.record(EVENT_RECEIVED, self.clock.scalar(), remaining + len(batch) - 1 - i, sender=sender, seq=seq)
+        if self.log_received == LOG_SUMMARY: 
+            self.log.record(EVENT_RECEIVED, self.clock.scalar(), remaining)
+        if self.metrics is not None: 
+            self.metrics.events[EVENT_RECEIVED] += len(batch)
             
-    # Sends message to machine at specified ports, incrementing logical clock once
+    # Sends message to machine at specified ports, incrementing logical clock once. Without
+    # coalescing each message is sent right away, otherwise it waits in the outbox
     def write_message(self, ports): 
-        self.logical_clock += 1
-        with open(f"log{self.config[1]}.txt", "a+") as f: 
-            for port in ports:
-                self.connections[port].sendall(struct.pack('>I', self.logical_clock))
-                f.write("Sent a message: system time " + datetime.now().strftime("%H:%M:%S") + ", logical clock time " + str(self.logical_clock) + "\n")
+        self.clock.local()
+        stamp, logical_clock = self.clock.stamp(), self.clock.scalar()
+        one_message = self.one_message if self.coalesce <= 1 else None
+        for port in ports:
+            if self.message_ids: 
+                self.sequence += 1
+                message = (self.sequence, stamp)
+                self.log.record(EVENT_SENT, logical_clock, sender=self.config[1], seq=self.sequence, peer=self.peer_ports[port])
+            else: 
+                message = stamp
+                self.log.record(EVENT_SENT, logical_clock, peer=self.peer_ports[port])
+            if self.flow is not None: 
+                if port not in self.down or self._link_up(port): 
+                    ready = self.flow[port].offer(message)
+                    if ready: 
+                        self.send(port, ready)
+            elif one_message is None: 
+                self.outbox[port].append(message)
+            else: 
+                one_message[0] = message
+                self.send(port, one_message)
+            if self.metrics is not None: 
+                self.metrics.events[EVENT_SENT] += 1
+                self.metrics.sent[port] = self.metrics.sent.get(port, 0) + 1
+
+    # Sends the messages that flow control held back and now has credits for
+    def release_flow(self): 
+        for port, flow in self.flow.items(): 
+            ready = flow.release() if port not in self.down else None
+            if ready: 
+                self.send(port, ready)
+
+    # Sends all pending timestamps, one send per machine
+    def flush_outbox(self): 
+        for port, pending in self.outbox.items(): 
+            if pending: 
+                self.send(port, pending)
+                pending.clear()
+
+    # Sends messages to the machine at port in one write. If its connection broke, they are lost
+    # until a background thread has reopened it
+    def send(self, port, messages): 
+        if port in self.down and not self._link_up(port): 
+            return
+        try: 
+            self.connections[port].sendall(self.encoders[port].encode(messages))
+        except OSError: 
+            if not self.own_connections: 
+                raise
+            print(f"Machine {self.config[1]} lost its connection to machine {port}")
+            self.connections[port].close()
+            self.down[port] = None
+            threading.Thread(target=self._reconnect, args=(port,), daemon=True).start()
+
+    # Reopens the connection to the machine at port, retrying with backoff until it is back
+    def _reconnect(self, port): 
+        self.down[port] = connect(self.config, port, self.framed, self.shm, self.shm_capacity, retry_for=None)
+
+    # Returns whether the connection to port is up again, switching to the reopened connection,
+    # with fresh stamp encoder and flow control state, as the other machine sees a new connection
+    def _link_up(self, port): 
+        link = self.down[port]
+        if link is None: 
+            return False
+        del self.down[port]
+        self.connections[port] = link
+        self.encoders[port] = self.clock.encoder(self.framed, self.config[1] if self.message_ids else None)
+        if self.flow is not None: 
+            self.flow[port] = self._flow_control(link)
+        return True
+
+    def _flow_control(self, link): 
+        return FlowControl(link.sock if isinstance(link, ShmLink) else link, self.flow_policy, self.flow_window)
     
     # Performs internal event, incrementing logical clock
     def internal_event(self): 
-        self.logical_clock += 1
-        with open(f"log{self.config[1]}.txt", "a+") as f: 
-            f.write("Internal event: system time " + datetime.now().strftime("%H:%M:%S") + ", logical clock time " + str(self.logical_clock) + "\n")
+        self.clock.local()
+        self.log.record(EVENT_INTERNAL, self.clock.scalar())
+        if self.metrics is not None: 
+            self.metrics.events[EVENT_INTERNAL] += 1
 
     # Main loop that infinitely runs each clock cycle of the machine
     def run(self): 
-        while True: 
-            self._perform_clock_cycle()
+        self._scheduler().begin()
+        try: 
+            while True: 
+                self._perform_clock_cycle()
+        finally: # flush any buffered log records if the machine stops, and report how well it kept its tick rate
+            self.log.close()
+            self.report_schedule()
+            if self.checkpointer is not None: 
+                self.checkpointer.close()
+                self.report_checkpoints()
+            for link in self.connections.values(): 
+                if isinstance(link, (ShmLink, EmulatedLink)): 
+                    link.close()
+
+    # Prints the achieved vs. nominal tick rate and the number of overrun clock cycles
+    def report_schedule(self): 
+        stats = self._scheduler().stats()
+        print(f"Machine {self.config[1]} ran {stats['cycles']} cycles at {stats['achieved_rate']:.3f}/{stats['nominal_rate']} ticks per second, {stats['overruns']} overran and {stats['skipped']} were skipped")
+
+    # Prints how many snapshots were taken and how long they held up the clock cycles that took them
+    def report_checkpoints(self): 
+        stats = self.checkpointer.stats()
+        print(f"Machine {self.config[1]} took {stats['snapshots']} snapshots, {stats['mean_us']} us on average and {stats['max_us']} us at most")
+
+    def _scheduler(self): 
+        if self.scheduler is None: 
+            self.scheduler = TickScheduler(self.tick, self.schedule_policy)
+        return self.scheduler
 
     # Helper function that simulates exactly one clock cycle of the machine
     def _perform_clock_cycle(self):
-        start_time = time.time()
+        if self.metrics is None: 
+            self.step()
+        else: 
+            start = time.perf_counter()
+            self.step()
+            self.metrics.cycle_duration.observe(time.perf_counter() - start)
+        # Wait until the next cycle is due, so that every second the machine performs self.tick
+        # clock cycles; the scheduler targets absolute deadlines, so overruns never make this sleep negative
+        slack = self._scheduler().wait()
+        if self.metrics is not None: 
+            self.metrics.sleep_slack.observe(slack)
+
+    # Performs the work of one clock cycle without waiting for the next one, so that
+    # other runtimes can drive the same machine logic on their own schedule
+    def step(self): 
+        if self.flow is not None: 
+            self.release_flow()
         if not self.read_message(): # if message queue is empty, we cannot read from it
-            val = random.randint(1, 10) 
-            if val == 1 or val == 2: # write a message to one of the other two machines
-                self.write_message([self.config[val + 1]])
-            elif val == 3: # write a message to both of the other two machines
-                self.write_message(self.config[2:]) 
+            i = self.event_index
+            if i == len(self.event_draws): 
+                self.event_draws, i = self._next_events(), 0
+            self.event_index = i + 1
+            event = self.event_draws[i]
+            if event == SEND_ONE: # write a message to one of the other machines, chosen by target weight
+                j = self.peer_index
+                if j == len(self.peer_draws): 
+                    self.peer_draws, j = self._next_targets(), 0
+                self.peer_index = j + 1
+                self.one_peer[0] = self.peer_draws[j]
+                self.write_message(self.one_peer)
+            elif event == SEND_ALL: # write a message to all of the other machines
+                self.write_message(self.peers) 
             else: # perform an internal event to this machine only
                 self.internal_event()
-        # Ensure that each clock cycle takes exactly 1 / self.tick seconds,
-        # meaning that every second, the machine can perform self.tick clock cycles
-        time.sleep(1 / self.tick - (time.time() - start_time))
+        self.cycles += 1
+        if self.cycles == self.phase_end: 
+            self._enter_phase()
+        if self.coalesce > 1 and self.cycles % self.coalesce == 0: 
+            self.flush_outbox()
+        if self.checkpointer is not None and self.cycles % self.checkpointer.every == 0: 
+            self.checkpointer.snapshot(self)
+
+    # Switches to the workload phase of the current clock cycle, dropping draws of the previous one
+    def _enter_phase(self): 
+        phases = self.workload.phases
+        k = self.workload.phase_at(self.cycles)
+        self.event_table, self.target_table = phases[k].events, phases[k].targets
+        self.trace, self.trace_targets = phases[k].trace, phases[k].trace_targets
+        self.trace_position = self.target_position = 0 # how much of the trace (and its targets) has been drawn
+        self.phase_end = phases[k + 1].start if k + 1 < len(phases) else None
+        self.event_draws, self.event_index = [], 0
+        self.peer_draws, self.peer_index = [], 0
+
+    # The next block of events: the rest of the trace being replayed, up to DRAW_BLOCK of it, or draws
+    def _next_events(self): 
+        if self.trace is not None and self.trace_position < len(self.trace): 
+            block = self.trace[self.trace_position:self.trace_position + DRAW_BLOCK]
+            self.trace_position += len(block)
+            return block
+        return self._draw(self.event_table)
+
+    # The next block of machines single messages go to, likewise
+    def _next_targets(self): 
+        if self.trace_targets is not None and self.target_position < len(self.trace_targets): 
+            block = self.trace_targets[self.target_position:self.target_position + DRAW_BLOCK]
+            self.target_position += len(block)
+            return block
+        return self._draw(self.target_table)
+
+    # Returns DRAW_BLOCK uniform choices from population (a range or list), with the client's draw
+    # backend. Either way they come from rng, so seeded runs stay reproducible
+    def _draw(self, population): 
+        if self.draws == DRAW_RANDOM: 
+            return self.rng.choices(population, k=DRAW_BLOCK)
+        picks = numpy.random.default_rng(self.rng.getrandbits(64)).integers(0, len(population), size=DRAW_BLOCK)
+        if isinstance(population, range): 
+            return (picks * population.step + population.start).tolist()
+        return [population[i] for i in picks.tolist()]
 
 
 if __name__ == '__main__': 
@@ -1,13 +1,34 @@
 import unittest
 from unittest import mock
 import selectors
+import struct
 import machine
+from framing import FrameDecoder, FRAMED_MAGIC
+from message_queue import MessageQueue
+from workload import SEND_ONE, SEND_ALL, INTERNAL
 import types
 import socket
+import os
+import logsink
+import io
+import time
+import random
+from contextlib import redirect_stdout
+
+DEFAULT_TABLE = [SEND_ONE] * 2 + [SEND_ALL] + [INTERNAL] * 7 # the event table of the default weights 2, 1, 7
+
+# Returns a recv_into side effect that delivers each chunk in turn into the caller's buffer
+def recv_into_chunks(*chunks):
+    chunks = list(chunks)
+    def recv_into(buffer):
+        chunk = chunks.pop(0)
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+    return recv_into
 
 class TestServerMethods(unittest.TestCase):
     def setUp(self):
-        self.messages = []
+        self.messages = MessageQueue()
 
     @mock.patch("selectors.DefaultSelector")
     @mock.patch("socket.socket")
@@ -30,67 +51,57 @@ class TestServerMethods(unittest.TestCase):
         server.accept_wrapper()
         mock_socket.return_value.accept.assert_called_once()
         conn.setblocking.assert_called_once_with(False)
-        mock_selector.return_value.register.assert_called_with(conn, selectors.EVENT_READ, data=types.SimpleNamespace(addr=addr))
+        mock_selector.return_value.register.assert_called_with(conn, selectors.EVENT_READ, data=mock.ANY)
+        data = mock_selector.return_value.register.call_args.kwargs["data"]
+        self.assertEqual(addr, data.addr)
+        self.assertIsInstance(data.decoder, FrameDecoder)
 
-    @mock.patch("struct.unpack")
-    @mock.patch("machine.Server.recvall")
     @mock.patch("selectors.DefaultSelector")
     @mock.patch("socket.socket")
-    def test_service_connection_first_new_message_in_queue(self, mock_socket, mock_selector, mock_recvall, mock_unpack):
+    def test_service_connection_first_new_message_in_queue(self, mock_socket, mock_selector):
         server = machine.Server(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
-        key = mock.Mock(name="key")
-        mock_unpack.return_value = (123, )
+        key = mock.Mock(name="key", data=types.SimpleNamespace(decoder=FrameDecoder(), flow=None))
+        key.fileobj.recv_into.side_effect = recv_into_chunks(struct.pack(">I", 123))
         server.service_connection(key, mock.ANY)
-        mock_recvall.assert_called_once_with(key.fileobj, 4)
-        self.assertEqual(self.messages, [123])
+        key.fileobj.recv_into.assert_called_once()
+        self.assertEqual(list(self.messages), [123])
 
-    @mock.patch("struct.unpack")
-    @mock.patch("machine.Server.recvall")
     @mock.patch("selectors.DefaultSelector")
     @mock.patch("socket.socket")
-    def test_service_connection_multiple_messages_in_queue(self, mock_socket, mock_selector, mock_recvall, mock_unpack):
-        self.messages = [123, 456, 789]
+    def test_service_connection_multiple_messages_in_queue(self, mock_socket, mock_selector):
+        self.messages.put_many([123, 456, 789])
         server = machine.Server(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
-        key = mock.Mock(name="key")
-        mock_unpack.return_value = (13790, )
+        key = mock.Mock(name="key", data=types.SimpleNamespace(decoder=FrameDecoder(), flow=None))
+        key.fileobj.recv_into.side_effect = recv_into_chunks(struct.pack(">I", 13790))
         server.service_connection(key, mock.ANY)
-        mock_recvall.assert_called_once_with(key.fileobj, 4)
-        self.assertEqual(self.messages, [123, 456, 789, 13790])
-
-    @mock.patch("selectors.DefaultSelector")
-    @mock.patch("socket.socket")
-    def test_recvall_one_iteration(self, mock_socket, mock_selector):
-        server = machine.Server(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
-        mock_sock = mock.Mock(name="sock")
-        return_values = {24: bytearray("This is a test sentence.", 'utf-8')}
-        mock_sock.recv.side_effect = return_values.get
-        data = server.recvall(mock_sock, 24)
-        self.assertEqual(data, bytearray("This is a test sentence.", 'utf-8'))
-        self.assertEqual(mock_sock.recv.call_args_list, [mock.call(24)])
+        self.assertEqual(list(self.messages), [123, 456, 789, 13790])
 
     @mock.patch("selectors.DefaultSelector")
     @mock.patch("socket.socket")
-    def test_recvall_multiple_iterations(self, mock_socket, mock_selector):
+    def test_service_connection_drains_all_complete_messages(self, mock_socket, mock_selector):
         server = machine.Server(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
-        mock_sock = mock.Mock(name="sock")
-        mock_sock.recv.side_effect = {24: bytearray("This", 'utf-8'), 20: bytearray(" is", 'utf-8'), 17: bytearray(" a", 'utf-8'), 15: bytearray(" test sentence.", 'utf-8')}.get
-        data = server.recvall(mock_sock, 24)
-        self.assertEqual(data, bytearray("This is a test sentence.", 'utf-8'))
-        self.assertEqual(mock_sock.recv.call_args_list, [mock.call(24), mock.call(20), mock.call(17), mock.call(15)])
+        key = mock.Mock(name="key", data=types.SimpleNamespace(decoder=FrameDecoder(), flow=None))
+        key.fileobj.recv_into.side_effect = recv_into_chunks(struct.pack(">3I", 5, 6, 7) + b"\x00\x00", b"\x00\x08")
+        server.service_connection(key, mock.ANY)
+        self.assertEqual(list(self.messages), [5, 6, 7])
+        server.service_connection(key, mock.ANY)
+        self.assertEqual(list(self.messages), [5, 6, 7, 8])
 
     @mock.patch("selectors.DefaultSelector")
     @mock.patch("socket.socket")
-    def test_recvall_zero_bytes(self, mock_socket, mock_selector):
+    def test_service_connection_peer_disconnected(self, mock_socket, mock_selector):
         server = machine.Server(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
-        mock_sock = mock.Mock(name="sock")
-        data = server.recvall(mock_sock, 0)
-        self.assertEqual(data, bytearray())
-        mock_sock.recv.assert_not_called()
+        key = mock.Mock(name="key", data=types.SimpleNamespace(decoder=FrameDecoder(), flow=None))
+        key.fileobj.recv_into.side_effect = recv_into_chunks(b"")
+        server.service_connection(key, mock.ANY)
+        mock_selector.return_value.unregister.assert_called_once_with(key.fileobj)
+        key.fileobj.close.assert_called_once()
+        self.assertEqual(list(self.messages), [])
 
 
 class TestClientMethods(unittest.TestCase):
     def setUp(self):
-        self.messages = []
+        self.messages = MessageQueue()
 
     @mock.patch("socket.socket")
     def test_init(self, mock_socket):
@@ -107,104 +118,264 @@ class TestClientMethods(unittest.TestCase):
         self.assertDictEqual({"test_port2": mock_sock1, "test_port3": mock_sock2}, client.connections)
         self.assertEqual(0, client.logical_clock)
         self.assertTrue(client.tick in range(1, 7))
+        self.assertEqual(os.path.join(".", "logtest_port1.txt"), client.log.path)
+        self.assertIsNone(client.log.file)
+
+    @mock.patch("socket.socket")
+    def test_init_any_number_of_peers(self, mock_socket):
+        socks = [mock.Mock(name=f"sock{i}") for i in range(4)]
+        mock_socket.side_effect = socks
+        config = ["test_host", "test_port1", "test_port2", "test_port3", "test_port4", "test_port5"]
+        client = machine.Client(config=config, messages=self.messages)
+        for sock, port in zip(socks, config[2:]):
+            sock.connect.assert_called_once_with(("test_host", port))
+        self.assertDictEqual(dict(zip(config[2:], socks)), client.connections)
+        self.assertEqual(config[2:], client.peers)
+
+    @mock.patch("socket.socket")
+    @mock.patch("machine.numpy", None)
+    def test_custom_tick_range_and_event_weights(self, mock_socket):
+        mock_socket.side_effect = [mock.Mock(name="sock1"), mock.Mock(name="sock2")]
+        rng = mock.Mock(name="rng")
+        rng.randint.return_value = 5
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock(), rng=rng, tick_range=(5, 9), event_weights=(4, 4, 2))
+        rng.randint.assert_called_once_with(5, 9)
+        rng.choices.return_value = [SEND_ALL] * machine.DRAW_BLOCK
+        with mock.patch.object(client, "write_message") as mock_write:
+            client.step()
+            rng.choices.assert_called_once_with([SEND_ONE, SEND_ONE, SEND_ALL, SEND_ALL, INTERNAL], k=machine.DRAW_BLOCK)
+            mock_write.assert_called_once_with(["test_port2", "test_port3"])
 
     @mock.patch("socket.socket")
     def test_read_message_no_messages_in_queue(self, mock_socket):
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             self.assertFalse(client.read_message())
             self.assertEqual(0, client.logical_clock)
-            self.assertEqual([], mock_file.mock_calls)
-            self.assertEqual([], self.messages)
+            mock_log.record.assert_not_called()
+            self.assertEqual([], list(self.messages))
 
     @mock.patch("socket.socket")
     def test_read_message_1_message_in_queue_updates_clock(self, mock_socket):
-        self.messages = [123]
+        self.messages.put_many([123])
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 64
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             self.assertTrue(client.read_message())
             self.assertEqual(124, client.logical_clock)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([], self.messages)
+            mock_log.record.assert_called_once_with(logsink.EVENT_RECEIVED, 124, 0)
+            self.assertEqual([], list(self.messages))
 
     @mock.patch("socket.socket")
     def test_read_message_1_message_in_queue_updates_clock(self, mock_socket):
-        self.messages = [123]
+        self.messages.put_many([123])
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 64
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             self.assertTrue(client.read_message())
             self.assertEqual(124, client.logical_clock)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([], self.messages)
+            mock_log.record.assert_called_once_with(logsink.EVENT_RECEIVED, 124, 0)
+            self.assertEqual([], list(self.messages))
 
     @mock.patch("socket.socket")
     def test_read_message_multiple_messages_in_queue_updates_clock(self, mock_socket):
-        self.messages = [125, 456, 789]
+        self.messages.put_many([125, 456, 789])
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 12
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             self.assertTrue(client.read_message())
             self.assertEqual(126, client.logical_clock)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([456, 789], self.messages)
+            mock_log.record.assert_called_once_with(logsink.EVENT_RECEIVED, 126, 2)
+            self.assertEqual([456, 789], list(self.messages))
+
+    @mock.patch("socket.socket")
+    def test_read_message_batch_merges_each_message(self, mock_socket):
+        self.messages.put_many([125, 456, 789])
+        mock_socket.side_effect = [mock.Mock(name="sock1"), mock.Mock(name="sock2")]
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock(), consume=machine.CONSUME_BATCH, consume_batch=2)
+        self.assertTrue(client.read_message())
+        self.assertEqual(457, client.logical_clock)
+        self.assertEqual([mock.call(logsink.EVENT_RECEIVED, 126, 2, sender=0, seq=0), mock.call(logsink.EVENT_RECEIVED, 457, 1, sender=0, seq=0)], client.log.record.call_args_list)
+        self.assertEqual([789], list(self.messages))
+
+    @mock.patch("socket.socket")
+    def test_read_message_drain_merges_once(self, mock_socket):
+        self.messages.put_many([125, 789, 456])
+        mock_socket.side_effect = [mock.Mock(name="sock1"), mock.Mock(name="sock2")]
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock(), consume=machine.CONSUME_DRAIN, log_received=machine.LOG_SUMMARY)
+        client.logical_clock = 12
+        self.assertTrue(client.read_message())
+        self.assertEqual(790, client.logical_clock)
+        client.log.record.assert_called_once_with(logsink.EVENT_RECEIVED, 790, 0)
+        self.assertEqual([], list(self.messages))
+
+    @mock.patch("socket.socket")
+    def test_consumption_options_checked(self, mock_socket):
+        with self.assertRaises(ValueError):
+            machine.Client(config=["test_host", "test_port1"], messages=self.messages, log=mock.Mock(), consume="all")
+        with self.assertRaises(ValueError):
+            machine.Client(config=["test_host", "test_port1"], messages=self.messages, log=mock.Mock(), log_received=machine.LOG_SUMMARY, message_ids=True)
+        for batch in (0, -1):
+            with self.subTest(consume_batch=batch), self.assertRaises(ValueError):
+                machine.Client(config=["test_host", "test_port1"], messages=self.messages, log=mock.Mock(), consume=machine.CONSUME_BATCH, consume_batch=batch)
 
     @mock.patch("socket.socket")
     def test_read_message_multiple_messages_in_queue_no_external_clock_update(self, mock_socket):
-        self.messages = [456, 778]
+        self.messages.put_many([456, 778])
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 1234
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             self.assertTrue(client.read_message())
             self.assertEqual(1235, client.logical_clock)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([778], self.messages)
+            mock_log.record.assert_called_once_with(logsink.EVENT_RECEIVED, 1235, 1)
+            self.assertEqual([778], list(self.messages))
 
-    @mock.patch("struct.pack")
     @mock.patch("socket.socket")
-    def test_write_message_to_one_machine(self, mock_socket, mock_pack):
+    def test_write_message_to_one_machine(self, mock_socket):
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 261
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             client.write_message(["test_port2"])
             self.assertEqual(262, client.logical_clock)
-            mock_sock1.sendall.assert_called_once_with(mock_pack.return_value)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([], self.messages)
+            mock_sock1.sendall.assert_called_once_with(struct.pack(">I", 262))
+            mock_sock2.sendall.assert_not_called()
+            mock_log.record.assert_called_once_with(logsink.EVENT_SENT, 262, peer="test_port2")
+            self.assertEqual([], list(self.messages))
 
-    @mock.patch("struct.pack")
     @mock.patch("socket.socket")
-    def test_write_message_to_two_machines(self, mock_socket, mock_pack):
+    def test_write_message_to_two_machines(self, mock_socket):
         mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 260
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             client.write_message(["test_port2", "test_port3"])
             self.assertEqual(261, client.logical_clock)
-            mock_sock1.sendall.assert_called_once_with(mock_pack.return_value)
-            mock_sock2.sendall.assert_called_once_with(mock_pack.return_value)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([], self.messages)
+            mock_sock1.sendall.assert_called_once_with(struct.pack(">I", 261))
+            mock_sock2.sendall.assert_called_once_with(struct.pack(">I", 261))
+            self.assertEqual([mock.call(logsink.EVENT_SENT, 261, peer="test_port2"), mock.call(logsink.EVENT_SENT, 261, peer="test_port3")], mock_log.record.call_args_list)
+            self.assertEqual([], list(self.messages))
+
+    @mock.patch("socket.socket")
+    def test_write_message_framed(self, mock_socket):
+        mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
+        mock_socket.side_effect = [mock_sock1, mock_sock2]
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock(), framed=True)
+        mock_sock1.sendall.assert_called_once_with(FRAMED_MAGIC)
+        mock_sock2.sendall.assert_called_once_with(FRAMED_MAGIC)
+        client.write_message(["test_port2"])
+        decoder = FrameDecoder()
+        self.assertEqual([1], decoder.feed(b"".join(c.args[0] for c in mock_sock1.sendall.call_args_list)))
+
+    @mock.patch("socket.socket")
+    def test_broken_connection_reopened(self, mock_socket):
+        mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
+        mock_socket.side_effect = [mock_sock1, mock_sock2]
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock())
+        mock_sock1.sendall.side_effect = BrokenPipeError
+        with redirect_stdout(io.StringIO()), mock.patch.object(client, "_reconnect") as mock_reconnect:
+            client.write_message(["test_port2"])
+            mock_sock1.close.assert_called_once_with()
+            for _ in range(1000):
+                if mock_reconnect.called:
+                    break
+                time.sleep(0.001)
+            mock_reconnect.assert_called_once_with("test_port2")
+            client.write_message(["test_port2"]) # lost while the connection is down
+        self.assertEqual(1, mock_sock1.sendall.call_count)
+        link = mock.Mock(name="link")
+        client.down["test_port2"] = link # reopened by the background thread
+        client.write_message(["test_port2"])
+        link.sendall.assert_called_once_with(struct.pack(">I", 3))
+        self.assertEqual({}, client.down)
+
+    @mock.patch("time.sleep")
+    @mock.patch("socket.socket")
+    def test_connect_retries_with_backoff(self, mock_socket, mock_sleep):
+        socks = [mock.Mock(name=f"sock{i}") for i in range(3)]
+        socks[0].connect.side_effect = socks[1].connect.side_effect = ConnectionRefusedError
+        mock_socket.side_effect = socks
+        with redirect_stdout(io.StringIO()):
+            self.assertIs(socks[2], machine.connect(["", 1], "10.0.0.2:22224", False, retry_for=10))
+        socks[2].connect.assert_called_once_with(("10.0.0.2", 22224))
+        self.assertEqual([mock.call(machine.CONNECT_RETRY_FIRST), mock.call(2 * machine.CONNECT_RETRY_FIRST)], mock_sleep.call_args_list)
+        socks[2].setsockopt.assert_any_call(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        mock_socket.side_effect = [mock.Mock(**{"connect.side_effect": ConnectionRefusedError})]
+        with self.assertRaises(ConnectionRefusedError):
+            machine.connect(["", 1], 22224, False)
+
+    def test_peer_address(self):
+        self.assertEqual(("h", 2), machine.peer_address(["h", 1], 2))
+        self.assertEqual(("10.0.0.3", 33335), machine.peer_address(["h", 1], "10.0.0.3:33335"))
+
+    def test_broken_connection_passed_in_raises(self):
+        link = mock.Mock(name="link")
+        link.sendall.side_effect = BrokenPipeError
+        client = machine.Client(["", 1, 2], self.messages, log=mock.Mock(), connections={2: link})
+        with self.assertRaises(BrokenPipeError):
+            client.write_message([2])
+
+    @mock.patch("time.sleep")
+    @mock.patch("socket.socket")
+    def test_coalesced_messages_sent_together(self, mock_socket, mock_sleep):
+        mock_sock1, mock_sock2 = mock.Mock(name="sock1"), mock.Mock(name="sock2")
+        mock_socket.side_effect = [mock_sock1, mock_sock2]
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock(), coalesce=2)
+        with mock.patch("machine.Client._draw", return_value=[SEND_ALL] * machine.DRAW_BLOCK):
+            client._perform_clock_cycle()
+            mock_sock1.sendall.assert_not_called()
+            client._perform_clock_cycle()
+        mock_sock1.sendall.assert_called_once_with(struct.pack(">2I", 1, 2))
+        mock_sock2.sendall.assert_called_once_with(struct.pack(">2I", 1, 2))
+
+    @mock.patch("socket.socket")
+    def test_random_choices_drawn_in_blocks(self, mock_socket):
+        mock_socket.side_effect = [mock.Mock(name="sock1"), mock.Mock(name="sock2")]
+        client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages, log=mock.Mock())
+        with mock.patch.object(client, "_draw", side_effect=[[SEND_ONE, SEND_ALL], ["test_port3", "test_port3"], [SEND_ONE]]) as mock_draw, mock.patch.object(client, "write_message") as mock_write:
+            for _ in range(3):
+                client.step()
+            self.assertEqual(3, mock_draw.call_count)
+            self.assertEqual([mock.call(["test_port3"]), mock.call(["test_port2", "test_port3"]), mock.call(["test_port3"])], mock_write.call_args_list)
+        draws = client._draw(["a", "b"])
+        self.assertEqual(machine.DRAW_BLOCK, len(draws))
+        self.assertEqual({"a", "b"}, set(draws))
+        self.assertTrue(set(client._draw(range(1, 11))) <= set(range(1, 11)))
+
+    @mock.patch("socket.socket")
+    def test_draw_backends(self, mock_socket):
+        mock_socket.side_effect = lambda *args: mock.Mock(name="sock")
+        config = ["test_host", "test_port1", "test_port2", "test_port3"]
+        seeded = random.Random(3)
+        seeded.randint(1, 6) # the client's tick rate
+        expected_choices, expected_seed = random.Random(3), seeded.getrandbits(64)
+        expected_choices.randint(1, 6)
+        with mock.patch("machine.numpy") as mock_numpy:
+            client = machine.Client(config=config, messages=self.messages, log=mock.Mock(), rng=random.Random(3))
+            self.assertEqual(expected_choices.choices(["a", "b"], k=machine.DRAW_BLOCK), client._draw(["a", "b"])) # the same with or without NumPy
+            mock_numpy.random.default_rng.assert_not_called()
+            generator = mock_numpy.random.default_rng.return_value
+            generator.integers.return_value.tolist.return_value = [1, 0, 1]
+            client = machine.Client(config=config, messages=self.messages, log=mock.Mock(), rng=random.Random(3), draws=machine.DRAW_NUMPY)
+            self.assertEqual(["b", "a", "b"], client._draw(["a", "b"]))
+            mock_numpy.random.default_rng.assert_called_once_with(expected_seed)
+            generator.integers.assert_called_once_with(0, 2, size=machine.DRAW_BLOCK)
+        with mock.patch("machine.numpy", None), self.assertRaises(ValueError):
+            machine.Client(config=config, messages=self.messages, log=mock.Mock(), draws=machine.DRAW_NUMPY)
+        with self.assertRaises(ValueError):
+            machine.Client(config=config, messages=self.messages, log=mock.Mock(), draws="bogus")
 
     @mock.patch("socket.socket")
     def test_internal_event(self, mock_socket):
@@ -212,15 +383,14 @@ class TestClientMethods(unittest.TestCase):
         mock_socket.side_effect = [mock_sock1, mock_sock2]
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.logical_clock = 278
-        with mock.patch("builtins.open", mock.mock_open(read_data="data")) as mock_file:
+        with mock.patch.object(client, "log") as mock_log:
             client.internal_event()
             self.assertEqual(279, client.logical_clock)
-            self.assertIn(mock.call('logtest_port1.txt', 'a+'), mock_file.mock_calls)
-            self.assertIn(mock.call().write(mock.ANY), mock_file.mock_calls)
-            self.assertEqual([], self.messages) 
+            mock_log.record.assert_called_once_with(logsink.EVENT_INTERNAL, 279)
+            self.assertEqual([], list(self.messages)) 
 
     @mock.patch("time.sleep")
-    @mock.patch("time.time")
+    @mock.patch("time.monotonic")
     @mock.patch("machine.Client.internal_event")
     @mock.patch("machine.Client.read_message")
     @mock.patch("machine.Client.write_message")
@@ -231,14 +401,16 @@ class TestClientMethods(unittest.TestCase):
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.tick = 4
         mock_time.side_effect = [1, 1.08]
+        client._scheduler().begin()
         mock_read.return_value = True
-        with mock.patch("random.randint") as mock_randint:
+        with mock.patch("machine.Client._draw") as mock_draw:
             client._perform_clock_cycle()
-            mock_randint.assert_not_called()
-            mock_sleep.assert_called_once_with(1 / client.tick - (1.08 - 1))
+            mock_draw.assert_not_called()
+            mock_sleep.assert_called_once()
+            self.assertAlmostEqual(1 / client.tick - (1.08 - 1), mock_sleep.call_args.args[0])
 
     @mock.patch("time.sleep")
-    @mock.patch("time.time")
+    @mock.patch("time.monotonic")
     @mock.patch("machine.Client.internal_event")
     @mock.patch("machine.Client.read_message")
     @mock.patch("machine.Client.write_message")
@@ -249,16 +421,18 @@ class TestClientMethods(unittest.TestCase):
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.tick = 3
         mock_time.side_effect = [1, 1.03]
+        client._scheduler().begin()
         mock_read.return_value = False
-        with mock.patch("random.randint") as mock_randint:
-            mock_randint.return_value = 2
+        with mock.patch("machine.Client._draw") as mock_draw:
+            mock_draw.side_effect = [[SEND_ONE], ["test_port3"]]
             client._perform_clock_cycle()
-            mock_randint.assert_called_once_with(1, 10)
+            self.assertEqual([mock.call(DEFAULT_TABLE), mock.call(["test_port2", "test_port3"])], mock_draw.call_args_list)
             mock_write.assert_called_once_with(["test_port3"])
-            mock_sleep.assert_called_once_with(1 / client.tick - (1.03 - 1))
+            mock_sleep.assert_called_once()
+            self.assertAlmostEqual(1 / client.tick - (1.03 - 1), mock_sleep.call_args.args[0])
 
     @mock.patch("time.sleep")
-    @mock.patch("time.time")
+    @mock.patch("time.monotonic")
     @mock.patch("machine.Client.internal_event")
     @mock.patch("machine.Client.read_message")
     @mock.patch("machine.Client.write_message")
@@ -269,16 +443,18 @@ class TestClientMethods(unittest.TestCase):
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.tick = 6
         mock_time.side_effect = [1, 1.04]
+        client._scheduler().begin()
         mock_read.return_value = False
-        with mock.patch("random.randint") as mock_randint:
-            mock_randint.return_value = 3
+        with mock.patch("machine.Client._draw") as mock_draw:
+            mock_draw.return_value = [SEND_ALL]
             client._perform_clock_cycle()
-            mock_randint.assert_called_once_with(1, 10)
+            mock_draw.assert_called_once_with(DEFAULT_TABLE)
             mock_write.assert_called_once_with(["test_port2", "test_port3"])
-            mock_sleep.assert_called_once_with(1 / client.tick - (1.04 - 1))
+            mock_sleep.assert_called_once()
+            self.assertAlmostEqual(1 / client.tick - (1.04 - 1), mock_sleep.call_args.args[0])
 
     @mock.patch("time.sleep")
-    @mock.patch("time.time")
+    @mock.patch("time.monotonic")
     @mock.patch("machine.Client.internal_event")
     @mock.patch("machine.Client.read_message")
     @mock.patch("machine.Client.write_message")
@@ -289,14 +465,16 @@ class TestClientMethods(unittest.TestCase):
         client = machine.Client(config=["test_host", "test_port1", "test_port2", "test_port3"], messages=self.messages)
         client.tick = 5
         mock_time.side_effect = [1, 1.02]
+        client._scheduler().begin()
         mock_read.return_value = False
-        with mock.patch("random.randint") as mock_randint:
-            mock_randint.return_value = 4
+        with mock.patch("machine.Client._draw") as mock_draw:
+            mock_draw.return_value = [INTERNAL]
             client._perform_clock_cycle()
-            mock_randint.assert_called_once_with(1, 10)
+            mock_draw.assert_called_once_with(DEFAULT_TABLE)
             mock_write.assert_not_called()
             mock_internal.assert_called_once()
-            mock_sleep.assert_called_once_with(1 / client.tick - (1.02 - 1))
+            mock_sleep.assert_called_once()
+            self.assertAlmostEqual(1 / client.tick - (1.02 - 1), mock_sleep.call_args.args[0])
 
 if __name__ == '__main__':
     unittest.main()
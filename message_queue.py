@@ -0,0 +1,121 @@
+import threading
+from collections import deque
+
+
+# What a bounded MessageQueue does when a message arrives while it is full
+OVERFLOW_BLOCK = "block" # the enqueuing (server) thread waits until the client frees a slot
+OVERFLOW_DROP_OLDEST = "drop_oldest" # the oldest queued message is discarded to make room
+OVERFLOW_BACKPRESSURE = "backpressure" # the message is kept, and the server stops reading from its peers until the queue drains
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_BACKPRESSURE)
+
+
+# Message queue shared between a machine's Server (single producer) and Client (single consumer).
+# Backed by a deque, so enqueue and dequeue are O(1) and need no lock on the fast path: the
+# condition variable is only touched while a producer is actually waiting for free space. The
+# drop_oldest policy is the exception, as its producer also takes messages off the consumer's
+# end, so under it dropping and dequeuing both hold the condition's lock
+class MessageQueue():
+    def __init__(self, maxsize=None, overflow=OVERFLOW_BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy {overflow!r}, expected one of {OVERFLOW_POLICIES}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0 # number of messages discarded by the drop_oldest policy
+        self._items = deque()
+        self._not_full = threading.Condition(threading.Lock())
+        self._waiters = 0 # number of producers waiting on _not_full
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    # Returns True if the queue has reached its maximum size
+    def full(self):
+        return self.maxsize is not None and len(self._items) >= self.maxsize
+
+    # Enqueues one message, applying the overflow policy if the queue is full
+    def put(self, item):
+        if self.maxsize is not None and len(self._items) >= self.maxsize:
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                with self._not_full:
+                    if len(self._items) >= self.maxsize: # the consumer may have made room meanwhile
+                        self._items.popleft()
+                        self.dropped += 1
+                    self._items.append(item)
+                return
+            elif self.overflow == OVERFLOW_BLOCK:
+                self.wait_not_full()
+        self._items.append(item)
+
+    # Enqueues several messages at once
+    def put_many(self, items):
+        if self.maxsize is None or self.overflow == OVERFLOW_BACKPRESSURE:
+            self.extend(items)
+        else:
+            for item in items:
+                self.put(item)
+
+    # Enqueues several messages ignoring the size limit, for producers that cannot block and
+    # instead stop reading from their peers while the queue is full
+    def extend(self, items):
+        self._items.extend(items)
+
+    # Puts messages back at the front of the queue, ahead of everything queued, e.g. when a
+    # machine restarts from a checkpoint
+    def put_front(self, items):
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            with self._not_full:
+                self._items.extendleft(reversed(items))
+            return
+        self._items.extendleft(reversed(items))
+
+    # Dequeues the earliest message, raising IndexError if the queue is empty
+    def pop(self):
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            with self._not_full:
+                return self._items.popleft()
+        item = self._items.popleft()
+        if self._waiters:
+            self._notify_not_full()
+        return item
+
+    # Dequeues and returns up to max_items messages (all of them if max_items is None)
+    def drain(self, max_items=None):
+        if self.overflow == OVERFLOW_DROP_OLDEST:
+            with self._not_full: # producers never wait under drop_oldest, so there is no one to notify
+                return self._drain(max_items)
+        drained = self._drain(max_items)
+        if self._waiters:
+            self._notify_not_full()
+        return drained
+
+    def _drain(self, max_items):
+        items = self._items
+        if max_items is None or max_items >= len(items):
+            drained = list(items)
+            for _ in range(len(drained)):
+                items.popleft()
+        else:
+            drained = [items.popleft() for _ in range(max_items)]
+        return drained
+
+    # Blocks the calling thread until the queue is below its maximum size or timeout expires,
+    # returning whether there is room
+    def wait_not_full(self, timeout=None):
+        with self._not_full:
+            self._waiters += 1
+            try:
+                # The size is re-checked while holding the lock, and consumers notify while holding it,
+                # so a slot freed between the check and the wait cannot be missed
+                return self._not_full.wait_for(lambda: not self.full(), timeout)
+            finally:
+                self._waiters -= 1
+
+    def _notify_not_full(self):
+        with self._not_full:
+            self._not_full.notify_all()
@@ -0,0 +1,115 @@
+import unittest
+import threading
+import time
+from collections import deque
+import message_queue
+from message_queue import MessageQueue
+
+# Deque that lets another thread run in the middle of the consumer's first pop, as a thread
+# switch could, giving it up to 0.1 s
+class InterleavedDeque(deque):
+    def popleft(self):
+        hook, self.hook = getattr(self, "hook", None), None
+        if hook is not None:
+            hook.start()
+            hook.join(0.1)
+        return super().popleft()
+
+class TestMessageQueue(unittest.TestCase):
+    def test_fifo_order(self):
+        queue = MessageQueue()
+        for item in [5, 3, 9]:
+            queue.put(item)
+        self.assertEqual(3, len(queue))
+        self.assertEqual([5, 3, 9], [queue.pop() for _ in range(3)])
+        self.assertFalse(queue)
+        with self.assertRaises(IndexError):
+            queue.pop()
+
+    def test_drain(self):
+        queue = MessageQueue()
+        queue.put_many(range(5))
+        self.assertEqual([0, 1], queue.drain(2))
+        self.assertEqual([2, 3, 4], queue.drain())
+        self.assertEqual([], queue.drain())
+
+    def test_put_front(self):
+        queue = MessageQueue()
+        queue.put_many([3, 4])
+        queue.put_front([1, 2])
+        self.assertEqual([1, 2, 3, 4], queue.drain())
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            MessageQueue(4, overflow="spill")
+
+    def test_drop_oldest(self):
+        queue = MessageQueue(2, overflow=message_queue.OVERFLOW_DROP_OLDEST)
+        queue.put_many([1, 2, 3, 4])
+        self.assertEqual([3, 4], list(queue))
+        self.assertEqual(2, queue.dropped)
+
+    def test_backpressure_keeps_messages(self):
+        queue = MessageQueue(2, overflow=message_queue.OVERFLOW_BACKPRESSURE)
+        queue.put_many([1, 2, 3])
+        self.assertEqual([1, 2, 3], list(queue))
+        self.assertTrue(queue.full())
+        self.assertFalse(queue.wait_not_full(timeout=0.01))
+
+    def test_block_waits_for_consumer(self):
+        queue = MessageQueue(1, overflow=message_queue.OVERFLOW_BLOCK)
+        queue.put(1)
+        producer = threading.Thread(target=queue.put, args=(2,))
+        producer.start()
+        time.sleep(0.05)
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(1, queue.pop())
+        producer.join(timeout=1)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual([2], list(queue))
+
+    def test_concurrent_producer_consumer(self):
+        queue = MessageQueue(8)
+        n = 2000
+        producer = threading.Thread(target=lambda: [queue.put(i) for i in range(n)])
+        producer.start()
+        received = []
+        while len(received) < n:
+            received.extend(queue.drain(3))
+        producer.join()
+        self.assertEqual(list(range(n)), received)
+
+    def test_concurrent_drop_oldest_and_drain(self):
+        queue = MessageQueue(4, overflow=message_queue.OVERFLOW_DROP_OLDEST)
+        n = 20000
+        errors = []
+
+        def produce():
+            try:
+                for i in range(n):
+                    queue.put(i)
+            except IndexError as e:
+                errors.append(e)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        received = []
+        while producer.is_alive() or queue:
+            received.extend(queue.drain(None if len(received) % 2 else 1))
+        producer.join()
+        self.assertEqual([], errors)
+        self.assertEqual(sorted(received), received) # nothing returned twice or out of order
+        self.assertEqual(n, len(received) + queue.dropped) # every message was either returned or dropped
+
+    def test_drop_oldest_while_draining(self):
+        queue = MessageQueue(2, overflow=message_queue.OVERFLOW_DROP_OLDEST)
+        queue.put_many([1, 2])
+        queue._items = InterleavedDeque(queue._items)
+        queue._items.hook = producer = threading.Thread(target=queue.put, args=(3,))
+        self.assertEqual([1, 2], queue.drain())
+        producer.join()
+        self.assertEqual([3], list(queue)) # the drop waited for the drain instead of losing 3
+        self.assertEqual(0, queue.dropped)
+
+if __name__ == '__main__':
+    unittest.main()
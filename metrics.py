@@ -0,0 +1,130 @@
+import threading, time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logsink import EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+
+EVENT_NAMES = {EVENT_RECEIVED: "received", EVENT_SENT: "sent", EVENT_INTERNAL: "internal"}
+
+# Bucket upper bounds in seconds, from 10us (cycle work at high tick rates) to 1s (a whole cycle at tick rate 1)
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+# Fixed-bucket histogram. Like the counters in MachineMetrics it is updated by a single thread
+# without locking; a scrape may see it mid-update, which only skews one sample
+class Histogram():
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last slot counts values above every bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Yields (le, cumulative count) pairs in exposition order
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            yield bound, total
+
+
+# In-process counters and histograms of one machine. The client thread owns the event, send and
+# cycle metrics and the server thread owns the receive counters, so every value has a single
+# writer and increments need no locks. Queue depth, logical clock and scheduler stats are read at scrape time
+class MachineMetrics():
+    def __init__(self, machine, messages):
+        self.machine = machine
+        self.messages = messages
+        self.client = None # set by the Client that reports into these metrics
+        self.events = [0, 0, 0] # indexed by event type
+        self.sent = {} # peer -> messages sent
+        self.received = {} # connection address -> messages received
+        self.cycle_duration = Histogram()
+        self.sleep_slack = Histogram()
+        self.last_scrape = None # (time, logical clock) at the previous scrape, for the clock rate
+
+    def add_received(self, connection, n):
+        self.received[connection] = self.received.get(connection, 0) + n
+
+    # Renders all metrics in the Prometheus text exposition format
+    def render(self):
+        label = f'machine="{self.machine}"'
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{{{label}{labels}}} {value}")
+
+        def histogram(name, help, h):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for bound, count in h.cumulative():
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"{name}_sum{{{label}}} {h.sum}")
+            lines.append(f"{name}_count{{{label}}} {h.count}")
+
+        metric("lc_events_total", "counter", "Events performed by the machine, by type.", [(f',type="{name}"', self.events[event]) for event, name in EVENT_NAMES.items()])
+        metric("lc_messages_sent_total", "counter", "Messages sent, by peer.", [(f',peer="{peer}"', n) for peer, n in list(self.sent.items())])
+        metric("lc_messages_received_total", "counter", "Messages received, by connection.", [(f',connection="{_address(connection)}"', n) for connection, n in list(self.received.items())])
+        metric("lc_queue_depth", "gauge", "Messages waiting in the message queue.", [("", len(self.messages))])
+        histogram("lc_cycle_duration_seconds", "Time spent doing the work of a clock cycle.", self.cycle_duration)
+        histogram("lc_sleep_slack_seconds", "Time spent waiting for the next clock cycle.", self.sleep_slack)
+
+        if self.client is not None:
+            now, clock = time.monotonic(), self.client.logical_clock
+            rate = 0.0
+            if self.last_scrape is not None and now > self.last_scrape[0]:
+                rate = (clock - self.last_scrape[1]) / (now - self.last_scrape[0])
+            self.last_scrape = (now, clock)
+            metric("lc_logical_clock", "counter", "Current logical clock value.", [("", clock)])
+            metric("lc_logical_clock_rate", "gauge", "Logical clock increase per second since the previous scrape.", [("", round(rate, 3))])
+            if self.client.scheduler is not None:
+                stats = self.client.scheduler.stats()
+                metric("lc_tick_rate_nominal", "gauge", "Configured clock cycles per second.", [("", stats["nominal_rate"])])
+                metric("lc_tick_rate_achieved", "gauge", "Clock cycles per second achieved since the machine started.", [("", round(stats["achieved_rate"], 3))])
+                metric("lc_cycle_overruns_total", "counter", "Clock cycles that ended after the next one was due.", [("", stats["overruns"])])
+                metric("lc_cycles_skipped_total", "counter", "Clock cycles dropped to get back on schedule.", [("", stats["skipped"])])
+        return "\n".join(lines) + "\n"
+
+
+# Formats a socket address such as ("127.0.0.1", 53422) as host:port
+def _address(addr):
+    return ":".join(map(str, addr)) if isinstance(addr, tuple) else str(addr)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # keep scrapes out of the machine's output
+        pass
+
+
+# Serves a machine's metrics over HTTP at http://host:port/metrics from a daemon thread
+class MetricsServer():
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.metrics = metrics
+        self.port = self.httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+import urllib.request
+import metrics
+import machine
+from message_queue import MessageQueue
+
+class TestHistogram(unittest.TestCase):
+    def test_observe_and_cumulative(self):
+        h = metrics.Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            h.observe(value)
+        self.assertEqual([(0.1, 2), (1.0, 3), ("+Inf", 4)], list(h.cumulative()))
+        self.assertEqual(4, h.count)
+        self.assertAlmostEqual(3.65, h.sum)
+
+class TestMachineMetrics(unittest.TestCase):
+    def setUp(self):
+        self.messages = MessageQueue()
+        self.metrics = metrics.MachineMetrics(11113, self.messages)
+
+    @mock.patch("socket.socket")
+    def test_client_reports_events(self, mock_socket):
+        mock_socket.side_effect = [mock.Mock(name="sock1"), mock.Mock(name="sock2")]
+        client = machine.Client(["test_host", 11113, 22224, 33335], self.messages, log=mock.Mock(), metrics=self.metrics)
+        self.assertIs(client, self.metrics.client)
+        client.write_message([22224, 33335])
+        client.write_message([22224])
+        client.internal_event()
+        self.messages.put_many([50, 60])
+        client.read_message()
+        self.assertEqual([1, 3, 1], self.metrics.events)
+        self.assertEqual({22224: 2, 33335: 1}, self.metrics.sent)
+        text = self.metrics.render()
+        self.assertIn('lc_events_total{machine="11113",type="sent"} 3', text)
+        self.assertIn('lc_messages_sent_total{machine="11113",peer="22224"} 2', text)
+        self.assertIn('lc_queue_depth{machine="11113"} 1', text)
+        self.assertIn('lc_logical_clock{machine="11113"} 51', text)
+
+    @mock.patch("time.sleep")
+    @mock.patch("socket.socket")
+    def test_cycle_timings(self, mock_socket, mock_sleep):
+        mock_socket.side_effect = [mock.Mock(name="sock1"), mock.Mock(name="sock2")]
+        client = machine.Client(["test_host", 11113, 22224, 33335], self.messages, log=mock.Mock(), metrics=self.metrics)
+        client._perform_clock_cycle()
+        self.assertEqual(1, self.metrics.cycle_duration.count)
+        self.assertEqual(1, self.metrics.sleep_slack.count)
+        text = self.metrics.render()
+        self.assertIn('lc_cycle_duration_seconds_count{machine="11113"} 1', text)
+        self.assertIn('lc_tick_rate_nominal{machine="11113"}', text)
+
+    def test_received_by_connection(self):
+        self.metrics.add_received(("127.0.0.1", 5000), 3)
+        self.metrics.add_received(("127.0.0.1", 5000), 2)
+        self.assertIn('lc_messages_received_total{machine="11113",connection="127.0.0.1:5000"} 5', self.metrics.render())
+
+    def test_http_endpoint(self):
+        server = metrics.MetricsServer(self.metrics, 0).start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+                self.assertEqual(200, response.status)
+                self.assertIn("# TYPE lc_events_total counter", response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/other")
+        finally:
+            server.close()
+
+if __name__ == '__main__':
+    unittest.main()
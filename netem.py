@@ -0,0 +1,153 @@
+import heapq, itertools, random, threading, time
+from collections import namedtuple
+
+
+PARTITION_DROP = "drop" # the connection stays up and everything sent while partitioned is lost
+PARTITION_DISCONNECT = "disconnect" # the connection is closed when the partition starts and reopened when it heals
+PARTITION_MODES = (PARTITION_DROP, PARTITION_DISCONNECT)
+RECONNECT_DELAY = 0.1 # seconds between attempts to reopen a connection after a partition heals
+
+# Impairments of one direction of a link. Times are in seconds and bandwidth in bytes per second
+# (None for unlimited); drop and reorder are probabilities per send. A message is delayed by
+# latency plus a uniform amount up to jitter, but still arrives in order unless it is picked for
+# reordering, in which case it goes out at once, overtaking anything still in flight (like
+# netem's reorder). partitions are (start, end) windows, in seconds since the link was created
+LinkProfile = namedtuple("LinkProfile", ["latency", "jitter", "bandwidth", "drop", "reorder", "partitions", "partition_mode"],
+                         defaults=[0.0, 0.0, None, 0.0, 0.0, (), PARTITION_DROP])
+
+
+# Whether a link with this profile can lose or reorder messages. Vector and hybrid stamps and
+# message IDs are delta-encoded per connection, so they need a link that does neither
+def loses_messages(profile):
+    return bool(profile.drop or profile.reorder or profile.partitions)
+
+
+# Parses a profile from a comma-separated list such as "latency=0.05,jitter=0.01,drop=0.1,
+# partition=10-20,partition=40-45,mode=disconnect", raising ValueError if it is malformed
+def parse_profile(spec):
+    fields, partitions = {}, []
+    for item in filter(None, spec.split(",")):
+        key, _, value = item.partition("=")
+        key = key.strip()
+        try:
+            if key == "partition":
+                start, end = value.split("-")
+                partitions.append((float(start), float(end)))
+            elif key == "mode":
+                if value not in PARTITION_MODES:
+                    raise ValueError(value)
+                fields["partition_mode"] = value
+            elif key in ("latency", "jitter", "bandwidth", "drop", "reorder"):
+                fields[key] = float(value)
+            else:
+                raise ValueError(key)
+        except ValueError:
+            raise ValueError(f"bad link profile item {item!r} in {spec!r}") from None
+    return LinkProfile(partitions=tuple(partitions), **fields)
+
+
+# Wraps the sending end of a connection (anything with a sendall method) and applies a
+# LinkProfile to it. sendall never blocks: messages wait in a delay line that a background
+# thread delivers from once they are due. open_connection, if given, returns a new connection
+# and is used to reconnect after a disconnecting partition heals
+class EmulatedLink():
+    def __init__(self, connection, profile, open_connection=None, rng=None, clock=time.monotonic):
+        if profile.partition_mode == PARTITION_DISCONNECT and profile.partitions and open_connection is None:
+            raise ValueError("disconnecting partitions need open_connection to reconnect with")
+        self.connection = connection
+        self.profile = profile
+        self.open_connection = open_connection
+        self.rng = rng if rng is not None else random.Random()
+        self.clock = clock
+        self.start = clock()
+        self.sent = self.delivered = self.dropped = 0 # dropped by the profile when sent
+        self.lost = 0 # in flight when a disconnecting partition started, or sent after the peer went away
+        self.last_due = self.line_free = self.start # when the latest in-order message and the line are due to be free
+        self.queue = [] # heap of (due time, sequence number, data)
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._deliver, daemon=True)
+        self.thread.start()
+
+    # Whether the link is partitioned at time now, and when that next changes (None if never)
+    def partitioned(self, now):
+        elapsed = now - self.start
+        change = None
+        for start, end in self.profile.partitions:
+            if start <= elapsed < end:
+                return True, self.start + end
+            if elapsed < start and (change is None or start < change - self.start):
+                change = self.start + start
+        return False, change
+
+    def sendall(self, data):
+        profile, now = self.profile, self.clock()
+        self.sent += 1
+        if self.partitioned(now)[0] or (profile.drop and self.rng.random() < profile.drop):
+            self.dropped += 1
+            return
+        if profile.reorder and self.rng.random() < profile.reorder:
+            due = now
+        else:
+            due = now + profile.latency + (self.rng.uniform(0, profile.jitter) if profile.jitter else 0)
+            due = self.last_due = max(due, self.last_due)
+        if profile.bandwidth:
+            self.line_free = max(due, self.line_free) + len(data) / profile.bandwidth
+            due = self.line_free
+        with self.cond:
+            heapq.heappush(self.queue, (due, next(self.sequence), bytes(data))) # senders reuse their buffers
+            self.cond.notify()
+
+    # Stops delivering, discarding whatever is still in flight, and closes the connection
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.queue.clear()
+            self.cond.notify()
+        self.thread.join()
+        if self.connection is not None:
+            self.connection.close()
+
+    # Delivery thread: sends due messages, and with disconnecting partitions closes the
+    # connection when one starts and reopens it when it heals, retrying if the peer is not back yet
+    def _deliver(self):
+        disconnect = self.profile.partition_mode == PARTITION_DISCONNECT
+        retry_at = None
+        while True:
+            with self.cond:
+                action = None
+                while action is None:
+                    if self.closed:
+                        return
+                    now = self.clock()
+                    partitioned, change = self.partitioned(now) if disconnect else (False, None)
+                    if partitioned and self.connection is not None:
+                        action = "down"
+                        self.lost += len(self.queue)
+                        self.queue.clear()
+                    elif not partitioned and self.connection is None and (retry_at is None or now >= retry_at):
+                        action = "up"
+                    elif self.connection is not None and self.queue and self.queue[0][0] <= now:
+                        action, data = "send", heapq.heappop(self.queue)[2]
+                    else:
+                        wakeups = [change] if change is not None else []
+                        if self.connection is None and retry_at is not None:
+                            wakeups.append(retry_at)
+                        elif self.connection is not None and self.queue:
+                            wakeups.append(self.queue[0][0])
+                        self.cond.wait(min(wakeups) - now if wakeups else None)
+            if action == "down":
+                self.connection.close()
+                self.connection = None
+            elif action == "up":
+                try:
+                    self.connection, retry_at = self.open_connection(), None
+                except OSError:
+                    retry_at = self.clock() + RECONNECT_DELAY
+            else:
+                try:
+                    self.connection.sendall(data)
+                    self.delivered += 1
+                except OSError: # the peer went away; like the network, the link loses the message
+                    self.lost += 1
@@ -0,0 +1,144 @@
+import unittest
+from unittest import mock
+import io
+import random
+import threading
+import time
+from contextlib import redirect_stdout
+import machine
+import netem
+from async_machine_tests import free_ports
+from message_queue import MessageQueue
+from netem import EmulatedLink, LinkProfile
+
+# Connection that records when each send arrived
+class Recorder():
+    def __init__(self):
+        self.received = []
+        self.closed = False
+
+    def sendall(self, data):
+        self.received.append((time.monotonic(), bytes(data)))
+
+    def close(self):
+        self.closed = True
+
+    def data(self):
+        return [data for _, data in self.received]
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+class TestParseProfile(unittest.TestCase):
+    def test_parse(self):
+        profile = netem.parse_profile("latency=0.05,jitter=0.01,bandwidth=1000,drop=0.1,reorder=0.2,partition=10-20,partition=30-35.5,mode=disconnect")
+        self.assertEqual(LinkProfile(0.05, 0.01, 1000, 0.1, 0.2, ((10, 20), (30, 35.5)), netem.PARTITION_DISCONNECT), profile)
+        self.assertEqual(LinkProfile(), netem.parse_profile(""))
+
+    def test_malformed(self):
+        for spec in ("delay=1", "latency=fast", "partition=10", "mode=flaky"):
+            with self.assertRaises(ValueError):
+                netem.parse_profile(spec)
+
+class TestEmulatedLink(unittest.TestCase):
+    def test_latency_and_jitter_keep_order(self):
+        inner = Recorder()
+        link = EmulatedLink(inner, LinkProfile(latency=0.02, jitter=0.02), rng=random.Random(1))
+        start = time.monotonic()
+        for i in range(20):
+            link.sendall(bytes([i]))
+        self.assertTrue(wait_for(lambda: len(inner.received) == 20))
+        self.assertEqual([bytes([i]) for i in range(20)], inner.data())
+        self.assertGreaterEqual(inner.received[0][0] - start, 0.02)
+        link.close()
+        self.assertTrue(inner.closed)
+
+    def test_drop_and_reorder(self):
+        inner = Recorder()
+        link = EmulatedLink(inner, LinkProfile(drop=1.0))
+        link.sendall(b"x")
+        self.assertEqual((1, 1), (link.sent, link.dropped))
+        link.close()
+        inner = Recorder()
+        link = EmulatedLink(inner, LinkProfile(latency=0.05, reorder=0.5), rng=random.Random(3))
+        for i in range(20):
+            link.sendall(bytes([i]))
+        self.assertTrue(wait_for(lambda: len(inner.received) == 20))
+        self.assertNotEqual(sorted(inner.data()), inner.data()) # some messages overtook others
+        self.assertEqual(sorted(inner.data()), [bytes([i]) for i in range(20)])
+        link.close()
+
+    def test_bandwidth(self):
+        inner = Recorder()
+        link = EmulatedLink(inner, LinkProfile(bandwidth=1000))
+        start = time.monotonic()
+        for _ in range(10):
+            link.sendall(b"x" * 10)
+        self.assertTrue(wait_for(lambda: len(inner.received) == 10))
+        self.assertGreaterEqual(inner.received[-1][0] - start, 0.09)
+        link.close()
+
+    def test_partition_drops(self):
+        now = [100.0]
+        inner = Recorder()
+        link = EmulatedLink(inner, LinkProfile(partitions=((5, 10),)), clock=lambda: now[0])
+        link.sendall(b"a")
+        now[0] = 107
+        link.sendall(b"b")
+        now[0] = 110
+        link.sendall(b"c")
+        self.assertTrue(wait_for(lambda: len(inner.received) == 2))
+        self.assertEqual([b"a", b"c"], inner.data())
+        self.assertEqual(1, link.dropped)
+        link.close()
+
+    def test_partition_disconnects_and_reconnects(self):
+        first, second = Recorder(), Recorder()
+        open_connection = mock.Mock(side_effect=[OSError("refused"), second])
+        with mock.patch.object(netem, "RECONNECT_DELAY", 0.01):
+            link = EmulatedLink(first, LinkProfile(partitions=((0.05, 0.1),), partition_mode=netem.PARTITION_DISCONNECT), open_connection)
+            link.sendall(b"a")
+            self.assertTrue(wait_for(lambda: first.closed))
+            link.sendall(b"b")
+            self.assertTrue(wait_for(lambda: link.connection is second))
+            link.sendall(b"c")
+            self.assertTrue(wait_for(lambda: len(second.received) == 1))
+        self.assertEqual([b"a"], first.data())
+        self.assertEqual([b"c"], second.data())
+        self.assertEqual(2, open_connection.call_count) # the peer refused the first attempt
+        link.close()
+
+    def test_disconnect_needs_open_connection(self):
+        with self.assertRaises(ValueError):
+            EmulatedLink(Recorder(), LinkProfile(partitions=((1, 2),), partition_mode=netem.PARTITION_DISCONNECT))
+
+class TestClientLinks(unittest.TestCase):
+    def test_lossy_links_need_stateless_stamps(self):
+        for options in ({"clock_mode": "vector"}, {"message_ids": True}):
+            with self.assertRaises(ValueError):
+                machine.Client(["127.0.0.1", 0, 1], MessageQueue(), log=mock.Mock(), netem=LinkProfile(drop=0.1), **options)
+
+    def test_server_sees_reconnected_peer(self):
+        port, = free_ports(1)
+        messages = MessageQueue()
+        server = machine.Server(["127.0.0.1", port], messages)
+        threading.Thread(target=server.run, daemon=True).start()
+        profile = LinkProfile(partitions=((0.1, 0.2),), partition_mode=netem.PARTITION_DISCONNECT)
+        with redirect_stdout(io.StringIO()):
+            client = machine.Client(["127.0.0.1", 0, port], MessageQueue(), log=mock.Mock(), netem=profile)
+            link = client.connections[port]
+            client.write_message([port])
+            self.assertTrue(wait_for(lambda: len(messages) == 1))
+            first = link.connection
+            self.assertTrue(wait_for(lambda: link.connection not in (None, first)))
+        client.write_message([port])
+        self.assertTrue(wait_for(lambda: len(messages) == 2))
+        self.assertEqual([1, 2], list(messages))
+        self.assertEqual(2, len(server.sel.get_map())) # the listening socket and the new connection only
+        link.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import time
+
+
+# What a TickScheduler does when a cycle overruns its deadline
+POLICY_CATCH_UP = "catch_up" # run the missed cycles back to back until the schedule is caught up
+POLICY_SKIP = "skip" # drop the missed cycles and wait for the next deadline on the original schedule
+POLICIES = (POLICY_CATCH_UP, POLICY_SKIP)
+
+
+# Schedules clock cycles at a fixed rate against absolute deadlines on a monotonic clock, so
+# that sleep jitter and the time spent in each cycle do not accumulate into drift. Cycle k is
+# due at start + k / rate. With the catch_up policy at most max_catch_up missed cycles are run
+# back to back; any beyond that are skipped
+class TickScheduler():
+    def __init__(self, rate, policy=POLICY_CATCH_UP, max_catch_up=None, spin=None, clock=None, sleep=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r}, expected one of {POLICIES}")
+        self.rate = rate
+        self.period = 1 / rate
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        # time.sleep can oversleep by tens of microseconds, so at high rates we sleep until shortly
+        # before the deadline and busy-wait the rest
+        self.spin = spin if spin is not None else (0.0005 if self.period <= 0.01 else 0)
+        self.clock = clock or time.monotonic
+        self.sleep = sleep or time.sleep
+        self.started = None
+        self.deadline = None # when the next cycle is due
+        self.cycles = 0
+        self.overruns = 0 # cycles that ended after the next cycle was due
+        self.skipped = 0 # cycles dropped to get back on schedule
+        self.slack = 0.0 # total time spent waiting between cycles
+
+    # Marks the start of the first cycle
+    def begin(self):
+        self.started = self.clock()
+        self.deadline = self.started + self.period
+
+    # Accounts for the cycle that just ended and returns how long to wait before the next one
+    def next_delay(self):
+        now = self.clock()
+        if self.deadline is None: # begin() was not called, so the cycle that just ended starts the schedule
+            self.started, self.deadline = now, now
+        self.cycles += 1
+        behind = now - self.deadline
+        if behind <= 0:
+            delay = -behind
+        else:
+            self.overruns += 1
+            missed = int(behind / self.period) # whole cycles that are already overdue besides the next one
+            if self.policy == POLICY_SKIP:
+                self.deadline += (missed + 1) * self.period
+                self.skipped += missed + 1
+                delay = self.deadline - now
+            else:
+                if self.max_catch_up is not None and missed > self.max_catch_up:
+                    self.deadline += (missed - self.max_catch_up) * self.period
+                    self.skipped += missed - self.max_catch_up
+                delay = 0
+        self.deadline += self.period
+        self.slack += delay
+        return delay
+
+    # Blocks until the next cycle is due, returning how long that was
+    def wait(self):
+        delay = self.next_delay()
+        if delay <= 0:
+            return delay
+        target = self.deadline - self.period # when the next cycle is due
+        if delay > self.spin:
+            self.sleep(delay - self.spin)
+        if self.spin:
+            while self.clock() < target:
+                pass
+        return delay
+
+    # Returns the nominal and achieved rates and overrun counts so far
+    def stats(self):
+        elapsed = self.clock() - self.started if self.started is not None else 0
+        return {"nominal_rate": self.rate, "achieved_rate": self.cycles / elapsed if elapsed > 0 else 0.0, "cycles": self.cycles,
+                "overruns": self.overruns, "skipped": self.skipped, "slack": self.slack}
@@ -0,0 +1,101 @@
+import unittest
+from unittest import mock
+import time
+import scheduler
+from scheduler import TickScheduler
+
+# Clock that only advances when told to, recording how long the scheduler sleeps
+class FakeClock():
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class TestTickScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def make(self, rate, **options):
+        s = TickScheduler(rate, clock=self.clock, sleep=self.clock.sleep, **options)
+        s.begin()
+        return s
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            TickScheduler(5, policy="panic")
+
+    def test_deadlines_do_not_drift(self):
+        s = self.make(4)
+        for work in (0.05, 0.1, 0.2, 0.0):
+            self.clock.now += work
+            s.wait()
+        self.assertAlmostEqual(101.0, self.clock.now)
+        self.assertEqual(0, s.overruns)
+        self.assertAlmostEqual(0.65, s.slack)
+
+    def test_overrun_does_not_sleep_negative(self):
+        s = self.make(10, policy=scheduler.POLICY_CATCH_UP)
+        self.clock.now += 0.35 # cycle 0 overruns into cycle 3's slot
+        s.wait()
+        self.assertEqual([], self.clock.sleeps)
+        self.assertEqual(1, s.overruns)
+        s.wait() # cycles 1 and 2 are caught up back to back
+        s.wait()
+        self.assertEqual([], self.clock.sleeps)
+        s.wait()
+        self.assertAlmostEqual(0.05, self.clock.sleeps[0])
+        self.assertAlmostEqual(100.4, self.clock.now)
+        self.assertEqual(0, s.skipped)
+
+    def test_catch_up_is_bounded(self):
+        s = self.make(10, policy=scheduler.POLICY_CATCH_UP, max_catch_up=1)
+        self.clock.now += 0.55
+        s.wait()
+        self.assertEqual(3, s.skipped)
+        s.wait()
+        self.assertEqual([], self.clock.sleeps)
+        s.wait()
+        self.assertAlmostEqual(0.05, self.clock.sleeps[0])
+
+    def test_skip_keeps_phase(self):
+        s = self.make(10, policy=scheduler.POLICY_SKIP)
+        self.clock.now += 0.25 # cycles due at 100.1 and 100.2 are dropped
+        s.wait()
+        self.assertEqual(2, s.skipped)
+        self.assertAlmostEqual(100.3, self.clock.now)
+        self.clock.now += 0.01
+        s.wait()
+        self.assertAlmostEqual(100.4, self.clock.now)
+
+    def test_stats(self):
+        s = self.make(5)
+        for _ in range(10):
+            s.wait()
+        stats = s.stats()
+        self.assertEqual(10, stats["cycles"])
+        self.assertAlmostEqual(5, stats["achieved_rate"])
+        self.assertEqual(5, stats["nominal_rate"])
+
+    def test_uses_patched_time_functions(self):
+        with mock.patch("time.monotonic", return_value=3.0), mock.patch("time.sleep") as mock_sleep:
+            s = TickScheduler(2)
+            s.begin()
+            s.wait()
+            mock_sleep.assert_called_once_with(0.5)
+
+    def test_high_rate_is_honored(self):
+        s = TickScheduler(2000)
+        s.begin()
+        start = time.monotonic()
+        while time.monotonic() - start < 0.25:
+            s.wait()
+        self.assertAlmostEqual(2000, s.stats()["achieved_rate"], delta=100)
+
+if __name__ == '__main__':
+    unittest.main()
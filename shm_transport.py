@@ -0,0 +1,149 @@
+import os, struct, time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from framing import FRAME_HEADER
+
+
+# Frame kinds of the handshake and wakeups that travel over the TCP connection of a link whose
+# messages go through shared memory
+FRAME_SHM_ATTACH = 5 # payload: creator's resource tracker (>Q) then the shared memory name
+FRAME_SHM_DOORBELL = 6 # empty; wakes a reader that is waiting in select
+DOORBELL = FRAME_HEADER.pack(0, FRAME_SHM_DOORBELL)
+ATTACH = struct.Struct(">Q")
+
+DEFAULT_CAPACITY = 1 << 20
+
+# Ring layout: write position, read position and the reader's waiting flag each on their own
+# cache line, then the data. Positions count bytes since the ring was created and only grow;
+# the writer alone updates the write position and the reader alone the read position, each with
+# a single aligned 8-byte store
+POSITION = struct.Struct("<Q")
+WRITE_AT, READ_AT, WAITING_AT, CAPACITY_AT = 0, 64, 128, 136
+DATA_AT = 192
+
+
+# Single-producer single-consumer byte ring in a shared memory segment. It carries the same
+# byte stream a socket would, so senders and FrameDecoders work on it unchanged
+class ShmRing():
+    def __init__(self, shm):
+        self.shm = shm
+        self.buf = shm.buf
+        self.capacity = POSITION.unpack_from(self.buf, CAPACITY_AT)[0]
+        self.data = self.buf[DATA_AT:DATA_AT + self.capacity]
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY):
+        shm = SharedMemory(create=True, size=DATA_AT + capacity)
+        shm.buf[:DATA_AT] = bytes(DATA_AT)
+        POSITION.pack_into(shm.buf, CAPACITY_AT, capacity)
+        return cls(shm)
+
+    # Attaches to a ring created by another machine. Python registers attached segments with
+    # the attaching process's resource tracker as well, which would unlink the segment when this
+    # process exits; if that tracker is not the creator's, it should not track the segment
+    @classmethod
+    def attach(cls, name, creator_tracker):
+        shm = SharedMemory(name)
+        if creator_tracker != _tracker_id():
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def pending(self):
+        return POSITION.unpack_from(self.buf, WRITE_AT)[0] - POSITION.unpack_from(self.buf, READ_AT)[0]
+
+    # Writes as much of data as fits, returning the number of bytes written
+    def write(self, data):
+        head = POSITION.unpack_from(self.buf, WRITE_AT)[0]
+        free = self.capacity - (head - POSITION.unpack_from(self.buf, READ_AT)[0])
+        n = min(free, len(data))
+        if n:
+            start = head % self.capacity
+            first = min(n, self.capacity - start)
+            self.data[start:start + first] = data[:first]
+            self.data[:n - first] = data[first:n]
+            POSITION.pack_into(self.buf, WRITE_AT, head + n) # publish only after the bytes are in place
+        return n
+
+    # Returns every byte available to read
+    def read(self):
+        tail = POSITION.unpack_from(self.buf, READ_AT)[0]
+        n = POSITION.unpack_from(self.buf, WRITE_AT)[0] - tail
+        if not n:
+            return b""
+        start = tail % self.capacity
+        first = min(n, self.capacity - start)
+        data = bytes(self.data[start:start + first]) + bytes(self.data[:n - first])
+        POSITION.pack_into(self.buf, READ_AT, tail + n)
+        return data
+
+    # The reader sets the waiting flag before it blocks, and a writer that finds it set clears
+    # it and rings the doorbell, so wakeups cost a syscall only when the reader is idle
+    def set_waiting(self):
+        self.buf[WAITING_AT] = 1
+
+    def take_waiting(self):
+        if self.buf[WAITING_AT]:
+            self.buf[WAITING_AT] = 0
+            return True
+        return False
+
+    def close(self):
+        self.data.release()
+        self.buf = None
+        self.shm.close()
+
+
+# Sending side of a shared memory link to a machine on the same host, with the sendall
+# interface of a socket. The peer is told where the ring is over the (framed) TCP connection,
+# which then only carries doorbells
+class ShmLink():
+    def __init__(self, sock, capacity=DEFAULT_CAPACITY):
+        self.sock = sock
+        self.ring = ShmRing.create(capacity)
+        sock.sendall(_frame(FRAME_SHM_ATTACH, ATTACH.pack(_tracker_id()) + self.ring.name.encode()))
+
+    # Blocks until all of data is in the ring. A full ring means the reader is behind, so the
+    # sender waits for it like a blocking socket would, ringing the doorbell in case it is asleep
+    def sendall(self, data):
+        view = memoryview(data)
+        while view:
+            n = self.ring.write(view)
+            view = view[n:]
+            if view:
+                self.sock.sendall(DOORBELL)
+                time.sleep(0.0001)
+        if self.ring.take_waiting():
+            self.sock.sendall(DOORBELL)
+
+    def close(self):
+        self.ring.close()
+        self.ring.shm.unlink()
+        self.sock.close()
+
+
+# Whether sock connects two endpoints on this host, so that its peer can share memory with us
+def is_local(sock):
+    peer, local = sock.getpeername()[0], sock.getsockname()[0]
+    return peer == local or peer.startswith("127.") or peer == "::1"
+
+
+# Returns handlers for a FrameDecoder of the TCP side of a link, calling attached(ring) when
+# the peer moves the link to shared memory
+def link_handlers(attached):
+    def attach(payload):
+        attached(ShmRing.attach(payload[ATTACH.size:].decode(), ATTACH.unpack_from(payload)[0]))
+    return {FRAME_SHM_ATTACH: attach, FRAME_SHM_DOORBELL: lambda payload: None}
+
+
+def _frame(kind, payload):
+    return FRAME_HEADER.pack(len(payload), kind) + payload
+
+
+# Identifies this process's resource tracker by the inode of the pipe it reads, which every
+# process sharing the tracker has open
+def _tracker_id():
+    return os.fstat(resource_tracker.getfd()).st_ino
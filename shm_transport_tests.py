@@ -0,0 +1,98 @@
+import unittest
+from unittest import mock
+import io
+import threading
+import time
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+import machine
+import shm_transport
+from async_machine_tests import free_ports
+from message_queue import MessageQueue
+from shm_transport import ShmRing
+
+# Runs a Server on port in a daemon thread and returns its message queue
+def start_server(port):
+    messages = MessageQueue()
+    server = machine.Server(["127.0.0.1", port], messages)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server, messages
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+# Child process sending stamps 1..n to port through a shared memory link
+def send_from_other_process(port, n):
+    with redirect_stdout(io.StringIO()):
+        client = machine.Client(["127.0.0.1", 0, port], MessageQueue(), log=mock.Mock(), shm=True)
+    for i in range(n):
+        client.write_message([port])
+    time.sleep(0.2)
+    client.connections[port].close()
+
+class TestShmRing(unittest.TestCase):
+    def setUp(self):
+        self.ring = ShmRing.create(16)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.shm.unlink()
+
+    def test_wraps_around(self):
+        reader = ShmRing.attach(self.ring.name, shm_transport._tracker_id())
+        self.assertEqual(16, reader.capacity)
+        for chunk in (b"0123456789", b"abcdefghij", b"KLMNOPQRST"):
+            self.assertEqual(10, self.ring.write(chunk))
+            self.assertEqual(chunk, reader.read())
+        self.assertEqual(b"", reader.read())
+        reader.close()
+
+    def test_full_ring_takes_what_fits(self):
+        self.assertEqual(16, self.ring.write(b"x" * 20))
+        self.assertEqual(0, self.ring.write(b"y"))
+        self.assertEqual(16, self.ring.pending())
+        self.assertEqual(b"x" * 16, self.ring.read())
+        self.assertEqual(1, self.ring.write(b"y"))
+
+    def test_waiting_flag(self):
+        self.assertFalse(self.ring.take_waiting())
+        self.ring.set_waiting()
+        self.assertTrue(self.ring.take_waiting())
+        self.assertFalse(self.ring.take_waiting())
+
+class TestShmLink(unittest.TestCase):
+    def test_local_peers_use_shared_memory(self):
+        port, = free_ports(1)
+        server, messages = start_server(port)
+        with redirect_stdout(io.StringIO()):
+            client = machine.Client(["127.0.0.1", 0, port], MessageQueue(), log=mock.Mock(), shm=True, shm_capacity=64)
+        link = client.connections[port]
+        self.assertIsInstance(link, shm_transport.ShmLink)
+        for _ in range(100): # more than the ring holds at once, so the sender has to wait for the reader
+            client.write_message([port])
+        self.assertTrue(wait_for(lambda: len(messages) == 100))
+        self.assertEqual(list(range(1, 101)), [messages.pop() for _ in range(100)])
+        self.assertTrue(wait_for(lambda: link.ring.buf[shm_transport.WAITING_AT] == 1)) # the server went idle
+        sock, link.sock = link.sock, mock.Mock(wraps=link.sock)
+        client.write_message([port])
+        link.sock.sendall.assert_called_once_with(shm_transport.DOORBELL)
+        link.sock = sock
+        self.assertTrue(wait_for(lambda: len(messages) == 1))
+        link.close()
+        self.assertTrue(wait_for(lambda: not server.rings))
+
+    def test_messages_from_another_process(self):
+        port, = free_ports(1)
+        _, messages = start_server(port)
+        process = get_context("spawn").Process(target=send_from_other_process, args=(port, 500))
+        process.start()
+        self.assertTrue(wait_for(lambda: len(messages) == 500, timeout=20))
+        process.join(10)
+        self.assertEqual(0, process.exitcode)
+        self.assertEqual(list(range(1, 501)), list(messages))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import argparse, heapq, itertools, os, random
+from datetime import datetime
+from machine import Client
+from logsink import LogSink
+from message_queue import MessageQueue
+from framing import FRAMED_MAGIC
+from clocks import CLOCK_LAMPORT, CLOCK_MODES, needs_frames, new_decoder
+from cluster import make_configs, TOPOLOGIES
+
+
+# Virtual wall-clock time at which simulations start, so that logs do not depend on when they were produced
+DEFAULT_START = datetime(2000, 1, 1)
+
+
+# In-memory link with the sendall interface of a socket. Bytes sent over it are decoded like
+# on a real connection and enqueued at the receiving machine after latency virtual seconds
+class SimLink():
+    def __init__(self, sim, messages, latency=0.0, framed=False):
+        self.sim = sim
+        self.messages = messages
+        self.latency = latency
+        self.decoder = new_decoder()
+        self.bytes_sent = 0
+        if framed: # stands in for the magic a real connection opens with
+            self.decoder.feed(FRAMED_MAGIC)
+
+    def sendall(self, data):
+        self.bytes_sent += len(data)
+        self.sim.schedule(self.sim.now + self.latency, self.deliver, bytes(data)) # senders reuse their buffers
+
+    def deliver(self, data):
+        self.messages.put_many(self.decoder.feed(data))
+
+
+# Deterministic discrete-event simulation of a cluster. Each machine runs the unchanged Client
+# logic with its own seeded random generator, clock cycles and message deliveries are events
+# in a priority queue ordered by virtual time, and nothing ever sleeps or touches a socket.
+# The same configs, seed and options always produce byte-identical logs
+class Simulation():
+    def __init__(self, configs, seed=0, latency=0.0, log_options=None, client_options=None, queue_size=None, overflow="block", start=DEFAULT_START):
+        self.now = 0.0 # virtual seconds since the start of the simulation
+        self.start_ns = int(start.timestamp()) * 10**9
+        self.events = [] # heap of (virtual time, sequence number, callback, argument)
+        self.sequence = itertools.count() # breaks ties between simultaneous events in scheduling order
+        log_options = log_options or {}
+        client_options = client_options or {}
+
+        framed = client_options.get("framed", False) or needs_frames(client_options.get("clock_mode", CLOCK_LAMPORT), client_options.get("message_ids", False))
+        queues = {config[1]: MessageQueue(queue_size, overflow) for config in configs}
+        self.clients = []
+        for config in configs:
+            port = config[1]
+            connections = {peer: SimLink(self, queues[peer], latency, framed) for peer in config[2:]}
+            log = LogSink.for_machine(port, clock=self.wall_ns, **log_options)
+            rng = random.Random(f"{seed}:{port}")
+            self.clients.append(Client(config, queues[port], log, connections=connections, rng=rng, wall_clock=self.wall_ns, **client_options))
+
+    # Virtual wall time in ns, used to stamp log records
+    def wall_ns(self):
+        return self.start_ns + round(self.now * 1e9)
+
+    # Schedules callback(argument) to run at virtual time t
+    def schedule(self, t, callback, argument=None):
+        heapq.heappush(self.events, (t, next(self.sequence), callback, argument))
+
+    # Runs one clock cycle of a client and schedules its next one. Cycle times are computed
+    # from the cycle count rather than accumulated, so they do not drift
+    def _cycle(self, state):
+        client, count = state
+        client.step()
+        self.schedule((count + 1) / client.tick, self._cycle, (client, count + 1))
+
+    # Runs the simulation for duration virtual seconds, then flushes and closes all logs
+    def run(self, duration):
+        for client in self.clients:
+            self.schedule(0.0, self._cycle, (client, 0))
+        events = self.events
+        try:
+            while events and events[0][0] < duration:
+                self.now, _, callback, argument = heapq.heappop(events)
+                callback(argument)
+        finally:
+            for client in self.clients:
+                client.log.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate a cluster of logical clock machines in virtual time")
+    parser.add_argument("-n", "--machines", type=int, default=3)
+    parser.add_argument("--topology", choices=TOPOLOGIES, default="mesh")
+    parser.add_argument("-k", "--degree", type=int, default=3, help="degree of the random topology")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--duration", type=float, default=60, help="virtual seconds to simulate")
+    parser.add_argument("--latency", type=float, default=0.0, help="virtual seconds between a send and its delivery")
+    parser.add_argument("--clock", choices=CLOCK_MODES, default=CLOCK_LAMPORT, help="logical clock each machine keeps")
+    parser.add_argument("--log-dir", default=".")
+    args = parser.parse_args()
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    configs = make_configs(args.machines, args.topology, k=args.degree, seed=args.seed)
+    Simulation(configs, args.seed, args.latency, {"directory": args.log_dir}, {"clock_mode": args.clock}).run(args.duration)
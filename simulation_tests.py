@@ -0,0 +1,63 @@
+import unittest
+import io
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+import cluster
+import simulation
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def run_simulation(self, directory, seed=1, duration=60, configs=None, **options):
+        os.makedirs(directory, exist_ok=True)
+        sim = simulation.Simulation(configs or cluster.make_configs(3), seed, log_options={"directory": directory}, **options)
+        with redirect_stdout(io.StringIO()):
+            sim.run(duration)
+        logs = {}
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name)) as f:
+                logs[name] = f.read()
+        return sim, logs
+
+    def test_same_seed_gives_identical_logs(self):
+        _, first = self.run_simulation(os.path.join(self.dir.name, "a"))
+        _, second = self.run_simulation(os.path.join(self.dir.name, "b"))
+        self.assertEqual(["log11113.txt", "log11114.txt", "log11115.txt"], list(first))
+        self.assertEqual(first, second)
+        _, other = self.run_simulation(os.path.join(self.dir.name, "c"), seed=2)
+        self.assertNotEqual(first, other)
+
+    def test_cycles_follow_tick_rate(self):
+        sim, logs = self.run_simulation(self.dir.name, duration=100)
+        for client in sim.clients:
+            lines = logs[f"log{client.config[1]}.txt"].splitlines()
+            clocks = {line.split("logical clock time ")[1].split(",")[0] for line in lines} # broadcasts log one line per machine
+            self.assertEqual(100 * client.tick, len(clocks))
+            self.assertIn("system time 00:00:00", lines[0])
+            self.assertIn("system time 00:01:39", lines[-1])
+
+    def test_messages_are_conserved(self):
+        sim, logs = self.run_simulation(self.dir.name, duration=300, configs=cluster.make_configs(5, "ring"))
+        sent = sum(text.count("Sent a message") for text in logs.values())
+        received = sum(text.count("Received a message") for text in logs.values())
+        queued = sum(len(client.messages) for client in sim.clients)
+        in_flight = len([event for event in sim.events if event[2].__name__ == "deliver"])
+        self.assertEqual(sent, received + queued + in_flight)
+
+    def test_latency_delays_delivery(self):
+        sim, logs = self.run_simulation(self.dir.name, duration=1, latency=10)
+        self.assertFalse(any("Received" in text for text in logs.values()))
+
+    def test_hour_of_cluster_time_runs_fast(self):
+        start = time.monotonic()
+        self.run_simulation(self.dir.name, duration=3600)
+        self.assertLess(time.monotonic() - start, 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import argparse, asyncio, csv, io, itertools, os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from cluster import make_configs, TOPOLOGIES
+from simulation import Simulation
+from async_machine import AsyncMachine, run_machines
+from logsink import parse_record, EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+
+
+# Parameters varied by a sweep, in the order they appear in the results table
+GRID_KEYS = ("tick_range", "event_weights", "machines", "topology", "seed")
+RESULT_FIELDS = ("run", "tick_range", "event_weights", "machines", "topology", "seed", "machine", "cycles_per_second",
+                 "received", "sent", "internal", "final_clock", "mean_jump", "max_jump", "max_queue", "clock_spread")
+
+
+# Returns one run (a dict of parameters plus its run number) per point of the grid,
+# which maps each of GRID_KEYS to the list of values to try
+def expand_grid(grid, duration):
+    runs = []
+    for i, values in enumerate(itertools.product(*(grid[key] for key in GRID_KEYS))):
+        run = dict(zip(GRID_KEYS, values), run=i, duration=duration)
+        runs.append(run)
+    return runs
+
+
+# Summarizes one machine's text log: cycles per second, event counts, final logical clock,
+# logical clock jumps between consecutive cycles and the largest message queue size seen
+def summarize_log(path, duration):
+    counts = {EVENT_RECEIVED: 0, EVENT_SENT: 0, EVENT_INTERNAL: 0}
+    cycles, clock, jumps, max_jump, max_queue = 0, 0, 0, 0, 0
+    with open(path) as f:
+        for line in f:
+            record = parse_record(line)
+            if record is None:
+                continue
+            event, _, new_clock, queue_depth = record
+            counts[event] += 1
+            if new_clock == clock: # the extra lines of a broadcast repeat the same clock
+                continue
+            cycles += 1
+            jumps += new_clock - clock
+            max_jump = max(max_jump, new_clock - clock)
+            clock = new_clock
+            if queue_depth is not None:
+                max_queue = max(max_queue, queue_depth)
+    return {"cycles_per_second": round(cycles / duration, 3), "received": counts[EVENT_RECEIVED], "sent": counts[EVENT_SENT],
+            "internal": counts[EVENT_INTERNAL], "final_clock": clock, "mean_jump": round(jumps / cycles, 3) if cycles else 0,
+            "max_jump": max_jump, "max_queue": max_queue}
+
+
+# Executes one run in its own log directory and returns one result row per machine. "sim" runs
+# use the virtual-time simulation; "live" runs use real sockets on the run's own port range
+def run_one(run, out_dir, mode="sim", base_port=20000, port_stride=64):
+    directory = os.path.join(out_dir, f"run{run['run']:04d}")
+    os.makedirs(directory, exist_ok=True)
+    configs = make_configs(run["machines"], run["topology"], base_port + run["run"] * port_stride, "127.0.0.1", seed=run["seed"])
+    client_options = {"tick_range": run["tick_range"], "event_weights": run["event_weights"]}
+    with redirect_stdout(io.StringIO()): # machines print their connections and tick rates
+        if mode == "sim":
+            Simulation(configs, run["seed"], log_options={"directory": directory}, client_options=client_options).run(run["duration"])
+        else:
+            machines = [AsyncMachine(config, {"directory": directory}, client_options=client_options) for config in configs]
+            asyncio.run(run_machines(machines, run["duration"]))
+
+    rows = [dict(run, machine=config[1], **summarize_log(os.path.join(directory, f"log{config[1]}.txt"), run["duration"])) for config in configs]
+    spread = max(row["final_clock"] for row in rows) - min(row["final_clock"] for row in rows)
+    for row in rows:
+        row["clock_spread"] = spread
+    return rows
+
+
+# Fans all runs of the grid out over a process pool and writes their rows to out_dir/results.csv
+def run_sweep(grid, out_dir, duration=60, mode="sim", workers=None, base_port=20000):
+    os.makedirs(out_dir, exist_ok=True)
+    runs = expand_grid(grid, duration)
+    port_stride = max(grid["machines"])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(run_one, runs, itertools.repeat(out_dir), itertools.repeat(mode), itertools.repeat(base_port), itertools.repeat(port_stride))
+        rows = [row for run_rows in results for row in run_rows]
+    path = os.path.join(out_dir, "results.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, RESULT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, tick_range="-".join(map(str, row["tick_range"])), event_weights="/".join(map(str, row["event_weights"]))))
+    return path
+
+
+# Parses "low-high" into a tick range and "a,b,c" into event weights
+def _int_tuple(separator):
+    return lambda text: tuple(int(part) for part in text.split(separator))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a grid of machine experiments in parallel")
+    parser.add_argument("--ticks", type=_int_tuple("-"), nargs="+", default=[(1, 6)], help="tick rate ranges, e.g. 1-6 1-3")
+    parser.add_argument("--weights", type=_int_tuple(","), nargs="+", default=[(2, 1, 7)], help="send one, send all and internal event weights, e.g. 2,1,7 2,1,2")
+    parser.add_argument("--machines", type=int, nargs="+", default=[3])
+    parser.add_argument("--topology", choices=TOPOLOGIES, nargs="+", default=["mesh"])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    parser.add_argument("--duration", type=float, default=60, help="seconds per run (virtual seconds in sim mode)")
+    parser.add_argument("--mode", choices=("sim", "live"), default="sim")
+    parser.add_argument("--workers", type=int, default=None, help="parallel runs (default: one per core)")
+    parser.add_argument("--base-port", type=int, default=20000, help="first listening port of live runs")
+    parser.add_argument("--out", default="sweep")
+    args = parser.parse_args()
+
+    grid = {"tick_range": args.ticks, "event_weights": args.weights, "machines": args.machines, "topology": args.topology, "seed": args.seeds}
+    print(run_sweep(grid, args.out, args.duration, args.mode, args.workers, args.base_port))
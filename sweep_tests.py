@@ -0,0 +1,41 @@
+import unittest
+import csv
+import os
+import tempfile
+import sweep
+
+class TestSweep(unittest.TestCase):
+    def test_expand_grid(self):
+        grid = {"tick_range": [(1, 6), (1, 3)], "event_weights": [(2, 1, 7)], "machines": [3, 5], "topology": ["mesh"], "seed": [0, 1, 2]}
+        runs = sweep.expand_grid(grid, 30)
+        self.assertEqual(12, len(runs))
+        self.assertEqual(list(range(12)), [run["run"] for run in runs])
+        self.assertEqual({"tick_range": (1, 6), "event_weights": (2, 1, 7), "machines": 3, "topology": "mesh", "seed": 0, "run": 0, "duration": 30}, runs[0])
+
+    def test_summarize_log(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("Internal event: system time 10:46:41, logical clock time 1\n"
+                    "Sent a message: system time 10:46:41, logical clock time 2\n"
+                    "Sent a message: system time 10:46:41, logical clock time 2\n"
+                    "Received a message: system time 10:46:42, logical clock time 9, remaining message queue size 3\n")
+        try:
+            summary = sweep.summarize_log(f.name, 2)
+        finally:
+            os.unlink(f.name)
+        self.assertEqual({"cycles_per_second": 1.5, "received": 1, "sent": 2, "internal": 1, "final_clock": 9, "mean_jump": 3.0, "max_jump": 7, "max_queue": 3}, summary)
+
+    def test_run_sweep_writes_one_row_per_machine(self):
+        grid = {"tick_range": [(1, 6), (2, 2)], "event_weights": [(2, 1, 7), (2, 1, 2)], "machines": [3], "topology": ["mesh"], "seed": [0, 1]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = sweep.run_sweep(grid, directory, duration=20, workers=2)
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(8 * 3, len(rows))
+            self.assertEqual(8, len([name for name in os.listdir(directory) if name.startswith("run")]))
+            fixed_tick = [row for row in rows if row["tick_range"] == "2-2"]
+            self.assertTrue(all(float(row["cycles_per_second"]) == 2 for row in fixed_tick))
+            again = sweep.run_one(sweep.expand_grid(grid, 20)[0], os.path.join(directory, "again"))
+            self.assertEqual([row["final_clock"] for row in rows[:3]], [str(row["final_clock"]) for row in again])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import argparse, json, os
+from collections import namedtuple
+from fractions import Fraction
+from math import gcd, lcm
+from logsink import parse_record, read_binary_log, EVENT_SENT, EVENT_INTERNAL
+
+
+# What a machine does in a clock cycle that finds no message to read. Draws and replayed traces
+# hold these codes, and a phase's event table holds each code as many times as its weight
+SEND_ONE, SEND_ALL, INTERNAL = 0, 1, 2
+EVENTS = ("send_one", "send_all", "internal")
+DEFAULT_WEIGHTS = (2, 1, 7) # the original 2/10, 1/10 and 7/10
+WEIGHT_PRECISION = 1000 # weights are exact to 1/WEIGHT_PRECISION, e.g. probabilities such as 0.125
+MAX_TABLE = 1 << 16 # longest event or target table, so that drawing from one stays a single index
+
+
+# A workload spec is JSON (or the equivalent dict) describing the events of every machine:
+#   {"weights": {"send_one": 2, "send_all": 1, "internal": 7},  (or a list in that order)
+#    "targets": {"22224": 3, "33335": 1},          weights of the peers single messages go to (default: equal)
+#    "tick": [1, 6],                               tick rate range, overriding the client's tick_range (not per phase)
+#    "machines": {"11113": {"weights": [1, 0, 9], "replay": "base_logs/base1_log11113.txt"}},
+#    "phases": [{"cycle": 600, "weights": [4, 4, 2], "machines": {"22224": {"targets": {"11113": 1}}}}]}
+# Keys given for a machine override the top-level ones for that machine, and every phase, from
+# its clock cycle on, overrides weights and targets given before it. A replay (a text or binary
+# log, or a columnar table as {"path": ..., "machine": port}) only holds for the phase that names
+# it: the machine repeats the recorded events in order, then goes back to drawing from its weights.
+# Text and binary logs do not record where single messages went, so their targets are still drawn
+Phase = namedtuple("Phase", "start events targets trace trace_targets")
+
+
+# A spec compiled for one machine: its phases, ordered by first clock cycle, each with an event
+# table and a target table to draw uniformly from (see Client._draw) and possibly a trace to replay
+class Workload():
+    def __init__(self, phases, tick_range=None):
+        self.phases = phases
+        self.tick_range = tick_range
+
+    # Returns the index of the phase clock cycle `cycle` belongs to
+    def phase_at(self, cycle):
+        k = 0
+        while k + 1 < len(self.phases) and self.phases[k + 1].start <= cycle:
+            k += 1
+        return k
+
+
+# Reads a JSON workload spec
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Returns a table holding each value as many times as its weight, with the weights scaled to the
+# smallest whole numbers in the same proportions
+def table(weights, values):
+    fractions = [Fraction(w).limit_denominator(WEIGHT_PRECISION) for w in weights]
+    if any(f < 0 for f in fractions) or not any(fractions):
+        raise ValueError(f"weights must be non-negative and not all 0, got {list(weights)}")
+    scale = lcm(*(f.denominator for f in fractions))
+    counts = [int(f * scale) for f in fractions]
+    divisor = gcd(*counts)
+    if sum(counts) // divisor > MAX_TABLE:
+        raise ValueError(f"weights {list(weights)} need a table of more than {MAX_TABLE} entries, give them with fewer decimals")
+    return [value for value, count in zip(values, counts) for _ in range(count // divisor)]
+
+
+def _weights(spec):
+    weights = spec.get("weights", DEFAULT_WEIGHTS)
+    if isinstance(weights, dict):
+        unknown = set(weights) - set(EVENTS)
+        if unknown:
+            raise ValueError(f"unknown events {sorted(unknown)}, expected some of {EVENTS}")
+        return [weights.get(event, 0) for event in EVENTS]
+    if len(weights) != len(EVENTS):
+        raise ValueError(f"weights {list(weights)} should give {len(EVENTS)} values, for {EVENTS}")
+    return list(weights)
+
+
+# The listening port of a peer, which identifies its machine, as a string like the keys of a spec
+def _port(peer):
+    return str(peer).rpartition(":")[2]
+
+
+def _targets(spec, peers):
+    if "targets" not in spec:
+        return list(peers)
+    targets = {_port(peer): weight for peer, weight in spec["targets"].items()}
+    return table([targets.get(_port(peer), 0) for peer in peers], peers) if peers else []
+
+
+# Compiles spec for the machine listening on port, which sends to peers
+def compile(spec, port, peers):
+    machines = spec.get("machines", {})
+    settings = dict(spec, **machines.get(str(port), {}))
+    tick_range = tuple(settings["tick"]) if "tick" in settings else None
+    starts = [(0, settings)]
+    for phase in sorted(spec.get("phases", []), key=lambda phase: phase["cycle"]):
+        settings = {key: value for key, value in settings.items() if key != "replay"}
+        settings.update(phase)
+        settings.update(phase.get("machines", {}).get(str(port), {}))
+        starts.append((phase["cycle"], settings))
+    phases = []
+    for start, settings in starts:
+        trace = trace_targets = None
+        if settings.get("replay"):
+            trace, trace_targets = read_trace(settings["replay"], peers)
+        weights = _weights(settings)
+        phases.append(Phase(start, table(weights, range(len(EVENTS))), _targets(settings, peers) if weights[SEND_ONE] else list(peers), trace, trace_targets))
+    return Workload(phases, tick_range)
+
+
+# The workload of a machine configured only with event_weights, as (send one, send all, internal)
+def from_weights(event_weights, port, peers):
+    return compile({"weights": list(event_weights)}, port, peers)
+
+
+# Returns the events a machine performed in the clock cycles without a message to read, recorded
+# in a log, and the peers its single messages went to if the log knows them (else None). A cycle
+# that sent several records with the same clock was a broadcast
+def read_trace(replay, peers):
+    path, machine = (replay["path"], replay.get("machine")) if isinstance(replay, dict) else (replay, None)
+    events, targets = [], []
+    sends = last_clock = last_peer = None
+    for event, clock, peer in _records(path, machine):
+        if sends is not None and not (event == EVENT_SENT and clock == last_clock):
+            events.append(SEND_ONE if sends == 1 else SEND_ALL)
+            if sends == 1:
+                targets.append(last_peer)
+            sends = None
+        if event == EVENT_SENT:
+            sends, last_clock, last_peer = (sends or 0) + 1, clock, peer
+        elif event == EVENT_INTERNAL:
+            events.append(INTERNAL)
+    if sends is not None:
+        events.append(SEND_ONE if sends == 1 else SEND_ALL)
+        if sends == 1:
+            targets.append(last_peer)
+    by_port = {int(_port(peer)): peer for peer in peers}
+    if targets and all(target in by_port for target in targets):
+        return events, [by_port[target] for target in targets]
+    return events, None
+
+
+# Yields (event, logical clock, peer or 0) for the records of a log, or of one machine of a
+# columnar table (the first machine in it by default)
+def _records(path, machine):
+    if path.rstrip(os.sep).endswith(".cols"):
+        from columnar import load as load_table
+        columns = load_table(path)
+        machines = columns["machine"]
+        if machine is None and len(columns):
+            machine = int(machines[0])
+        for m, event, clock, peer in zip(machines, columns["event"], columns["clock"], columns["peer"]):
+            if m == machine:
+                yield int(event), int(clock), int(peer)
+    elif path.endswith(".bin"):
+        for event, _, clock, _ in read_binary_log(path):
+            yield event, clock, 0
+    else:
+        with open(path, errors="replace") as f:
+            for record in map(parse_record, f):
+                if record is not None:
+                    yield record[0], record[2], 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Show what a workload spec compiles to for each machine of a cluster")
+    parser.add_argument("spec", help="JSON workload spec")
+    parser.add_argument("ports", type=int, nargs="+", help="listening ports of the cluster's machines, e.g. 11113 22224 33335")
+    args = parser.parse_args()
+
+    spec = load(args.spec)
+    for port in args.ports:
+        workload = compile(spec, port, [peer for peer in args.ports if peer != port])
+        print(f"machine {port}" + (f", tick rate {workload.tick_range[0]}-{workload.tick_range[1]}" if workload.tick_range else ""))
+        for phase in workload.phases:
+            events = ", ".join(f"{name} {phase.events.count(code) / len(phase.events):.3f}" for code, name in enumerate(EVENTS))
+            targets = ", ".join(f"{peer} {phase.targets.count(peer) / len(phase.targets):.3f}" for peer in dict.fromkeys(phase.targets))
+            replay = f", replaying {len(phase.trace)} recorded events first" if phase.trace is not None else ""
+            print(f"  from cycle {phase.start}: {events}; targets {targets or 'none'}{replay}")
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+import io
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+import columnar
+import logsink
+import workload
+from logsink import EVENT_RECEIVED, EVENT_SENT, EVENT_INTERNAL
+from machine import Client
+from message_queue import MessageQueue
+from workload import SEND_ONE, SEND_ALL, INTERNAL
+
+class TestWorkload(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def test_table(self):
+        self.assertEqual([SEND_ONE, SEND_ONE, SEND_ALL] + [INTERNAL] * 7, workload.table([2, 1, 7], range(3)))
+        self.assertEqual(["a", "b", "b", "b"], workload.table([0.25, 0.75], ["a", "b"]))
+        self.assertEqual(["a", "b"], workload.table([40, 40], ["a", "b"]))
+        for weights in ([0, 0], [1, -1], [0.001, 65.537]):
+            with self.subTest(weights=weights), self.assertRaises(ValueError):
+                workload.table(weights, ["a", "b"])
+
+    def test_compile(self):
+        spec = {"weights": {"send_one": 1, "internal": 1}, "tick": [2, 3], "targets": {"22224": 3, "33335": 1},
+                "machines": {"11113": {"weights": [0, 1, 1]}, "22224": {"tick": [6, 6]}},
+                "phases": [{"cycle": 50, "machines": {"22224": {"targets": {"11113": 1}}}}, {"cycle": 10, "weights": [1, 0, 0]}]}
+        first = workload.compile(spec, 11113, [22224, 33335])
+        self.assertEqual((2, 3), first.tick_range)
+        self.assertEqual([(0, [SEND_ALL, INTERNAL]), (10, [SEND_ONE]), (50, [SEND_ONE])], [(phase.start, phase.events) for phase in first.phases])
+        self.assertEqual([22224, 22224, 22224, 33335], first.phases[1].targets)
+        second = workload.compile(spec, 22224, [11113, "10.0.0.3:33335"])
+        self.assertEqual((6, 6), second.tick_range)
+        self.assertEqual([SEND_ONE, INTERNAL], second.phases[0].events)
+        self.assertEqual(["10.0.0.3:33335"], second.phases[0].targets)
+        self.assertEqual([11113], second.phases[2].targets)
+        self.assertEqual([0, 0, 1, 1, 2], [first.phase_at(cycle) for cycle in (0, 9, 10, 49, 50)])
+        with self.assertRaises(ValueError):
+            workload.compile({"weights": {"sleep": 1}}, 11113, [22224])
+
+    def test_read_trace(self):
+        with logsink.LogSink(self.path("log11113.txt")) as sink:
+            for event, clock in ((EVENT_INTERNAL, 1), (EVENT_SENT, 2), (EVENT_RECEIVED, 5), (EVENT_SENT, 6), (EVENT_SENT, 6), (EVENT_SENT, 7)):
+                sink.record(event, clock)
+        self.assertEqual(([INTERNAL, SEND_ONE, SEND_ALL, SEND_ONE], None), workload.read_trace(self.path("log11113.txt"), [22224, 33335]))
+        with columnar.ColumnarSink(self.path("run.cols"), 11113) as sink:
+            sink.record(EVENT_SENT, 1, peer=33335)
+            sink.record(EVENT_SENT, 2, peer=33335)
+            sink.record(EVENT_SENT, 2, peer=22224)
+            sink.record(EVENT_SENT, 3, peer=22224)
+        self.assertEqual(([SEND_ONE, SEND_ALL, SEND_ONE], ["h:33335", 22224]), workload.read_trace({"path": self.path("run.cols"), "machine": 11113}, [22224, "h:33335"]))
+
+    def test_client_replays_then_changes_phase(self):
+        with columnar.ColumnarSink(self.path("run.cols"), 11113) as sink:
+            sink.record(EVENT_SENT, 1, peer=33335)
+            sink.record(EVENT_INTERNAL, 2)
+        spec = {"weights": [1, 0, 0], "targets": {"22224": 1}, "replay": self.path("run.cols"), "phases": [{"cycle": 4, "weights": [0, 1, 0]}]}
+        links = {22224: mock.Mock(), 33335: mock.Mock()}
+        with redirect_stdout(io.StringIO()):
+            client = Client(["", 11113, 22224, 33335], MessageQueue(), mock.Mock(), connections=links, rng=random.Random(0), workload=spec)
+        sent = []
+        with mock.patch.object(client, "write_message", side_effect=lambda ports: sent.append(list(ports))), mock.patch.object(client, "internal_event") as mock_internal:
+            for _ in range(5):
+                client.step()
+        self.assertEqual([[33335], [22224], [22224], [22224, 33335]], sent) # the recorded target, then the spec's
+        mock_internal.assert_called_once()
+        self.assertIsNone(client.trace)
+
+if __name__ == '__main__':
+    unittest.main()